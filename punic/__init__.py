@@ -1,49 +1,70 @@
 from __future__ import division, absolute_import, print_function
 
 __version__ = '0.2.6'
-__all__ = ['Punic', 'current_session']
+__all__ = ['Punic']
 
+import multiprocessing
 import os
+import re
 from copy import copy
 from pathlib2 import Path
 import logging
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from functools import partial
+from networkx import topological_sort, descendants
 
 from .cartfile import Cartfile
 from .checkout import Checkout
-from .config import config
+from .config import Config
 from .repository import Repository, Revision
 from .resolver import Resolver, Node
-from .runner import runner
+from .tarball import TarballRepository
 from .specification import ProjectIdentifier, Specification, VersionPredicate, VersionOperator
-from .xcode import XcodeBuildArguments
+from .xcode import Xcodes, XcodeBuildArguments
+from .build_timing import BuildRecord
+from .scheduler import BuildScheduler
+from .artifact_store import ArtifactStore
+from .build_stamp import BuildStamp
 import punic.shshutil as shutil
-from .errors import NoSuchRevision
-
-current_session = None
-
+from .utilities import locked_paths
+from .errors import NoSuchRevision, PunicRepresentableError
 
 class Punic(object):
-    __slots__ = ['root_path', 'config', 'all_repositories', 'root_project']
-
-    def __init__(self, root_path=None):
-
-        global current_session
+    """A punic session.
 
-        if not current_session:
-            current_session = self
+    A session owns everything a resolve or build needs: its configuration, a runner (with its own concurrency limit,
+    result cache and ledger), the installed Xcodes, and the repositories and checkouts it has looked at. Sessions don't
+    share mutable state so several can be used at once, in different threads, in the same interpreter. Each session
+    needs its own config and runner, e.g. `Punic(config, config.make_runner())`."""
 
-        if not root_path:
-            root_path = Path.cwd()
+    __slots__ = ['root_path', 'config', 'runner', 'xcodes', 'all_repositories', 'all_checkouts', 'root_project', 'build_records', 'artifact_store', 'derived_data', '_submodule_status']
 
+    def __init__(self, config, runner):
+        # type: (Config, Runner)
         self.config = config
+        self.root_path = self.config.root_path
+        self.runner = runner
+        self.xcodes = Xcodes(self.runner, cache_path=self.config.xcodes_cache_path)
 
         root_project_identifier = ProjectIdentifier(overrides=None, project_name=self.config.root_path.name)
 
         self.all_repositories = {root_project_identifier: Repository(punic=self, identifier=root_project_identifier, repo_path=self.config.root_path),}
+        self.all_checkouts = dict()
+        # The timing of every build, if config.build_timing is set.
+        self.build_records = []
+        # Where build outputs are kept, keyed by their inputs, and where builds keep their intermediate state, see build().
+        self.artifact_store = None
+        self.derived_data = None
+        self._submodule_status = None
 
         self.root_project = self._repository_for_identifier(root_project_identifier)
 
+    @property
+    def xcode(self):
+        # type: () -> Xcode
+        """The config's Xcode, out of the Xcodes found by this session."""
+        return self.config.find_xcode(self.xcodes)
+
     def _resolver(self):
         return Resolver(root=Node(self.root_project.identifier, None), dependencies_for_node=self._dependencies_for_node)
 
@@ -81,7 +102,7 @@ class Punic(object):
 
         filtered_dependencies = self._ordered_dependencies(name_filter=dependencies)
 
-        checkouts = [Checkout(punic=self, identifier=identifier, revision=revision) for identifier, revision in filtered_dependencies]
+        checkouts = [self._checkout_for_identifier(identifier, revision) for identifier, revision in filtered_dependencies]
         for checkout in checkouts:
             checkout.prepare()
 
@@ -89,16 +110,22 @@ class Punic(object):
     def build(self, dependencies):
         # type: ([str])
 
-        logging.info('Using xcode version: {}'.format(self.config.xcode))
+        logging.info('Using xcode version: {}'.format(self.xcode))
 
         configuration, platforms = self.config.configuration, self.config.platforms
 
         if not self.config.build_path.exists():
             self.config.build_path.mkdir(parents=True)
 
-        filtered_dependencies = self._ordered_dependencies(name_filter=dependencies)
+        self.artifact_store = self.config.make_artifact_store()
+        self.derived_data = self.config.make_derived_data()
+
+        graph = self._dependency_graph(name_filter=dependencies)
+        build_order = topological_sort(graph, reverse=True)
 
-        checkouts = [Checkout(punic=self, identifier=identifier, revision=revision) for identifier, revision in filtered_dependencies]
+        checkouts = OrderedDict((node, self._checkout_for_identifier(node.identifier, node.version)) for node in build_order)
+        for checkout in checkouts.values():
+            checkout.prepare()
 
         skips = self.config.skips
 
@@ -117,54 +144,183 @@ class Punic(object):
                     return False
             return True
 
+        # Each build builds its platform's SDKs at the same time.
+        scheduler = BuildScheduler(jobs=self.config.build_jobs)
+        processes = scheduler.jobs * max([len(platform.sdks) for platform in platforms] or [1])
+        if self.runner.jobs < processes:
+            self.runner.jobs = processes
+
+        outputs_for_key = dict()
+
+        def build_one(key, platform, project, scheme, dependency, artifact_key):
+            # Builds that run alongside others get a share of the CPUs.
+            jobs = scheduler.job_share if scheduler.concurrent else None
+            outputs_for_key[key] = self._build_one(platform, project, scheme, configuration, dependency=dependency, jobs=jobs, artifact_key=artifact_key)
+
+        def write_stamp(stamp, checkout, stamp_key, keys):
+            stamp.write(checkout.revision.sha, [stamp_key], [path for key in keys for path in outputs_for_key[key]])
+
+        # Each build waits for the builds (for the same platform) of everything its dependency depends on, so their
+        # products are in Carthage/Build before it starts. A dependency's own builds share its derived data and so run
+        # one after another. Dependencies whose stamps say they are up to date aren't introspected, let alone built.
+        keys_for_platform_and_node = defaultdict(list)
+        stamp_keys_for_platform_and_node = dict()
+        last_key_for_node = dict()
         for platform in platforms:
-            for checkout in checkouts:
-                checkout.prepare()
-                for project in checkout.projects:
-                    schemes = project.schemes
-
-                    schemes = [scheme for scheme in schemes if scheme.framework_targets]
-                    schemes = [scheme for scheme in schemes if platform.device_sdk in scheme.supported_platform_names]
-                    for scheme in schemes:
-                        if not filter_dependency(platform, checkout, project, scheme):
-                            logging.warn('<err>Warning:</err> <sub>Skipping</sub>: {} / {} / {} / {}'.format(platform, checkout.identifier.project_name, project.path.name, scheme.name))
-                            continue
-                        self._build_one(platform, project, scheme.name, configuration)
+            for node, checkout in checkouts.items():
+                dependency = checkout.identifier.project_name
+                children = descendants(graph, node)
+                # The products of a build only change if it or something it depends on does.
+                dependency_keys = [stamp_keys_for_platform_and_node[(platform, child)] for child in children]
+                stamp_key = self._stamp_key(platform, checkout, configuration, dependency_keys)
+                stamp_keys_for_platform_and_node[(platform, node)] = stamp_key
+
+                stamp = BuildStamp(self.config.build_path / platform.output_directory_name, dependency)
+                if not self.config.force and stamp.is_current([stamp_key]):
+                    logging.info('<sub>Up to date</sub>: <ref>{}</ref> (platform: {})'.format(dependency, platform.name))
+                    continue
+                stamp.remove()
+
+                builds = []
+                for project, scheme in checkout.schemes_for_platform(platform):
+                    if not filter_dependency(platform, checkout, project, scheme):
+                        logging.warn('<err>Warning:</err> <sub>Skipping</sub>: {} / {} / {} / {}'.format(platform, dependency, project.path.name, scheme.name))
+                        continue
+                    key = (platform.name, dependency, project.path.name, scheme.name)
+                    artifact_key = self._artifact_key(platform, checkout, project, scheme.name, configuration, dependency_keys)
+                    builds.append((key, project, scheme.name, artifact_key))
+                if not builds:
+                    # Nothing to build for this platform, which won't change until the stamp key does.
+                    if not self.config.dry_run:
+                        stamp.write(checkout.revision.sha, [stamp_key], [])
+                    continue
+
+                dependencies = [key for child in children for key in keys_for_platform_and_node[(platform, child)]]
+                for key, project, scheme, artifact_key in builds:
+                    scheduler.add(key, partial(build_one, key, platform, project, scheme, dependency, artifact_key), dependencies + ([last_key_for_node[node]] if node in last_key_for_node else []))
+                    keys_for_platform_and_node[(platform, node)].append(key)
+                    last_key_for_node[node] = key
+                keys = keys_for_platform_and_node[(platform, node)]
+                if not self.config.dry_run:
+                    scheduler.add(('stamp', platform.name, dependency), partial(write_stamp, stamp, checkout, stamp_key, keys), list(keys))
+
+        scheduler.run(on_failure=self.runner.terminate)
+        self.derived_data.prune()
 
     def _ordered_dependencies(self, name_filter=None):
-        # type: (bool, [str]) -> [(ProjectIdentifier, Revision)]
+        # type: ([str]) -> [(ProjectIdentifier, Revision)]
+        """Return the dependencies in Cartfile.resolved in build order, see _dependency_graph."""
+        return topological_sort(self._dependency_graph(name_filter=name_filter), reverse=True)
+
+    def _dependency_graph(self, name_filter=None):
+        # type: ([str]) -> DiGraph
+        """Return the graph of the dependencies in Cartfile.resolved, with an edge from each to each of its dependencies.
+
+        If name_filter is given only the named dependencies and everything they (transitively) depend on are included,
+        and no other repository is fetched or even looked at."""
 
-        cartfile = Cartfile(use_ssh=self.config.use_ssh, overrides=config.repo_overrides)
+        cartfile = Cartfile(use_ssh=self.config.use_ssh, overrides=self.config.repo_overrides)
         cartfile.read(self.config.root_path / 'Cartfile.resolved')
 
+        revisions = dict()
+
         def _predicate_to_revision(spec):
-            repository = self._repository_for_identifier(spec.identifier)
+            if spec.identifier in revisions:
+                return revisions[spec.identifier]
+            # Pinned dependencies that are only being built don't need their history, see TarballRepository.
+            repository = self._repository_for_identifier(spec.identifier, tarball=self.config.use_tarballs)
             if spec.predicate.operator == VersionOperator.commitish:
                 try:
                     revision = Revision(repository=repository, revision=spec.predicate.value, revision_type=Revision.Type.commitish, check = True)
                 except Exception as e:
                     logging.warning(e.message)
-                    return None
-                else:
-                    return revision
+                    revision = None
             else:
                 raise Exception("Cannot convert spec to revision: {}".format(spec))
+            revisions[spec.identifier] = revision
+            return revision
 
-        dependencies = [(spec.identifier, _predicate_to_revision(spec)) for spec in cartfile.specifications]
-        resolved_dependencies = self._resolver().resolve_versions(dependencies)
-        resolved_dependencies = [dependency for dependency in resolved_dependencies if dependency[0].matches(name_filter)]
-        return resolved_dependencies
-
-    def _repository_for_identifier(self, identifier):
-        # type: (ProjectIdentifier) -> Repository
-        if identifier in self.all_repositories:
-            return self.all_repositories[identifier]
+        specifications = cartfile.specifications
+        if name_filter:
+            specifications = self._dependency_closure(specifications, name_filter, _predicate_to_revision)
         else:
-            repository = Repository(self, identifier=identifier)
-            if self.config.fetch:
-                repository.fetch()
-            self.all_repositories[identifier] = repository
-            return repository
+            self._repositories_for_identifiers([spec.identifier for spec in specifications], tarball=self.config.use_tarballs)
+
+        dependencies = [(spec.identifier, _predicate_to_revision(spec)) for spec in specifications]
+        return self._resolver().versions_graph(dependencies)
+
+    def _dependency_closure(self, specifications, name_filter, predicate_to_revision):
+        # type: ([Specification], [str], Callable) -> [Specification]
+        """Return the specifications that the dependencies named in name_filter need, themselves included.
+
+        The closure is walked using the Cartfile of each dependency at its pinned revision."""
+        unknown_names = set(name_filter) - set(spec.identifier.project_name for spec in specifications)
+        if unknown_names:
+            raise PunicRepresentableError('No dependencies named {} in Cartfile.resolved.'.format(', '.join(sorted(unknown_names))))
+
+        specifications_for_identifier = dict((spec.identifier, spec) for spec in specifications)
+        closure = set()
+        # Walk the graph a level at a time so each level's repositories can be fetched together.
+        level = [spec for spec in specifications if spec.identifier.matches(name_filter)]
+        while level:
+            closure.update(spec.identifier for spec in level)
+            repositories = self._repositories_for_identifiers([spec.identifier for spec in level], tarball=self.config.use_tarballs)
+            next_level = []
+            for spec, repository in zip(level, repositories):
+                revision = predicate_to_revision(spec)
+                if not revision:
+                    continue
+                for child in repository.specifications_for_revision(revision):
+                    child_spec = specifications_for_identifier.get(child.identifier)
+                    if child_spec and child.identifier not in closure and child_spec not in next_level:
+                        next_level.append(child_spec)
+            level = next_level
+
+        return [spec for spec in specifications if spec.identifier in closure]
+
+    def _repository_for_identifier(self, identifier, tarball=False):
+        # type: (ProjectIdentifier, bool) -> Repository
+        return self._repositories_for_identifiers([identifier], tarball=tarball)[0]
+
+    def _repositories_for_identifiers(self, identifiers, tarball=False):
+        # type: ([ProjectIdentifier], bool) -> [Repository]
+        """Return the repositories for identifiers, creating (and, if fetching, concurrently fetching) any that are new."""
+        new_repositories = []
+        for identifier in identifiers:
+            if identifier not in self.all_repositories:
+                if tarball and TarballRepository.supports(identifier):
+                    repository = TarballRepository(self, identifier=identifier)
+                else:
+                    repository = Repository(self, identifier=identifier)
+                self.all_repositories[identifier] = repository
+                new_repositories.append(repository)
+        if self.config.fetch and new_repositories:
+            with locked_paths([repository.path for repository in new_repositories]):
+                commands = [command for command in (repository.fetch_command() for repository in new_repositories) if command]
+                for _ in self.runner.run_many(commands):
+                    pass
+        return [self.all_repositories[identifier] for identifier in identifiers]
+
+    def _checkout_for_identifier(self, identifier, revision):
+        # type: (ProjectIdentifier, Revision) -> Checkout
+        checkout = self.all_checkouts.get(identifier)
+        if not checkout or checkout.revision != revision:
+            checkout = Checkout(punic=self, identifier=identifier, revision=revision)
+            self.all_checkouts[identifier] = checkout
+        return checkout
+
+    def submodule_status(self):
+        # type: () -> {str: (str, str)}
+        """Return (flag, sha) for every submodule of the root project keyed by path, from a single `git submodule status`."""
+        if self._submodule_status is None:
+            self._submodule_status = dict()
+            result = self.runner.run('git submodule status', cwd=self.config.root_path)
+            if result.return_code == 0:
+                for line in result.stdout.splitlines():
+                    match = re.match(r'^(?P<flag>[ +\-U])(?P<sha>[a-f0-9]+) (?P<path>.+?)( \((?P<description>.+)\))?$', line)
+                    if match:
+                        self._submodule_status[match.group('path')] = (match.group('flag'), match.group('sha'))
+        return self._submodule_status
 
     def dependencies_for_project_and_tag(self, identifier, tag):
         # type: (ProjectIdentifier, Revision) -> [ProjectIdentifier, [Revision]]
@@ -174,6 +330,7 @@ class Punic(object):
 
         repository = self._repository_for_identifier(identifier)
         specifications = repository.specifications_for_revision(tag)
+        self._repositories_for_identifiers([specification.identifier for specification in specifications])
 
         def make(specification):
             repository = self._repository_for_identifier(specification.identifier)
@@ -193,35 +350,128 @@ class Punic(object):
         dependencies = [dependency for dependency in dependencies if dependency]
         return dependencies
 
-    def _build_one(self, platform, project, scheme, configuration):
+    def _resolved_configuration(self, project, configuration, dependency=None):
+        # type: (XcodeProject, str, str) -> str
+        """Return the configuration to build: the one asked for, else the dependency's recipe's, else the project's default."""
+        recipe = self.config.recipes.get(dependency)
+        return configuration or (recipe and recipe.configuration) or project.default_configuration
+
+    def _stamp_key(self, platform, checkout, configuration, dependency_keys):
+        # type: (Platform, Checkout, str, [str]) -> str
+        """Return the key of a dependency's builds for a platform (see BuildStamp): a digest of everything that decides
+        what they build and how, including the stamp keys of everything it depends on.
+
+        It is worked out from the configuration and the SHA alone (which fixes the projects' contents), so checking
+        whether a dependency is up to date doesn't need its projects to be introspected."""
+        return ArtifactStore.key(
+            dependency=checkout.identifier.project_name,
+            sha=checkout.revision.sha,
+            sparse=checkout.sparse.to_dict(),
+            recipe=checkout.recipe.to_dict() if checkout.recipe else None,
+            skips=self.config.skips,
+            dependencies=sorted(dependency_keys),
+            xcode_version=str(self.xcode.version),
+            toolchain=self.config.toolchain,
+            configuration=configuration,
+            platform=platform.name,
+            sdks=platform.sdks,
+        )
+
+    def _artifact_key(self, platform, checkout, project, scheme, configuration, dependency_keys):
+        # type: (Platform, Checkout, XcodeProject, str, str, [str]) -> str
+        """Return the artifact store key of a build: a digest of everything its products depend on, including the
+        stamp keys of everything it depends on."""
+        dependency = checkout.identifier.project_name
+        recipe = self.config.recipes.get(dependency)
+        return ArtifactStore.key(
+            dependency=dependency,
+            sha=checkout.revision.sha,
+            sparse=checkout.sparse.to_dict(),
+            dependencies=sorted(dependency_keys),
+            xcode_version=str(self.xcode.version),
+            platform=platform.name,
+            # What _build_one passes xcodebuild for each SDK, less what doesn't change the products.
+            arguments=[self._build_arguments(project, scheme, configuration, sdk, dependency).to_list() for sdk in platform.sdks],
+            project=project.path.name,
+            scheme=scheme,
+            product=recipe.product if recipe else None,
+        )
+
+    def _build_arguments(self, project, scheme, configuration, sdk, dependency=None, jobs=None, derived_data_path=None):
+        # type: (XcodeProject, str, str, str, str, int, Path) -> XcodeBuildArguments
+        """Return the xcodebuild arguments that build a scheme for an SDK."""
+        resolved_configuration = self._resolved_configuration(project, configuration, dependency)
+        return XcodeBuildArguments(scheme=scheme, configuration=resolved_configuration, sdk=sdk, toolchain=self.config.toolchain, jobs=jobs, derived_data_path=derived_data_path)
+
+    def _build_one(self, platform, project, scheme, configuration, dependency=None, jobs=None, artifact_key=None):
+        """Build a scheme for each of the platform's SDKs and put the products in Carthage/Build.
+
+        jobs (xcodebuild's -jobs) is given when other builds are running at the same time. The SDKs (e.g. device and
+        simulator) are built at the same time, sharing jobs (or the CPUs) between them; whenever builds run alongside
+        others xcodebuild's output is shown once each has finished rather than as it runs.
+
+        If the artifact store has the outputs for artifact_key they are copied into Carthage/Build instead (unless
+        config.force is set), otherwise the outputs of the build are stored under it. Returns the paths of the outputs."""
 
         if self.config.dry_run:
             for sdk in platform.sdks:
                 logging.warn('<sub>DRY-RUN: (Not) Building</sub>: <ref>{}</ref> (scheme: {}, sdk: {}, configuration: {})...'.format(project.path.name, scheme, sdk, configuration))
             return
 
-        all_products = []
+        if artifact_key and self.artifact_store and not self.config.force:
+            output_path = self.config.build_path / platform.output_directory_name
+            names = self.artifact_store.restore(artifact_key, output_path)
+            if names is not None:
+                logging.info('<sub>Restored</sub>: <ref>{}</ref> (scheme: {}, platform: {}) from the artifact store: {}'.format(project.path.name, scheme, platform.name, ', '.join(names)))
+                return [output_path / name for name in names]
 
         toolchain = self.config.toolchain
 
+        recipe = self.config.recipes.get(dependency)
+        resolved_configuration = self._resolved_configuration(project, configuration, dependency)
+        if not resolved_configuration:
+            logging.warn("<err>Warning</err>: No configuration specified for project and no default configuration found. This could be a problem.")
+
+        # Each dependency has its own derived data for every Xcode and toolchain it is built with, see DerivedData.
+        derived_data_path = self.derived_data.partition(dependency or project.path.stem, self.xcode.version, toolchain=toolchain)
+
         # Build device & simulator (if sim exists)
-        for sdk in platform.sdks:
-            logging.info('<sub>Building</sub>: <ref>{}</ref> (scheme: {}, sdk: {}, configuration: {})...'.format(project.path.name, scheme, sdk, configuration))
+        scheduler = BuildScheduler(jobs=len(platform.sdks))
+        if len(platform.sdks) > 1:
+            jobs = max(1, (jobs or multiprocessing.cpu_count()) // len(platform.sdks))
 
-            derived_data_path = self.config.derived_data_path
+        def build_sdk(sdk):
+            logging.info('<sub>Building</sub>: <ref>{}</ref> (scheme: {}, sdk: {}, configuration: {})...'.format(project.path.name, scheme, sdk, configuration))
 
-            resolved_configuration = configuration if configuration else project.default_configuration
-            if not resolved_configuration:
-                logging.warn("<err>Warning</err>: No configuration specified for project and no default configuration found. This could be a problem.")
+            # Each SDK has its own derived data so that they can be built alongside each other.
+            arguments = self._build_arguments(project, scheme, configuration, sdk, dependency, jobs=jobs, derived_data_path=derived_data_path / sdk)
 
-            arguments = XcodeBuildArguments(scheme=scheme, configuration=resolved_configuration, sdk=sdk, toolchain=toolchain, derived_data_path=derived_data_path)
+            record = BuildRecord(dependency, project.path.name, scheme, sdk, resolved_configuration) if self.config.build_timing else None
+            try:
+                products = project.build(arguments=arguments, record=record, buffered=bool(jobs), dependency=dependency)
+            finally:
+                if record:
+                    self.build_records.append(record)
+            if recipe and recipe.product:
+                products = [product for product in products if product.product_name == recipe.product]
+            return products
 
-            all_products += project.build(arguments=arguments)
+        for sdk in platform.sdks:
+            scheduler.add(sdk, partial(build_sdk, sdk))
+        try:
+            products_for_sdk = scheduler.run(on_failure=self.runner.terminate)
+        finally:
+            self.derived_data.record_size(derived_data_path)
 
-        self._post_process(platform, all_products)
+        outputs = self._post_process(platform, [product for sdk in platform.sdks for product in products_for_sdk[sdk]])
+        if artifact_key and self.artifact_store:
+            self.artifact_store.store(artifact_key, outputs)
+        return outputs
 
     def _post_process(self, platform, products):
-        # type: (punic.platform.Platform, List)
+        # type: (punic.platform.Platform, List) -> [Path]
+        """Merge the products of each SDK into Carthage/Build, returning the paths of everything written there (the
+        frameworks, their dSYMs and bcsymbolmaps)."""
 
         ########################################################################################################
 
@@ -232,6 +482,8 @@ class Punic(object):
         for product in products:
             products_by_name_then_sdk[product.full_product_name][product.sdk] = product
 
+        outputs = []
+
 
         for products_by_sdk in products_by_name_then_sdk.values():
 
@@ -257,6 +509,7 @@ class Punic(object):
                 raise Exception("No product at: {}".format(device_product.product_path))
 
             shutil.copytree(device_product.product_path, output_product.product_path, symlinks=True)
+            outputs.append(output_product.product_path)
 
             ########################################################################################################
 
@@ -264,7 +517,7 @@ class Punic(object):
                 logging.debug('<sub>Lipo-ing</sub>...')
                 executable_paths = [product.executable_path for product in products]
                 command = ['/usr/bin/xcrun', 'lipo', '-create'] + executable_paths + ['-output', output_product.executable_path]
-                runner.check_run(command)
+                self.runner.check_run(command)
                 mtime = executable_paths[0].stat().st_mtime
                 os.utime(str(output_product.executable_path), (mtime, mtime))
 
@@ -280,13 +533,17 @@ class Punic(object):
 
             logging.debug('<sub>Copying bcsymbolmap files</sub>...')
             for product in products:
-                for path in product.bcsymbolmap_paths:
+                for path in product.bcsymbolmap_paths(self.runner):
                     shutil.copy(path, output_product.target_build_dir)
+                    outputs.append(output_product.target_build_dir / path.name)
 
             ########################################################################################################
 
             logging.debug('<sub>Producing dSYM files</sub>...')
-            command = ['/usr/bin/xcrun', 'dsymutil', str(output_product.executable_path), '-o', str(output_product.target_build_dir / (output_product.executable_name + '.dSYM'))]
-            runner.check_run(command)
+            dsym_path = output_product.target_build_dir / (output_product.executable_name + '.dSYM')
+            command = ['/usr/bin/xcrun', 'dsymutil', str(output_product.executable_path), '-o', str(dsym_path)]
+            self.runner.check_run(command)
+            outputs.append(dsym_path)
 
-            ########################################################################################################
\ No newline at end of file
+            ########################################################################################################
+        return outputs
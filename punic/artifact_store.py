@@ -0,0 +1,134 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['ArtifactStore']
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from pathlib2 import Path
+
+import punic.shshutil as shutil
+
+
+class ArtifactStore(object):
+    """A local store of build outputs (framework bundles, dSYMs and bcsymbolmaps) keyed by a digest of everything that
+    went into building them.
+
+    Each entry is a directory named by its key holding the stored files and a manifest. Entries are written to a
+    temporary directory first and renamed into place, so a half-written entry is never seen, even by another process.
+    Once the store exceeds `max_size` bytes the least recently used entries are evicted.
+
+    >>> import tempfile
+    >>> from pathlib2 import Path
+    >>> temp_dir = Path(tempfile.mkdtemp())
+    >>> store = ArtifactStore(temp_dir / 'store')
+    >>> (temp_dir / 'Build').mkdir()
+    >>> _ = (temp_dir / 'Build/Example.bcsymbolmap').open('w').write(u'map')
+    >>> key = ArtifactStore.key(dependency='Example', sha='0123abcd')
+    >>> store.restore(key, temp_dir / 'Restored')
+    >>> store.store(key, [temp_dir / 'Build/Example.bcsymbolmap'])
+    >>> store.restore(key, temp_dir / 'Restored')
+    ['Example.bcsymbolmap']
+    """
+
+    def __init__(self, path, max_size=2 * 1024 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(**inputs):
+        # type: (Any) -> str
+        """Return the key for a build: a digest of its inputs (which must be JSON serializable)."""
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return self.path / key
+
+    def restore(self, key, destination):
+        # type: (str, Path) -> [str]
+        """Copy the outputs stored for key into destination (replacing any already there) and return their names, or
+        return None if nothing is stored for key."""
+        entry_path = self._entry_path(key)
+        manifest_path = entry_path / 'manifest.json'
+        try:
+            manifest = json.load(manifest_path.open())
+            if not destination.exists():
+                destination.mkdir(parents=True)
+            for name in manifest['names']:
+                shutil.remove(destination / name)
+                source = entry_path / 'files' / name
+                if source.is_dir():
+                    shutil.copytree(source, destination / name, symlinks=True)
+                else:
+                    shutil.copy(source, destination / name)
+            # An entry's manifest is touched whenever it is used, see evict().
+            os.utime(str(manifest_path), None)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            if entry_path.exists():
+                logging.debug('<sub>Artifact store entry {} is unusable</sub>: {}'.format(key, e))
+            return None
+        return manifest['names']
+
+    def store(self, key, paths):
+        # type: (str, [Path])
+        """Store copies of paths (files or directories) for key, then evict least recently used entries until the
+        store is within max_size."""
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        temp_path = Path(tempfile.mkdtemp(dir=str(self.path), prefix='.'))
+        try:
+            size = 0
+            for path in paths:
+                if path.is_dir():
+                    shutil.copytree(path, temp_path / 'files' / path.name, symlinks=True)
+                else:
+                    if not (temp_path / 'files').exists():
+                        (temp_path / 'files').mkdir()
+                    shutil.copy(path, temp_path / 'files' / path.name)
+                size += shutil.tree_size(temp_path / 'files' / path.name)
+            manifest = {'names': [path.name for path in paths], 'size': size, 'created': time.time()}
+            with open(str(temp_path / 'manifest.json'), 'w') as stream:
+                json.dump(manifest, stream)
+            with self._lock:
+                shutil.remove(self._entry_path(key))
+                try:
+                    os.rename(str(temp_path), str(self._entry_path(key)))
+                except OSError:
+                    # Stored by another process at the same time.
+                    pass
+        finally:
+            shutil.remove(temp_path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the store is within max_size."""
+        with self._lock:
+            entries = []
+            for entry_path in self.path.iterdir() if self.path.exists() else []:
+                manifest_path = entry_path / 'manifest.json'
+                try:
+                    entries.append((manifest_path.stat().st_mtime, json.load(manifest_path.open())['size'], entry_path))
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+            total_size = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, entry_path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                shutil.remove(entry_path)
+                total_size -= size
+                evicted += 1
+            if evicted:
+                logging.debug('Evicted {} entries from the artifact store'.format(evicted))
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            shutil.remove(self.path)
+
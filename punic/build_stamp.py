@@ -0,0 +1,87 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['BuildStamp']
+
+import hashlib
+import json
+import os
+
+from pathlib2 import Path
+
+
+class BuildStamp(object):
+    """What a dependency's builds for a platform put in Carthage/Build, and what they were built from.
+
+    A stamp records the dependency's SHA, its key (see `Punic._stamp_key`, which covers every input that affects its
+    builds, including the inputs of its dependencies' builds) and a fingerprint of each of its outputs. If the key is the
+    same and the outputs haven't changed since the stamp was written there is nothing to build.
+
+    >>> import tempfile
+    >>> from pathlib2 import Path
+    >>> temp_dir = Path(tempfile.mkdtemp())
+    >>> _ = (temp_dir / 'Example.bcsymbolmap').open('w').write(u'map')
+    >>> stamp = BuildStamp(temp_dir, 'Example')
+    >>> stamp.is_current(['key'])
+    False
+    >>> stamp.write('0123abcd', ['key'], [temp_dir / 'Example.bcsymbolmap'])
+    >>> stamp.is_current(['key']), stamp.is_current(['other key'])
+    (True, False)
+    >>> _ = (temp_dir / 'Example.bcsymbolmap').open('w').write(u'changed')
+    >>> stamp.is_current(['key'])
+    False
+    """
+
+    def __init__(self, directory, dependency):
+        # type: (Path, str)
+        self.directory = directory
+        self.path = directory / '.{}.punic'.format(dependency)
+
+    def read(self):
+        # type: () -> dict
+        if not self.path.exists():
+            return dict()
+        try:
+            return json.load(self.path.open())
+        except ValueError:
+            return dict()
+
+    def write(self, sha, keys, outputs):
+        # type: (str, [str], [Path])
+        stamp = {
+            'sha': sha,
+            'keys': sorted(keys),
+            'outputs': dict((path.name, _fingerprint(path)) for path in outputs),
+        }
+        with open(str(self.path), 'w') as stream:
+            json.dump(stamp, stream, indent=2, sort_keys=True)
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
+
+    def is_current(self, keys):
+        # type: ([str]) -> bool
+        stamp = self.read()
+        if not stamp or stamp.get('keys') != sorted(keys):
+            return False
+        return all(_fingerprint(self.directory / name) == fingerprint for name, fingerprint in stamp['outputs'].items())
+
+
+def _fingerprint(path):
+    # type: (Path) -> str
+    """Return a digest of the size and modification time of path and, for a bundle, every file in it; or None if path
+    doesn't exist.
+
+    Reading the contents of every framework on every build would take longer than most builds. Punic's outputs are only
+    ever replaced, never edited in place, and replacing a file changes its modification time."""
+    if not path.exists():
+        return None
+    if path.is_dir() and not path.is_symlink():
+        paths = sorted(os.path.join(root, name) for root, dirs, files in os.walk(str(path)) for name in dirs + files)
+    else:
+        paths = [str(path)]
+    digest = hashlib.sha1()
+    for name in paths:
+        stat = os.lstat(name)
+        digest.update('{}\0{}\0{}\n'.format(os.path.relpath(name, str(path)), stat.st_size, stat.st_mtime).encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,116 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['BuildRecord', 'log_build_timings', 'append_timing_report']
+
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+
+# Lines of the summary xcodebuild prints with -showBuildTimingSummary, e.g. "CompileSwiftSources (4 tasks) | 12.345 seconds"
+_phase_pattern = re.compile(r'^(?P<phase>\S.*?) \((?P<tasks>\d+) tasks?\) \| (?P<seconds>\d+(?:\.\d+)?) seconds$')
+# e.g. "=== BUILD TARGET Example-iOS OF PROJECT Example WITH CONFIGURATION Release ==="
+_target_pattern = re.compile(r'^=== BUILD (?:AGGREGATE )?TARGET (?P<target>.+?) OF PROJECT .+ ===$')
+
+
+class BuildRecord(object):
+    """The timing of one xcodebuild build of a dependency's scheme for one SDK.
+
+    Feed it xcodebuild's output a line at a time, as it is read: the time spent on each target is measured between
+    xcodebuild's "=== BUILD TARGET" markers and the time spent in each kind of task (compiling, linking, running
+    scripts...) is read from the summary -showBuildTimingSummary adds to the end of the output.
+
+    >>> record = BuildRecord('Example', 'Example.xcodeproj', 'Example-iOS', 'iphoneos', 'Release')
+    >>> for line in ['Build Timing Summary', '', 'CompileSwiftSources (4 tasks) | 12.500 seconds', 'Ld (1 task) | 0.250 seconds']:
+    ...     record.feed(line)
+    >>> record.phases
+    [('CompileSwiftSources', 4, 12.5), ('Ld', 1, 0.25)]
+    """
+
+    def __init__(self, dependency, project, scheme, sdk, configuration):
+        self.dependency = dependency
+        self.project = project
+        self.scheme = scheme
+        self.sdk = sdk
+        self.configuration = configuration
+        self.start = time.time()
+        self.end = None
+        self.return_code = None
+        self.phases = []
+        self.targets = OrderedDict()
+        self._in_summary = False
+        self._target = None
+        self._target_start = None
+
+    def __repr__(self):
+        return 'BuildRecord({}, {}, {})'.format(self.dependency, self.scheme, self.sdk)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def feed(self, line):
+        # type: (str)
+        if self._in_summary:
+            match = _phase_pattern.match(line)
+            if match:
+                self.phases.append((match.group('phase'), int(match.group('tasks')), float(match.group('seconds'))))
+        elif line == 'Build Timing Summary':
+            self._finish_target()
+            self._in_summary = True
+        elif line.startswith('=== BUILD '):
+            match = _target_pattern.match(line)
+            if match:
+                self._finish_target()
+                self._target = match.group('target')
+                self._target_start = time.time()
+
+    def _finish_target(self):
+        if self._target:
+            self.targets[self._target] = self.targets.get(self._target, 0) + time.time() - self._target_start
+            self._target = None
+
+    def finish(self, return_code):
+        self._finish_target()
+        self.end = time.time()
+        self.return_code = return_code
+
+    def to_dict(self):
+        # type: () -> dict
+        return OrderedDict([
+            ('dependency', self.dependency),
+            ('project', self.project),
+            ('scheme', self.scheme),
+            ('sdk', self.sdk),
+            ('configuration', self.configuration),
+            ('start', self.start),
+            ('seconds', self.duration),
+            ('return_code', self.return_code),
+            ('targets', self.targets),
+            ('phases', [OrderedDict([('phase', phase), ('tasks', tasks), ('seconds', seconds)]) for phase, tasks, seconds in self.phases]),
+        ])
+
+
+def log_build_timings(records, phases=3):
+    # type: ([BuildRecord], int)
+    """Log how long each build took, slowest first, with its slowest targets and phases."""
+    for record in sorted(records, key=lambda record: record.duration, reverse=True):
+        logging.info('Build <ref>{}</ref> ({}, {}) took <echo>{:.3f}</echo> seconds.'.format(record.dependency, record.scheme, record.sdk, record.duration))
+        if len(record.targets) > 1:
+            for target, seconds in sorted(record.targets.items(), key=lambda item: item[1], reverse=True):
+                logging.info('    Target <ref>{}</ref>: {:.3f} seconds'.format(target, seconds))
+        for phase, tasks, seconds in sorted(record.phases, key=lambda phase: phase[2], reverse=True)[:phases]:
+            logging.info('    {} ({} tasks): {:.3f} seconds'.format(phase, tasks, seconds))
+
+
+def append_timing_report(records, path, **extra):
+    # type: ([BuildRecord], Path)
+    """Append one JSON object per build (plus any extra fields, e.g. the Xcode version) to the report at path.
+
+    Reports accumulate, so builds can be compared over time."""
+    with open(str(path), 'a') as stream:
+        for record in records:
+            entry = record.to_dict()
+            entry.update(extra)
+            stream.write(json.dumps(entry) + '\n')
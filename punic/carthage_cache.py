@@ -16,8 +16,9 @@ from .errors import *
 
 
 class CarthageCache(object):
-    def __init__(self, config):
+    def __init__(self, config, xcode):
         self.config = config
+        self.xcode = xcode
 
         config_path = Path('.carthage_cache.yml')
         if not config_path.exists():
@@ -40,7 +41,7 @@ class CarthageCache(object):
         return path
 
     def hash_for_project(self):
-        output = self.config.xcode.check_call('swift -version')
+        output = self.xcode.check_call('swift -version')
         swift_version = re.search(r'Swift version ((?:\d+\.)*(?:\d+))', output).group(1)
 
         resolve_file = Path('Cartfile.resolved').open().read()
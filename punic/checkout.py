@@ -1,15 +1,32 @@
 import os
-import re
+import json
+import hashlib
 import logging
-import itertools
+import tempfile
+from flufl.enum import IntEnum
+from pathlib2 import Path
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
 
 from punic import shshutil as shutil
-from punic.config import config
-from punic.runner import runner
-from punic.xcode import XcodeProject
+from punic.config import SparsePaths
+from punic.xcode import XcodeProject, Scheme
 
 
 class Checkout(object):
+    """A dependency checked out into Carthage/Checkouts.
+
+    Checkouts are vended once per session by `Punic._checkout_for_identifier` and move forward through `State`. Each
+    step is performed at most once, no matter how many platforms or commands ask for it."""
+
+    class State(IntEnum):
+        fetched = 1
+        materialized = 2
+        discovered = 3
+        introspected = 4
 
     def __init__(self, punic, identifier, revision):
         self.punic = punic
@@ -17,55 +34,178 @@ class Checkout(object):
         self.repository = self.punic._repository_for_identifier(self.identifier)
         self.revision = revision
         self.checkout_path = self.config.checkouts_path / self.identifier.project_name
+        self.sparse = self.config.sparse_checkouts.get(self.identifier.project_name, SparsePaths())
+        self.recipe = self.config.recipes.get(self.identifier.project_name)
+        self.state = Checkout.State.fetched
+        self._projects = None
+        self._recipe_schemes = None
+
+    def __repr__(self):
+        return 'Checkout({}, {})'.format(self.identifier, self.revision)
 
     @property
     def config(self):
         return self.punic.config
 
-    def prepare(self):
+    @property
+    def record_path(self):
+        # type: () -> Path
+        """Path of the file recording what the checkout was materialized from."""
+        return self.config.checkouts_path / '.{}.punic'.format(self.identifier.project_name)
 
-        if self.config.use_submodules:
-            relative_checkout_path = self.checkout_path.relative_to(self.config.root_path)
-
-            result = runner.run('git submodule status "{}"'.format(relative_checkout_path))
-            if result.return_code == 0:
-                match = re.match(r'^(?P<flag> |\-|\+|U)(?P<sha>[a-f0-9]+) (?P<path>.+)( \((?P<description>.+)\))?', result.stdout)
-                flag = match.groupdict()['flag']
-                if flag == ' ':
-                    pass
-                elif flag == '-':
-                    raise Exception('Uninitialized submodule {}. Please report this!'.format(self.checkout_path))
-                elif flag == '+':
-                    raise Exception('Submodule {} doesn\'t match expected revision'.format(self.checkout_path))
-                elif flag == 'U':
-                    raise Exception('Submodule {} has merge conflicts'.format(self.checkout_path))
+    def read_record(self):
+        # type: () -> dict
+        if not self.record_path.exists() or not self.checkout_path.exists():
+            return dict()
+        try:
+            return json.load(self.record_path.open())
+        except ValueError:
+            return dict()
+
+    def write_record(self, record):
+        # type: (dict)
+        with open(str(self.record_path), 'w') as stream:
+            json.dump(record, stream)
+
+    def _record_is_current(self, record):
+        # type: (dict) -> bool
+        return record.get('sha') == self.revision.sha and record.get('sparse', SparsePaths().to_dict()) == self.sparse.to_dict()
+
+    @property
+    def shared_checkout_path(self):
+        # type: () -> Path
+        """Path of this checkout's tree in the global checkout store, keyed by remote URL and SHA (and sparse paths)."""
+        url_hash = hashlib.md5(self.identifier.remote_url.encode('utf-8')).hexdigest()
+        name = self.revision.sha
+        if self.sparse:
+            name += '-' + hashlib.md5(json.dumps(self.sparse.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        return self.config.checkout_store_directory / '{}_{}'.format(self.identifier.project_name, url_hash) / name
+
+    @property
+    def tree_path(self):
+        # type: () -> Path
+        """Path of the directory that really holds the checkout's files."""
+        return self.shared_checkout_path if self.config.shared_checkouts else self.checkout_path
+
+    def _materialize(self):
+        sha = self.revision.sha
+        record = self.read_record()
+        is_current = self._record_is_current(record) and record.get('shared', False) == self.config.shared_checkouts
+        # The record can't see the shared tree the checkout links to being removed, e.g. by punic clean.
+        if is_current and self.config.shared_checkouts and not self.shared_checkout_path.exists():
+            is_current = False
+        if is_current:
+            logging.debug('<sub>Checkout of <ref>{}</ref> is already at <rev>{}</rev></sub>'.format(self.identifier, self.revision))
+            return
+
+        # Forget the old SHA first so that an interrupted update is never mistaken for a complete one.
+        if self.record_path.exists():
+            self.record_path.unlink()
+
+        if self.config.shared_checkouts:
+            self._link_shared_checkout()
+        else:
+            old_sha = record.get('sha')
+            if record.get('shared') or record.get('sparse', SparsePaths().to_dict()) != self.sparse.to_dict():
+                old_sha = None
+            if not old_sha or not self.repository.update_materialized(old_sha, self.revision, self.checkout_path, sparse=self.sparse):
+                logging.debug('<sub>Materializing project in <ref>Carthage/Checkouts</ref></sub>')
+                self.repository.materialize(self.revision, self.checkout_path, sparse=self.sparse)
+
+        record = {'sha': sha}
+        if self.sparse:
+            record['sparse'] = self.sparse.to_dict()
+        if self.config.shared_checkouts:
+            record['shared'] = True
+        self.write_record(record)
+
+    def _link_shared_checkout(self):
+        store_path = self.shared_checkout_path
+        if not store_path.exists():
+            logging.debug('<sub>Materializing project in <ref>{}</ref></sub>'.format(store_path))
+            if not store_path.parent.exists():
+                store_path.parent.mkdir(parents=True)
+            temp_path = Path(tempfile.mkdtemp(dir=str(store_path.parent), prefix='.{}.'.format(store_path.name)))
+            try:
+                self.repository.materialize(self.revision, temp_path / 'tree', sparse=self.sparse)
+                try:
+                    os.rename(str(temp_path / 'tree'), str(store_path))
+                except OSError:
+                    # Another punic got there first. Its tree is just as good as ours.
+                    if not store_path.exists():
+                        raise
+                else:
+                    shutil.make_read_only(store_path)
+            finally:
+                shutil.rmtree(temp_path)
+
+        # Link the shared tree into Carthage/Checkouts entry by entry so that this project can still have its own
+        # Carthage/Build symlink inside the checkout.
+        logging.debug('<sub>Linking <ref>{}</ref> to <ref>{}</ref></sub>'.format(self.checkout_path.relative_to(self.config.root_path), store_path))
+        if self.checkout_path.is_symlink():
+            self.checkout_path.unlink()
+        elif self.checkout_path.exists():
+            shutil.rmtree(self.checkout_path)
+        self.checkout_path.mkdir()
+        for path in store_path.iterdir():
+            if path.name == 'Carthage' and path.is_dir() and not path.is_symlink():
+                (self.checkout_path / 'Carthage').mkdir()
+                for child_path in path.iterdir():
+                    if child_path.name != 'Build':
+                        os.symlink(str(child_path), str(self.checkout_path / 'Carthage' / child_path.name))
             else:
-                if self.checkout_path.exists():
-                    raise Exception('Want to create a submodule in {} but something already exists in there.'.format(self.checkout_path))
-                logging.debug('Adding submodule for {}'.format(self))
-                runner.check_run(['git', 'submodule', 'add', '--force', self.identifier.remote_url, self.checkout_path.relative_to(self.config.root_path)])
+                os.symlink(str(path), str(self.checkout_path / path.name))
+
+    def _prepare_submodule(self):
+        relative_checkout_path = str(self.checkout_path.relative_to(self.config.root_path))
 
-            # runner.check_run(['git', 'submodule', 'add', '--force', self.identifier.remote_url, self.checkout_path.relative_to(self.config.root_path)])
-            # runner.check_run(['git', 'submodule', 'update', self.checkout_path.relative_to(self.config.root_path)])
+        # Submodules are cloned from the repository cache instead of the network. --dissociate copies the borrowed
+        # objects in so that the submodule survives the cache being cleaned.
+        reference = ['--reference', self.repository.path, '--dissociate']
 
-            logging.debug('Updating {}'.format(self))
-            self.repository.checkout(self.revision)
+        status = self.punic.submodule_status().get(relative_checkout_path)
+        if not status:
+            if self.checkout_path.exists():
+                raise Exception('Want to create a submodule in {} but something already exists in there.'.format(self.checkout_path))
+            logging.debug('Adding submodule for {}'.format(self))
+            self.punic.runner.check_run(['git', 'submodule', 'add', '--force'] + reference + [self.identifier.remote_url, relative_checkout_path], cwd=self.config.root_path)
+        else:
+            flag, _ = status
+            if flag == '-':
+                logging.debug('Initializing submodule for {}'.format(self))
+                self.punic.runner.check_run(['git', 'submodule', 'update', '--init'] + reference + ['--', relative_checkout_path], cwd=self.config.root_path)
+            elif flag == 'U':
+                raise Exception('Submodule {} has merge conflicts'.format(self.checkout_path))
+
+        logging.debug('Updating {}'.format(self))
+        sha = self.revision.sha
+        if self.punic.runner.check_run('git rev-parse HEAD', cwd=self.checkout_path, echo=False).strip() != sha:
+            if self.punic.runner.run(['git', 'cat-file', '-e', '{}^{{commit}}'.format(sha)], cwd=self.checkout_path, echo=False).return_code != 0:
+                self.punic.runner.check_run(['git', 'fetch', '--tags', self.repository.path, '+refs/remotes/origin/*:refs/remotes/origin/*'], cwd=self.checkout_path)
+            self.punic.runner.check_run(['git', 'checkout', '--quiet', '--detach', sha], cwd=self.checkout_path)
+
+        if (self.checkout_path / '.gitmodules').exists():
+            self.punic.runner.check_run(['git', 'submodule', 'update', '--init', '--recursive', '--jobs', self.config.jobs], cwd=self.checkout_path)
+
+    def prepare(self):
+        if self.state >= Checkout.State.materialized:
+            return
+
+        if self.config.use_submodules:
+            self._prepare_submodule()
         else:
 
             # TODO: This isn't really 'fetch'
             if self.config.fetch:
-
-                self.repository.checkout(self.revision)
-                logging.debug('<sub>Copying project to <ref>Carthage/Checkouts</ref></sub>')
-                if self.checkout_path.exists():
-                    shutil.rmtree(self.checkout_path, ignore_errors=True)
-                shutil.copytree(self.repository.path, self.checkout_path, symlinks=True, ignore=shutil.ignore_patterns('.git'))
+                if not self.config.checkouts_path.exists():
+                    self.config.checkouts_path.mkdir(parents=True)
+                self._materialize()
 
         if not self.checkout_path.exists():
             raise Exception('No checkout at path: {}'.format(self.checkout_path))
 
         # We only need to bother making a symlink to <root>/Carthage/Build if dependency also has dependencies.
-        if len(self.punic.dependencies_for_project_and_tag(self.identifier, self.revision)):
+        if len(self.repository.specifications_for_revision(self.revision)):
             # Make a Carthage/Build symlink inside checked out project.
             carthage_path = self.checkout_path / 'Carthage'
             if not carthage_path.exists():
@@ -80,34 +220,63 @@ class Checkout(object):
             # TODO: Generate this programatically.
             os.symlink("../../../Build", str(carthage_symlink_path))
 
+        self.state = Checkout.State.materialized
+
     @property
     def projects(self):
-        def _make_cache_identifier(project_path):
-            rev = self.repository.rev_parse(self.revision)
-            cache_identifier = '{},{}'.format(str(rev), project_path.relative_to(self.checkout_path))
-            return cache_identifier
-
-        def test(path):
-            relative_path = path.relative_to(self.checkout_path)
-            if 'Carthage/Checkouts' in str(relative_path):
-                return False
-            return True
-
-        project_paths = itertools.chain(self.checkout_path.glob("**/*.xcworkspace"), self.checkout_path.glob("**/*.xcodeproj"))
-        project_paths = [path for path in project_paths if test(path)]
+        if self.state < Checkout.State.discovered:
+            self.prepare()
+            if self.recipe:
+                self._projects = [XcodeProject(self.punic, self.punic.xcode, self.checkout_path / self.recipe.project)]
+            else:
+                self._projects = self._discover_projects()
+            self.state = Checkout.State.discovered
+        return self._projects
+
+    def introspect(self):
+        """Work out (once) which schemes of which projects build frameworks and for which platforms."""
+        if self.state >= Checkout.State.introspected:
+            return
+        if self.recipe:
+            project = self.projects[0]
+            self._recipe_schemes = [Scheme(project, name) for name in sorted(self.recipe.schemes)]
+        else:
+            for project in self.projects:
+                for scheme in project.schemes:
+                    if scheme.framework_targets:
+                        scheme.supported_platform_names
+        self.state = Checkout.State.introspected
+
+    def schemes_for_platform(self, platform):
+        # type: (Platform) -> [(XcodeProject, Scheme)]
+        """Return the (project, scheme) pairs that build frameworks for platform."""
+        self.introspect()
+        if self.recipe:
+            # Schemes without SDKs in the recipe are asked which platforms they support.
+            return [(scheme.project, scheme) for scheme in self._recipe_schemes if platform.device_sdk in (self.recipe.schemes[scheme.name] or scheme.supported_platform_names)]
+        return [(project, scheme) for project in self.projects for scheme in project.schemes if scheme.framework_targets and platform.device_sdk in scheme.supported_platform_names]
+
+    def _discover_projects(self):
+        # Project paths only depend on the tree so they are cached alongside the SHA the checkout was materialized from.
+        record = self.read_record()
+        if self._record_is_current(record) and 'projects' in record:
+            project_paths = [self.checkout_path / path for path in record['projects']]
+        else:
+            tree_path = self.tree_path
+            project_paths = [self.checkout_path / path.relative_to(tree_path) for path in find_projects(tree_path, sparse=self.sparse)]
+            if self._record_is_current(record):
+                record['projects'] = [str(path.relative_to(self.checkout_path)) for path in project_paths]
+                self.write_record(record)
+
         if not project_paths:
             logging.warning("No projects/workspaces found in {}".format(self.checkout_path))
             return []
 
         projects = []
         schemes = []
-        embedded_project_pattern = re.compile(r"\.(playground|xcodeproj)/[^/]+\.xcworkspace$")
 
         for project_path in project_paths:
-            if embedded_project_pattern .search(str(project_path)):
-                #print('Skipping project\'s embedded workspace:', project_path)
-                continue
-            project = XcodeProject(self, config.xcode, project_path, _make_cache_identifier(project_path))
+            project = XcodeProject(self.punic, self.punic.xcode, project_path)
             for scheme in list(project.scheme_names):
                 if scheme in schemes:
                     project.info[2].remove(scheme)
@@ -116,3 +285,40 @@ class Checkout(object):
             if len(project.scheme_names) > 0:
                 projects.append(project)
         return projects
+
+
+# Directories that are never descended into. Projects and workspaces are returned, everything else can't contain a
+# project we would want to build.
+_bundle_suffixes = frozenset(['.xcodeproj', '.xcworkspace', '.playground', '.framework', '.xcframework', '.bundle', '.app', '.xcassets', '.dSYM'])
+
+
+def find_projects(root, sparse=None):
+    # type: (Path, SparsePaths) -> [Path]
+    """Find the Xcode workspaces and projects under root (workspaces first) in a single pass.
+
+    Hidden directories, symlinks, nested Carthage/Checkouts, the insides of bundles and anything outside of sparse (if
+    given) are pruned instead of walked.
+    """
+    sparse = sparse or SparsePaths()
+    workspaces = []
+    projects = []
+    directories = [(str(root), '')]
+    while directories:
+        directory, relative_directory = directories.pop()
+        for entry in scandir(directory):
+            if entry.name.startswith('.') or not entry.is_dir(follow_symlinks=False):
+                continue
+            relative_path = relative_directory + entry.name
+            if not sparse.may_contain(relative_path):
+                continue
+            suffix = os.path.splitext(entry.name)[1]
+            if suffix in ('.xcworkspace', '.xcodeproj'):
+                if sparse.matches(relative_path):
+                    (workspaces if suffix == '.xcworkspace' else projects).append(Path(entry.path))
+            elif suffix in _bundle_suffixes:
+                continue
+            elif entry.name == 'Checkouts' and os.path.basename(directory) == 'Carthage':
+                continue
+            else:
+                directories.append((entry.path, relative_path + '/'))
+    return sorted(workspaces) + sorted(projects)
@@ -1,27 +1,116 @@
 from __future__ import division, absolute_import, print_function
 
-__all__ = ['Config', 'config']
+__all__ = ['Config', 'SparsePaths', 'BuildRecipe']
 
 from pathlib2 import Path
 import yaml
 import logging
+import multiprocessing
 import os
 
 from .runner import *
 from .xcode import *
 from .platform import *
+from .artifact_store import ArtifactStore
+from .derived_data import DerivedData
 
 
 # TODO: This all needs to be cleaned up and made more generic. More configs will be added over time and this will only get worse
 # TODO: Allow config file to be relocated and specified on command line
 # TODO: Allow subcommands to easily override configs
 
+class SparsePaths(object):
+    """A set of included and excluded paths, relative to the root of a tree, that selects part of that tree.
+
+    >>> sparse = SparsePaths(include=['Source', 'Example.xcodeproj'], exclude=['Source/Tests'])
+    >>> [sparse.matches(path) for path in ['Source/a.swift', 'Source/Tests/b.swift', 'Docs/c.md', 'SourceExtra']]
+    [True, False, False, False]
+    >>> sparse.may_contain('Source'), sparse.may_contain('Docs')
+    (True, False)
+    >>> bool(SparsePaths())
+    False
+    """
+
+    def __init__(self, include=None, exclude=None):
+        # type: ([str], [str])
+        self.include = [path.strip('/') for path in include or []]
+        self.exclude = [path.strip('/') for path in exclude or []]
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    __nonzero__ = __bool__
+
+    def to_dict(self):
+        # type: () -> dict
+        return {'include': self.include, 'exclude': self.exclude}
+
+    @staticmethod
+    def _within(path, parents):
+        return any(path == parent or path.startswith(parent + '/') for parent in parents)
+
+    def matches(self, path):
+        # type: (str) -> bool
+        """Return True if path is part of the selection."""
+        if self._within(path, self.exclude):
+            return False
+        return not self.include or self._within(path, self.include)
+
+    def may_contain(self, path):
+        # type: (str) -> bool
+        """Return True if path is, or is a directory that contains, part of the selection."""
+        if self._within(path, self.exclude):
+            return False
+        return not self.include or any(self._within(include, [path]) for include in self.include) or self._within(path, self.include)
+
+
+class BuildRecipe(object):
+    """How to build a dependency: the project (relative to the checkout) and the schemes to build, each with the SDKs
+    it supports, and optionally the name of the product to keep and the configuration to build by default. Punic builds
+    a dependency with a recipe without looking for projects or asking xcodebuild about them.
+
+    >>> recipe = BuildRecipe.from_dict({'project': 'Example.xcodeproj', 'schemes': {'Example-iOS': ['iphoneos', 'iphonesimulator'], 'Example-macOS': ['macosx']}})
+    >>> [name for name in recipe.schemes if 'macosx' in recipe.schemes[name]]
+    ['Example-macOS']
+    >>> BuildRecipe.from_dict({'project': 'Example.xcodeproj', 'schemes': ['Example'], 'sdks': ['macosx']}).to_dict()
+    {'project': 'Example.xcodeproj', 'schemes': {'Example': ['macosx']}}
+    """
+
+    def __init__(self, project, schemes, product=None, configuration=None):
+        # type: (str, dict, str, str)
+        self.project = project
+        # Scheme names and the SDKs they support (None to ask the project).
+        self.schemes = schemes
+        self.product = product
+        self.configuration = configuration
+
+    @classmethod
+    def from_dict(cls, d):
+        # type: (dict) -> BuildRecipe
+        if not isinstance(d, dict) or not d.get('project') or not d.get('schemes'):
+            raise Exception('A build recipe needs a project and schemes, got: {}'.format(d))
+        schemes = d['schemes']
+        if not isinstance(schemes, dict):
+            schemes = dict((name, d.get('sdks')) for name in schemes)
+        return BuildRecipe(project=d['project'], schemes=schemes, product=d.get('product'), configuration=d.get('configuration'))
+
+    def to_dict(self):
+        # type: () -> dict
+        d = {'project': self.project, 'schemes': self.schemes}
+        if self.product:
+            d['product'] = self.product
+        if self.configuration:
+            d['configuration'] = self.configuration
+        return d
+
+
 class Config(object):
-    def __init__(self):
-        self.xcode = None
+    def __init__(self, root_path=None):
+        self._xcode = None
+        self._xcode_version = None
         self.repo_overrides = dict()
 
-        self.root_path = Path.cwd()  # type: Path
+        self.root_path = Path(root_path) if root_path else Path.cwd()  # type: Path
 
         self.library_directory = Path('~/Library/Application Support/io.schwa.Punic').expanduser()
         if not self.library_directory.exists():
@@ -29,35 +118,78 @@ class Config(object):
         self.repo_cache_directory = self.library_directory / 'repo_cache'
         if not self.repo_cache_directory.exists():
             self.repo_cache_directory.mkdir(parents=True)
+        self.checkout_store_directory = self.library_directory / 'checkouts'
+        self.tarball_cache_directory = self.library_directory / 'tarballs'
+        self.artifact_store_directory = self.library_directory / 'artifacts'
         self.punic_path = self.root_path / 'Carthage'
         self.build_path = self.punic_path / 'Build'
         self.checkouts_path = self.punic_path / 'Checkouts'
 
         self.derived_data_path = self.library_directory / "DerivedData"
+        self.build_logs_path = self.library_directory / "Logs" / "xcodebuild"
 
         self.platforms = Platform.all
         self.configuration = None
 
         self.fetch = False
-        self.xcode = Xcode.default()
+        # Where the installed Xcodes are cached between runs, see Xcodes.
+        self.xcodes_cache_path = self.library_directory / 'xcodes.json'
 
         self.toolchain = None
+        self.jobs = multiprocessing.cpu_count()
+        # How many xcodebuild builds run at the same time (each with a share of the CPUs), see punic.scheduler.
+        self.build_jobs = max(1, multiprocessing.cpu_count() // 4)
         self.dry_run = False
+        # Build everything, even dependencies that are up to date (see punic.build_stamp) or in the artifact store.
+        self.force = False
         self.use_submodules = False
         self.use_ssh = False
+        self.shared_checkouts = False
+        self.use_tarballs = False
+        self.cache_size = 64
+        self.cache_ttl = None
+        # Megabytes, 0 to not store build outputs at all.
+        self.artifact_store_size = 2048
+        # Megabytes, 0 to let derived data grow without limit.
+        self.derived_data_size = 20480
 
         self.skips = []
+        self.sparse_checkouts = dict()
+        self.recipes = dict()
 
         self.verbose = False
         self.echo = False
+        self.log_timings = False
+        # Collect the timing of every xcodebuild build (see punic.build_timing).
+        self.build_timing = False
 
         # Read in defaults from punic.yaml (or punic.yml if that exists)
-        punic_configuration_path = Path('punic.yaml')
+        punic_configuration_path = self.root_path / 'punic.yaml'
         if not punic_configuration_path.exists():
-            punic_configuration_path = Path('punic.yml')
+            punic_configuration_path = self.root_path / 'punic.yml'
         if punic_configuration_path.exists():
             self.read(punic_configuration_path)
-        runner.cache_path = self.library_directory / "cache.shelf"
+
+    def make_runner(self):
+        # type: () -> Runner
+        """Return a new Runner set up for this configuration (result cache, concurrency and echo)."""
+        runner = Runner(cache_path=self.library_directory / "cache.sqlite")
+        runner.cache_max_size = self.cache_size * 1024 * 1024
+        runner.cache_ttl = self.cache_ttl
+        runner.jobs = self.jobs
+        runner.echo = self.echo
+        return runner
+
+    def make_artifact_store(self):
+        # type: () -> ArtifactStore
+        """Return the store of build outputs, or None if it is disabled."""
+        if not self.artifact_store_size:
+            return None
+        return ArtifactStore(self.artifact_store_directory, max_size=self.artifact_store_size * 1024 * 1024)
+
+    def make_derived_data(self):
+        # type: () -> DerivedData
+        return DerivedData(self.derived_data_path, max_size=self.derived_data_size * 1024 * 1024)
 
     def update(self, **kwargs):
         for key, value in sorted(kwargs.items()):
@@ -92,18 +224,30 @@ class Config(object):
             logging.info('{:{key_width}}: {}'.format(key, value, key_width = key_width + 1))
         logging.info('#' * 80)
 
+    def find_xcode(self, xcodes):
+        # type: (Xcodes) -> Xcode
+        """Return the Xcode to build with, out of the session's xcodes: the one for `xcode_version` if set, otherwise
+        the default one.
+
+        Finding the installed Xcodes is deferred until this is first needed, so commands that don't need a toolchain
+        never look for one."""
+        if not self._xcode:
+            if self._xcode_version:
+                self._xcode = xcodes.with_version(self._xcode_version)
+                if not self._xcode:
+                    raise Exception('Could not find xcode version: {}'.format(self._xcode_version))
+            else:
+                self._xcode = xcodes.default()
+        return self._xcode
+
     @property
     def xcode_version(self):
-        return self.xcode.version if self.xcode else None
+        return self._xcode.version if self._xcode else self._xcode_version
 
     @xcode_version.setter
     def xcode_version(self, value):
-        xcode = Xcode.with_version(value)
-        if value and not xcode:
-            raise Exception('Could not find xcode version: {}'.format(value))
-        if not xcode:
-            xcode = Xcode.default()
-        self.xcode = xcode
+        self._xcode_version = value
+        self._xcode = None
 
     def read(self, path):
         # type: (Path)
@@ -125,10 +269,34 @@ class Config(object):
             if 'use-ssh' in defaults:
                 self.use_ssh = defaults['use-ssh']
 
+            if 'shared-checkouts' in defaults:
+                self.shared_checkouts = defaults['shared-checkouts']
+
+            if 'use-tarballs' in defaults:
+                self.use_tarballs = defaults['use-tarballs']
+
+            if 'cache-size' in defaults:
+                self.cache_size = defaults['cache-size']
+            if 'cache-ttl' in defaults:
+                self.cache_ttl = defaults['cache-ttl']
+            if 'artifact-store-size' in defaults:
+                self.artifact_store_size = defaults['artifact-store-size']
+            if 'derived-data-size' in defaults:
+                self.derived_data_size = defaults['derived-data-size']
+
         if 'repo-overrides' in d:
             self.repo_overrides = d['repo-overrides']
 
         if 'skips' in d:
             self.skips = d['skips'] or []
 
-config = Config()
+        if 'sparse-checkouts' in d:
+            for name, paths in (d['sparse-checkouts'] or {}).items():
+                if isinstance(paths, dict):
+                    self.sparse_checkouts[name] = SparsePaths(include=paths.get('include'), exclude=paths.get('exclude'))
+                else:
+                    self.sparse_checkouts[name] = SparsePaths(include=paths)
+
+        if 'recipes' in d:
+            for name, recipe in (d['recipes'] or {}).items():
+                self.recipes[name] = BuildRecipe.from_dict(recipe)
@@ -36,9 +36,8 @@ def platform_nicknames():
     return sorted([p.nickname for p in Platform.all])
 
 
-def _xcode_versions():
-    Xcode.find_all()
-    return sorted([six.text_type(version) for version in Xcode._all_xcodes.keys()])
+def _xcode_versions(xcodes):
+    return sorted([six.text_type(version) for version in xcodes.find_all().keys()])
 
 
 def _prompt(s, items, default=None):
@@ -56,7 +55,7 @@ def _prompt(s, items, default=None):
     return text
 
 
-def config_init(**kwargs):
+def config_init(xcodes, **kwargs):
     """Generate punic configuration file."""
 
     kwargs['xcode_version'] = None
@@ -71,7 +70,7 @@ def config_init(**kwargs):
     if platform:
         d['defaults']['platform'] = platform
 
-    xcode_version = _prompt("Xcode Version", _xcode_versions())
+    xcode_version = _prompt("Xcode Version", _xcode_versions(xcodes))
     if xcode_version:
         d['defaults']['xcode-version'] = xcode_version
 
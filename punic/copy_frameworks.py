@@ -27,6 +27,7 @@ def copy_frameworks_main():
     platform_display_name = os.environ['PLATFORM_DISPLAY_NAME']
     punic_builds_dir = project_dir / 'Carthage' / 'Build' / platform_display_name
     action = os.environ['ACTION']
+    runner = Runner()
 
     for input_path in input_files:
 
@@ -56,7 +57,7 @@ def copy_frameworks_main():
 
         if code_signing_allowed:
             # Find out what architectures the framework has
-            output = runner.check_call(['/usr/bin/xcrun', 'lipo', '-info', binary_path])
+            output = runner.check_run(['/usr/bin/xcrun', 'lipo', '-info', binary_path])
             match = re.match(r'^Architectures in the fat file: (.+) are: (.+)'.format(binary_path), output)
             assert match.groups()[0] == str(binary_path)
             architectures = set(match.groups()[1].strip().split(' '))
@@ -72,7 +73,7 @@ def copy_frameworks_main():
             # For each invalid architecture strip it from framework
             for architecture in excluded_architectures:
                 logging.info('\tStripping "{}" from "{}"'.format(architecture, framework_name))
-                output = runner.check_call(['/usr/bin/xcrun', 'lipo', '-remove', architecture, '-output', binary_path, binary_path])
+                output = runner.check_run(['/usr/bin/xcrun', 'lipo', '-remove', architecture, '-output', binary_path, binary_path])
 
                 # Resign framework
                 logging.info('\tResigning "{}"/"{}" with "{}"'.format(framework_name, architecture, expanded_identity))
@@ -80,12 +81,12 @@ def copy_frameworks_main():
             logging.info('\tCode signing: "$SYMROOT/{}"'.format(binary_path.relative_to(sym_root)))
 
             # noinspection PyUnusedLocal
-            result = runner.check_call(['/usr/bin/xcrun', 'codesign', '--force', '--sign', expanded_identity, '--preserve-metadata=identifier,entitlements', binary_path])
+            result = runner.check_run(['/usr/bin/xcrun', 'codesign', '--force', '--sign', expanded_identity, '--preserve-metadata=identifier,entitlements', binary_path])
         else:
             logging.info('\tCode signing not allowed. Skipping.')
 
         if action == 'install':
-            uuids = uuids_from_binary(binary_path)
+            uuids = uuids_from_binary(binary_path, runner)
 
             # Copy dSYM files from $PROJECT_DIRCarthage/Build to $BUILT_PRODUCTS_DIR
             dsym_path = input_path.parent / (binary_path.name + '.dSYM')
@@ -0,0 +1,116 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['DerivedData']
+
+import json
+import logging
+import os
+import threading
+import time
+
+from pathlib2 import Path
+
+import punic.shshutil as shutil
+
+
+class DerivedData(object):
+    """Punic's derived data directory, partitioned by dependency, Xcode version and toolchain.
+
+    Each partition keeps the incremental build state of one dependency built with one Xcode and toolchain, so switching
+    Xcode (or building another dependency) never throws it away and builds running at the same time never share it.
+    A partition is marked with a small file recording its size and, by its modification time, when it was last used.
+    prune() removes the least recently used partitions until the total is within `max_size` (if set); anything in the
+    directory that isn't a partition is left alone.
+
+    >>> import tempfile
+    >>> derived_data = DerivedData(tempfile.mkdtemp())
+    >>> path = derived_data.partition('Example', '10.0', toolchain='com.apple.dt.toolchain.Swift_4_2')
+    >>> str(path.relative_to(derived_data.path))
+    'Example/Xcode-10.0-com.apple.dt.toolchain.Swift_4_2'
+    >>> derived_data.partition('Example', '10.0').name
+    'Xcode-10.0'
+    """
+
+    marker_name = '.punic-partition.json'
+
+    def __init__(self, path, max_size=None):
+        self.path = Path(path)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._used = set()
+
+    def partition(self, dependency, xcode_version, toolchain=None):
+        # type: (str, Any, str) -> Path
+        """Return the derived data path for builds of dependency with an Xcode version and toolchain, marking it as used."""
+        name = 'Xcode-{}'.format(xcode_version) + ('-{}'.format(toolchain) if toolchain else '')
+        path = self.path / dependency.replace(os.sep, '_') / name.replace(os.sep, '_')
+        with self._lock:
+            self._used.add(path)
+            if not path.exists():
+                path.mkdir(parents=True)
+            marker = self._read_marker(path)
+            marker.update({'dependency': dependency, 'xcode_version': str(xcode_version), 'toolchain': toolchain})
+            self._write_marker(path, marker)
+        return path
+
+    def record_size(self, path):
+        # type: (Path)
+        """Record the size of a partition, once a build in it has finished."""
+        size = shutil.tree_size(path)
+        with self._lock:
+            marker = self._read_marker(path)
+            marker['size'] = size
+            self._write_marker(path, marker)
+
+    def partitions(self):
+        # type: () -> [(float, int, Path)]
+        """Return the (last used, size, path) of every partition, least recently used first."""
+        partitions = []
+        for dependency_path in _directories(self.path):
+            for path in _directories(dependency_path):
+                marker_path = path / self.marker_name
+                if not marker_path.exists():
+                    continue
+                marker = self._read_marker(path)
+                size = marker.get('size')
+                if size is None:
+                    size = shutil.tree_size(path)
+                partitions.append((marker_path.stat().st_mtime, size, path))
+        return sorted(partitions)
+
+    def prune(self):
+        """Remove the least recently used partitions (other than those used by this session) until the derived data
+        is within max_size."""
+        if not self.max_size:
+            return
+        with self._lock:
+            partitions = self.partitions()
+            total_size = sum(size for _, size, _ in partitions)
+            for last_used, size, path in partitions:
+                if total_size <= self.max_size:
+                    break
+                if path in self._used:
+                    continue
+                logging.debug('<sub>Pruning derived data</sub>: <ref>{}</ref> ({} MB, last used {})'.format(path.relative_to(self.path), size // (1024 * 1024), time.ctime(last_used)))
+                shutil.remove(path)
+                total_size -= size
+                if not any(path.parent.iterdir()):
+                    path.parent.rmdir()
+
+    def _read_marker(self, path):
+        try:
+            return json.load((path / self.marker_name).open())
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def _write_marker(self, path, marker):
+        # Rewriting the marker is what marks the partition as used.
+        with open(str(path / self.marker_name), 'w') as stream:
+            json.dump(marker, stream)
+
+
+def _directories(path):
+    if not path.is_dir():
+        return []
+    return sorted(child for child in path.iterdir() if child.is_dir() and not child.is_symlink())
+
@@ -16,6 +16,15 @@ class PunicRepresentableError(Exception):
     pass
 
 
+class XcodeBuildError(Exception):
+    def __init__(self, return_code, command, output, log_path):
+        super(XcodeBuildError, self).__init__('xcodebuild failed with result code {}'.format(return_code))
+        self.return_code = return_code
+        self.command = command
+        self.output = output
+        self.log_path = log_path
+
+
 class NoSuchRevision(Exception):
     def __init__(self, repository, revision):
         self.repository = repository
@@ -37,6 +46,12 @@ def error_handling():
         logging.error('<err>Error</err>: No such revision {} found in repository {}'.format(e.revision, e.repository))
         logging.error('Are you sure you are using the latest bits? Try an explicit `punic fetch` or use `punic bootstrap` instead of `punic build`')
         exit(-1)
+    except XcodeBuildError as e:
+        logging.error('<err>Error</err>: Failed to build - result code <echo>{}</echo>'.format(e.return_code))
+        logging.error('Command: <echo>{}</echo>'.format(e.command))
+        logging.error(e.output)
+        logging.error('Full log: <ref>{}</ref>'.format(e.log_path))
+        exit(e.return_code)
     except PunicRepresentableError as e:
         logging.error(e.message)
         exit(-1)
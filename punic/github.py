@@ -9,7 +9,7 @@ from jsonpath_rw import jsonpath, parse
 # import iso8601
 # import sys
 # import re
-from memoize import mproperty
+from .utilities import mproperty
 import subprocess
 import shlex
 
@@ -20,9 +20,9 @@ def make_graph(punic, open):
             nx.drawing.nx_pydot.write_dot(graph, 'graph.dot')
 
             command = 'dot graph.dot -ograph.png -Tpng'
-            if runner.can_run(command):
+            if punic.runner.can_run(command):
                 logging.info('Rendering dot file to png file.')
-                runner.check_run(command)
+                punic.runner.check_run(command)
                 if open:
                     click.launch('graph.png')
             else:
@@ -0,0 +1,458 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['parse_plist', 'PBXProject', 'ProjectReader', 'workspace_projects']
+
+import getpass
+import logging
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+
+import six
+from pathlib2 import Path
+
+from .utilities import mproperty
+
+# One token of an old-style (NeXTSTEP) property list: whitespace and comments (skipped), a quoted string, an unquoted
+# string, data, or punctuation. Anything else is an error.
+_plist_token_pattern = re.compile(r'''
+    (?:\s+|//[^\n]*|/\*.*?\*/)+
+    |"(?P<quoted>(?:[^"\\]|\\.)*)"
+    |(?P<unquoted>[A-Za-z0-9_$+/:.\-]+)
+    |<(?P<data>[0-9A-Fa-f\s]*)>
+    |(?P<punctuation>[{}()=;,])
+    ''', re.VERBOSE | re.DOTALL)
+
+_plist_escapes = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v'}
+_plist_escape_pattern = re.compile(r'\\(U[0-9A-Fa-f]{4}|[0-7]{1,3}|.)', re.DOTALL)
+
+
+def _unescape(string):
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] == 'U' and len(escape) == 5:
+            return six.unichr(int(escape[1:], 16))
+        if escape[0] in '01234567':
+            return six.unichr(int(escape, 8))
+        return _plist_escapes.get(escape, escape)
+
+    return _plist_escape_pattern.sub(replace, string) if '\\' in string else string
+
+
+def _tokenize(string):
+    position = 0
+    length = len(string)
+    match_at = _plist_token_pattern.match
+    while position < length:
+        match = match_at(string, position)
+        if not match:
+            raise ValueError('Unexpected {!r} at offset {} of property list'.format(string[position:position + 20], position))
+        position = match.end()
+        kind = match.lastgroup
+        if kind == 'quoted':
+            yield 'string', _unescape(match.group(kind))
+        elif kind == 'unquoted':
+            yield 'string', match.group(kind)
+        elif kind == 'data':
+            yield 'data', bytearray.fromhex(re.sub(r'\s', '', match.group(kind)))
+        elif kind == 'punctuation':
+            yield match.group(kind), None
+
+
+def parse_plist(string):
+    # type: (str) -> Any
+    """Parse an old-style property list, the format of project.pbxproj.
+
+    >>> parse_plist('// !$*UTF8*$!\\n{ a = 1; b = ( x, "y z", ); /* comment */ c = { d = "\\\\"q\\\\""; }; }')
+    {'a': '1', 'b': ['x', 'y z'], 'c': {'d': '"q"'}}
+    """
+    tokens = _tokenize(string)
+
+    def expect(expected):
+        kind, value = six.next(tokens)
+        if kind != expected:
+            raise ValueError('Expected {!r} in property list, found {!r}'.format(expected, value if value is not None else kind))
+
+    def parse_value(kind, value):
+        if kind in ('string', 'data'):
+            return value
+        if kind == '{':
+            result = dict()
+            for kind, key in tokens:
+                if kind == '}':
+                    return result
+                if kind != 'string':
+                    raise ValueError('Expected a key in property list, found {!r}'.format(kind))
+                expect('=')
+                result[key] = parse_value(*six.next(tokens))
+                expect(';')
+            raise ValueError('Unterminated dictionary in property list')
+        if kind == '(':
+            result = []
+            for kind, value in tokens:
+                if kind == ')':
+                    return result
+                result.append(parse_value(kind, value))
+                kind, value = six.next(tokens)
+                if kind == ')':
+                    return result
+                if kind != ',':
+                    raise ValueError('Expected \',\' in property list, found {!r}'.format(value if value is not None else kind))
+            raise ValueError('Unterminated array in property list')
+        raise ValueError('Unexpected {!r} in property list'.format(kind))
+
+    try:
+        result = parse_value(*six.next(tokens))
+    except StopIteration:
+        raise ValueError('Unexpected end of property list')
+    for kind, value in tokens:
+        raise ValueError('Unexpected {!r} after the end of property list'.format(value if value is not None else kind))
+    return result
+
+
+########################################################################################################################
+
+# The Mach-O and package types xcodebuild reports (MACH_O_TYPE and PACKAGE_TYPE) for each kind of target.
+_product_types = {
+    'com.apple.product-type.framework': ('mh_dylib', 'com.apple.package-type.wrapper.framework'),
+    'com.apple.product-type.framework.static': ('staticlib', 'com.apple.package-type.wrapper.framework'),
+    'com.apple.product-type.library.dynamic': ('mh_dylib', 'com.apple.package-type.mach-o-dylib'),
+    'com.apple.product-type.library.static': ('staticlib', 'com.apple.package-type.static-library'),
+    'com.apple.product-type.application': ('mh_execute', 'com.apple.package-type.wrapper.application'),
+    'com.apple.product-type.tool': ('mh_execute', 'com.apple.package-type.mach-o-executable'),
+    'com.apple.product-type.bundle': ('mh_bundle', 'com.apple.package-type.wrapper.cfbundle'),
+    'com.apple.product-type.bundle.unit-test': ('mh_bundle', 'com.apple.package-type.wrapper.cfbundle'),
+    'com.apple.product-type.bundle.ui-testing': ('mh_bundle', 'com.apple.package-type.wrapper.cfbundle'),
+}
+
+# The platforms each base SDK supports (SUPPORTED_PLATFORMS when not set explicitly).
+_sdk_platforms = {
+    'macosx': 'macosx',
+    'iphoneos': 'iphonesimulator iphoneos',
+    'appletvos': 'appletvsimulator appletvos',
+    'watchos': 'watchsimulator watchos',
+    'xros': 'xrsimulator xros',
+}
+
+# #include "Other.xcconfig" (or #include? for an optional one) in an xcconfig file.
+_xcconfig_include_pattern = re.compile(r'^\s*#include\??\s*"(?P<path>[^"]+)"', re.MULTILINE)
+
+# $(NAME), ${NAME} or $(NAME:modifier)
+_setting_reference_pattern = re.compile(r'\$[({](?P<name>[A-Za-z0-9_]+)(?P<modifier>:[^)}]*)?[)}]')
+
+
+class _Unresolved(Exception):
+    pass
+
+
+class PBXProject(object):
+    """A project read from its project.pbxproj."""
+
+    def __init__(self, path):
+        # type: (Path)
+        self.path = path
+
+    def __repr__(self):
+        return 'PBXProject({})'.format(self.path)
+
+    @mproperty
+    def plist(self):
+        with (self.path / 'project.pbxproj').open('rb') as stream:
+            return parse_plist(stream.read().decode('utf-8'))
+
+    @property
+    def objects(self):
+        return self.plist['objects']
+
+    @property
+    def root(self):
+        return self.objects[self.plist['rootObject']]
+
+    @property
+    def target_ids(self):
+        return self.root['targets']
+
+    @property
+    def target_names(self):
+        return [self.objects[target_id]['name'] for target_id in self.target_ids]
+
+    def target_id_named(self, name):
+        return next((target_id for target_id in self.target_ids if self.objects[target_id]['name'] == name), None)
+
+    @property
+    def configurations(self):
+        configuration_list = self.objects[self.root['buildConfigurationList']]
+        return [self.objects[configuration_id]['name'] for configuration_id in configuration_list['buildConfigurations']]
+
+    @property
+    def default_configuration(self):
+        return self.objects[self.root['buildConfigurationList']].get('defaultConfigurationName')
+
+    def _file_reference_path(self, object_id, parents):
+        # type: (str, dict) -> Path
+        """Return the path of a file reference or group, or None if it is relative to something only Xcode knows."""
+        item = self.objects[object_id]
+        source_tree = item.get('sourceTree', '<group>')
+        path = item.get('path', '')
+        source_root = self.path.parent / self.root.get('projectDirPath', '')
+        if source_tree == '<absolute>':
+            return Path(path)
+        if source_tree == 'SOURCE_ROOT':
+            return source_root / path
+        if source_tree == '<group>':
+            # The main group (which has no parent) is relative to the source root.
+            parent_id = parents.get(object_id)
+            parent_path = self._file_reference_path(parent_id, parents) if parent_id else source_root
+            return parent_path / path if parent_path is not None else None
+        return None
+
+    @property
+    def xcconfig_paths(self):
+        # type: () -> [Path]
+        """Return the xcconfig files the project's build configurations (and its targets') are based on, and the files
+        they include."""
+        parents = dict()
+        for object_id, item in self.objects.items():
+            for child_id in item.get('children', []):
+                parents[child_id] = object_id
+        paths = []
+        for item in self.objects.values():
+            if item.get('isa') == 'XCBuildConfiguration' and item.get('baseConfigurationReference') in self.objects:
+                path = self._file_reference_path(item['baseConfigurationReference'], parents)
+                if path is not None and path not in paths:
+                    paths.append(path)
+        for path in paths:
+            # Appending while iterating follows includes of includes, each file once.
+            for include_path in _xcconfig_includes(path):
+                if include_path not in paths:
+                    paths.append(include_path)
+        return paths
+
+    def _configuration(self, configuration_list_id, name):
+        # type: (str, str) -> (dict, bool)
+        """Return the build settings of the named configuration and whether an xcconfig file adds to them."""
+        configuration_list = self.objects[configuration_list_id] if configuration_list_id else {}
+        for configuration_id in configuration_list.get('buildConfigurations', []):
+            configuration = self.objects[configuration_id]
+            if configuration['name'] == name:
+                return configuration.get('buildSettings', {}), 'baseConfigurationReference' in configuration
+        return {}, False
+
+    def target_settings(self, target_id, configuration=None):
+        # type: (str, str) -> dict
+        """Return TARGET_NAME, MACH_O_TYPE, PACKAGE_TYPE and SUPPORTED_PLATFORMS for a target, as xcodebuild would
+        report them, or None if a setting depends on something that isn't in the project file (an xcconfig file, a
+        build-time setting or a conditional setting)."""
+        target = self.objects[target_id]
+        configuration = configuration or self.default_configuration
+        target_level, target_xcconfig = self._configuration(target.get('buildConfigurationList'), configuration)
+        project_level, project_xcconfig = self._configuration(self.root['buildConfigurationList'], configuration)
+        mach_o_type, package_type = _product_types.get(target.get('productType'), (None, None))
+        # From highest to lowest precedence. An xcconfig file (None) sits between the level it is based on and the next
+        # one, anything not found above it could be set in it.
+        levels = [target_level] + ([None] if target_xcconfig else []) + [project_level] + ([None] if project_xcconfig else [])
+        defaults = {
+            'TARGET_NAME': lambda: target['name'],
+            'PRODUCT_NAME': lambda: lookup('TARGET_NAME'),
+            'MACH_O_TYPE': lambda: mach_o_type or '',
+            'SUPPORTED_PLATFORMS': lambda: _sdk_platforms[lookup('SDKROOT')] if lookup('SDKROOT') in _sdk_platforms else unresolved('SDKROOT'),
+        }
+
+        def unresolved(name):
+            raise _Unresolved(name)
+
+        def lookup(name, level=0, depth=0):
+            if depth > 32:
+                unresolved(name)
+            for index in range(level, len(levels)):
+                if levels[index] is None:
+                    if name == 'TARGET_NAME':
+                        continue
+                    unresolved(name)
+                if any(key.startswith(name + '[') for key in levels[index]):
+                    unresolved(name)
+                value = levels[index].get(name)
+                if value is not None:
+                    break
+            else:
+                if name in defaults:
+                    return defaults[name]()
+                unresolved(name)
+            if isinstance(value, list):
+                value = ' '.join(value)
+
+            def substitute(match):
+                if match.group('modifier'):
+                    unresolved(match.group('name'))
+                if match.group('name') == 'inherited':
+                    return lookup(name, index + 1, depth + 1)
+                return lookup(match.group('name'), 0, depth + 1)
+
+            return _setting_reference_pattern.sub(substitute, value).strip()
+
+        try:
+            return {
+                'TARGET_NAME': target['name'],
+                'MACH_O_TYPE': lookup('MACH_O_TYPE') or None,
+                'PACKAGE_TYPE': package_type,
+                'SUPPORTED_PLATFORMS': lookup('SUPPORTED_PLATFORMS'),
+            }
+        except _Unresolved as e:
+            logging.debug('<sub>Can\'t resolve {} of {} in {} without xcodebuild</sub>'.format(e, target['name'], self.path.name))
+            return None
+
+
+def _xcconfig_includes(path):
+    # type: (Path) -> [Path]
+    """Return the files an xcconfig file includes (other than those relative to a directory only Xcode knows, like
+    <DEVELOPER_DIR>)."""
+    try:
+        with path.open('rb') as stream:
+            text = stream.read().decode('utf-8', 'replace')
+    except (IOError, OSError):
+        return []
+    return [path.parent / include for include in _xcconfig_include_pattern.findall(text) if not include.startswith('<')]
+
+
+########################################################################################################################
+
+# A project in a workspace, e.g. <FileRef location = "group:Example/Example.xcodeproj">
+_workspace_project_pattern = re.compile(r'location\s*=\s*"(group|container|absolute):([^"]+\.xcodeproj)"')
+
+
+def workspace_projects(path):
+    # type: (Path) -> [Path]
+    """Return the paths of the projects in a workspace."""
+    data_path = path / 'contents.xcworkspacedata'
+    if not data_path.exists():
+        return []
+    with data_path.open() as stream:
+        locations = _workspace_project_pattern.findall(stream.read())
+    return [Path(location) if kind == 'absolute' else path.parent / location for kind, location in locations]
+
+
+class _Scheme(object):
+    def __init__(self, path, container_path):
+        self.path = path
+        # Where the scheme's references are relative to: the directory containing the project or workspace.
+        self.container_path = container_path
+
+    @mproperty
+    def element(self):
+        return ElementTree.parse(str(self.path)).getroot()
+
+    @property
+    def buildable_references(self):
+        # type: () -> [(Path, str, str)]
+        """Return the (project path, target id, target name) of every target built for running."""
+        references = []
+        for entry in self.element.findall('BuildAction/BuildActionEntries/BuildActionEntry'):
+            if entry.get('buildForRunning', 'YES') != 'YES':
+                continue
+            for reference in entry.findall('BuildableReference'):
+                container = reference.get('ReferencedContainer', '')
+                if not container.startswith('container:'):
+                    continue
+                project_path = Path(os.path.normpath(str(self.container_path / container[len('container:'):])))
+                references.append((project_path, reference.get('BlueprintIdentifier'), reference.get('BlueprintName')))
+        return references
+
+    @property
+    def configuration(self):
+        launch_action = self.element.find('LaunchAction')
+        return launch_action.get('buildConfiguration') if launch_action is not None else None
+
+
+class ProjectReader(object):
+    """Reads what punic needs to know about a project or workspace (its targets, configurations, schemes, the targets
+    each scheme builds and whether they build frameworks) straight from its files, without running xcodebuild.
+
+    Every method returns None for anything that can't be worked out from the files; callers then ask xcodebuild.
+    """
+
+    def __init__(self, path):
+        # type: (Path)
+        self.path = path
+        self._projects = dict()
+
+    def project(self, path):
+        # type: (Path) -> PBXProject
+        path = Path(os.path.normpath(str(path)))
+        if path not in self._projects:
+            self._projects[path] = PBXProject(path)
+        return self._projects[path]
+
+    @property
+    def is_workspace(self):
+        return self.path.suffix == '.xcworkspace'
+
+    @mproperty
+    def schemes(self):
+        # type: () -> dict
+        """The shared schemes (and the current user's schemes) of the project, or of the workspace and its projects,
+        keyed by name."""
+        containers = [self.path] + (workspace_projects(self.path) if self.is_workspace else [])
+        schemes = dict()
+        for container in reversed(containers):
+            patterns = ['xcuserdata/{}.xcuserdatad/xcschemes/*.xcscheme'.format(getpass.getuser()), 'xcshareddata/xcschemes/*.xcscheme']
+            for pattern in patterns:
+                for path in sorted(container.glob(pattern)):
+                    schemes[path.stem] = _Scheme(path, container.parent)
+        return schemes
+
+    @mproperty
+    def info(self):
+        # type: () -> ([str], [str], [str], str)
+        """Return the same (targets, configurations, schemes, default configuration) as `xcodebuild -list`."""
+        # Without any schemes xcodebuild makes some up, we leave that to it.
+        if not self.schemes:
+            return None
+        try:
+            schemes = sorted(self.schemes)
+            if self.is_workspace:
+                return [], [], schemes, None
+            project = self.project(self.path)
+            return project.target_names, project.configurations, schemes, project.default_configuration
+        except (ValueError, KeyError, IOError) as e:
+            logging.debug('<sub>Can\'t read {}: {}</sub>'.format(self.path.name, e))
+            return None
+
+    def _scheme_targets(self, scheme_name):
+        # type: (str) -> [(PBXProject, str)]
+        scheme = self.schemes.get(scheme_name)
+        if not scheme:
+            return None
+        targets = []
+        for project_path, target_id, target_name in scheme.buildable_references:
+            project = self.project(project_path)
+            if target_id not in project.objects:
+                target_id = project.target_id_named(target_name)
+                if not target_id:
+                    return None
+            targets.append((project, target_id))
+        return targets
+
+    def scheme_target_names(self, scheme_name):
+        # type: (str) -> [str]
+        """Return the names of the targets the scheme builds."""
+        try:
+            targets = self._scheme_targets(scheme_name)
+            return [project.objects[target_id]['name'] for project, target_id in targets] if targets is not None else None
+        except (ValueError, KeyError, IOError, ElementTree.ParseError) as e:
+            logging.debug('<sub>Can\'t read scheme {} of {}: {}</sub>'.format(scheme_name, self.path.name, e))
+            return None
+
+    def target_settings(self, scheme_name, target_name):
+        # type: (str, str) -> dict
+        """Return the settings punic needs (see `PBXProject.target_settings`) of one of the scheme's targets."""
+        try:
+            targets = self._scheme_targets(scheme_name)
+            if targets is None:
+                return None
+            for project, target_id in targets:
+                if project.objects[target_id]['name'] == target_name:
+                    return project.target_settings(target_id, self.schemes[scheme_name].configuration)
+            return None
+        except (ValueError, KeyError, IOError, ElementTree.ParseError) as e:
+            logging.debug('<sub>Can\'t read scheme {} of {}: {}</sub>'.format(scheme_name, self.path.name, e))
+            return None
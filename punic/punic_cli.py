@@ -25,14 +25,19 @@ from punic import *
 from .runner import *
 from .checkout import *
 from .search import *
+from .trace import *
+from .build_timing import *
+from .config import Config, BuildRecipe
 
 @click.group(cls=DYMGroup)
 @click.option('--echo', default=False, is_flag=True, help="""Echo all commands to terminal.""")
 @click.option('--verbose', default=False, is_flag=True, help="""Verbose logging.""")
 @click.option('--color/--no-color', default=True, is_flag=True, help="""TECHNICOLOR.""")
 @click.option('--timing/--no-timing', default=False, is_flag=True, help="""Log timing info""")
+@click.option('--trace', default=None, type=click.Path(dir_okay=False, writable=True), help="""Write a Chrome trace of every command run to this file and log a summary.""")
+@click.option('--timing-report', default=None, type=click.Path(dir_okay=False, writable=True), help="""Append the timing of every build (per target and phase) to this file, as JSON lines.""")
 @click.pass_context
-def punic_cli(context, echo, verbose, timing, color):
+def punic_cli(context, echo, verbose, timing, color, trace, timing_report):
     ### TODO: Clean this up!
 
     # Configure click
@@ -74,20 +79,42 @@ def punic_cli(context, echo, verbose, timing, color):
 
     formatter.color = color
     logger.color = color
-    runner.echo = echo
 
     # Set up punic
-    punic = Punic()
+    config = Config()
+    punic = Punic(config, config.make_runner())
     punic.config.log_timings = timing
+    punic.config.build_timing = timing or bool(timing_report)
     context.obj = punic
     punic.config.verbose = verbose
     punic.config.echo = verbose
+    punic.runner.echo = echo
+
+    if trace:
+        def write_trace():
+            ledger = sorted(punic.runner.ledger, key=lambda entry: entry.start)
+            write_chrome_trace(ledger, trace)
+            log_summary(ledger)
+            logging.info('Trace written to <ref>{}</ref>'.format(trace))
+        context.call_on_close(write_trace)
+
+    def report_build_timings():
+        if not punic.build_records:
+            return
+        if timing:
+            log_build_timings(punic.build_records)
+        if timing_report:
+            append_timing_report(punic.build_records, timing_report, xcode_version=str(punic.config.xcode_version))
+            logging.info('Build timings appended to <ref>{}</ref>'.format(timing_report))
+    context.call_on_close(report_build_timings)
 
 
 @punic_cli.command()
 @click.pass_context
 @click.option('--use-submodules', default=None, help="""Add dependencies as Git submodules""")
 @click.option('--use-ssh', default=None, help="""Use SSH for downloading GitHub repositories""")
+@click.option('--shared-checkouts', default=None, is_flag=True, help="""Link checkouts from a global store shared by all projects""")
+@click.option('--use-tarballs', default=None, is_flag=True, help="""Download GitHub dependencies as tarballs instead of cloning them""")
 def fetch(context, **kwargs):
     """Fetch the project's dependencies.."""
     logging.info("<cmd>fetch</cmd>")
@@ -95,7 +122,7 @@ def fetch(context, **kwargs):
     punic.config.fetch = True  # obviously
     punic.config.update(**kwargs)
 
-    with timeit('fetch'):
+    with timeit('fetch', log=punic.config.log_timings):
         with error_handling():
             punic.fetch()
 
@@ -115,7 +142,7 @@ def resolve(context, **kwargs):
     punic.config.update(**kwargs)
 
 
-    with timeit('resolve'):
+    with timeit('resolve', log=punic.config.log_timings):
         with error_handling():
             punic.resolve()
 
@@ -128,8 +155,12 @@ def resolve(context, **kwargs):
 @click.option('--xcode-version', default=None, help="""Xcode version to use""")
 @click.option('--toolchain', default=None, help="""Xcode toolchain to use""")
 @click.option('--dry-run', default=None, is_flag=True, help="""Do not actually perform final build""")
+@click.option('--jobs', 'build_jobs', default=None, type=int, help="""Number of builds to run at the same time""")
+@click.option('--force', default=None, is_flag=True, help="""Build dependencies even if they are up to date""")
 @click.option('--use-submodules', default=None, help="""Add dependencies as Git submodules""")
 @click.option('--use-ssh', default=None, is_flag=True, help="""Use SSH for downloading GitHub repositories""")
+@click.option('--shared-checkouts', default=None, is_flag=True, help="""Link checkouts from a global store shared by all projects""")
+@click.option('--use-tarballs', default=None, is_flag=True, help="""Download GitHub dependencies as tarballs instead of cloning them""")
 @click.argument('deps', nargs=-1)
 def build(context, **kwargs):
     """Fetch and build the project's dependencies."""
@@ -142,7 +173,7 @@ def build(context, **kwargs):
     logging.debug('Platforms: {}'.format(punic.config.platforms))
     logging.debug('Configuration: {}'.format(punic.config.configuration))
 
-    with timeit('build'):
+    with timeit('build', log=punic.config.log_timings):
         with error_handling():
             punic.build(dependencies=deps)
 
@@ -156,6 +187,10 @@ def build(context, **kwargs):
 @click.option('--toolchain', default=None, help="""Xcode toolchain to use""")
 @click.option('--use-submodules', default=None, help="""Add dependencies as Git submodules""")
 @click.option('--use-ssh', default=None, is_flag=True, help="""Use SSH for downloading GitHub repositories""")
+@click.option('--shared-checkouts', default=None, is_flag=True, help="""Link checkouts from a global store shared by all projects""")
+@click.option('--use-tarballs', default=None, is_flag=True, help="""Download GitHub dependencies as tarballs instead of cloning them""")
+@click.option('--jobs', 'build_jobs', default=None, type=int, help="""Number of builds to run at the same time""")
+@click.option('--force', default=None, is_flag=True, help="""Build dependencies even if they are up to date""")
 @click.argument('deps', nargs=-1)
 def update(context, **kwargs):
     """Update and rebuild the project's dependencies."""
@@ -165,7 +200,7 @@ def update(context, **kwargs):
 
     deps = kwargs['deps']
 
-    with timeit('update'):
+    with timeit('update', log=punic.config.log_timings):
         with error_handling():
             punic.resolve()
             punic.build(dependencies=deps)
@@ -182,7 +217,7 @@ def clean(context, derived_data, caches, build, all):
     logging.info("<cmd>Clean</cmd>")
     punic = context.obj
 
-    with timeit('clean'):
+    with timeit('clean', log=punic.config.log_timings):
         if build or all:
             logging.info('Erasing Carthage/Build directory')
             if punic.config.build_path.exists():
@@ -197,8 +232,18 @@ def clean(context, derived_data, caches, build, all):
             if punic.config.repo_cache_directory.exists():
                 logging.info('Erasing {}'.format(punic.config.repo_cache_directory))
                 shutil.rmtree(punic.config.repo_cache_directory)
+            if punic.config.checkout_store_directory.exists():
+                logging.info('Erasing {}'.format(punic.config.checkout_store_directory))
+                shutil.make_writable(punic.config.checkout_store_directory)
+                shutil.rmtree(punic.config.checkout_store_directory)
+            if punic.config.tarball_cache_directory.exists():
+                logging.info('Erasing {}'.format(punic.config.tarball_cache_directory))
+                shutil.rmtree(punic.config.tarball_cache_directory)
+            if punic.config.artifact_store_directory.exists():
+                logging.info('Erasing {}'.format(punic.config.artifact_store_directory))
+                shutil.rmtree(punic.config.artifact_store_directory)
             logging.info('Erasing run cache')
-            runner.reset()
+            punic.runner.reset()
 
 
 @punic_cli.command()
@@ -216,7 +261,7 @@ def graph(context, fetch, use_submodules, use_ssh, open):
         punic.config.use_submodules = use_submodules
     if use_ssh:
         punic.config.use_ssh = use_ssh
-    with timeit('graph'):
+    with timeit('graph', log=punic.config.log_timings):
         make_graph(punic, open)
 
 
@@ -263,6 +308,9 @@ def readme(context):
 @click.option('--toolchain', default=None, help="""Xcode toolchain to use""")
 @click.option('--use-submodules', default=None, help="""Add dependencies as Git submodules""")
 @click.option('--use-ssh', default=None, is_flag=True, help="""Use SSH for downloading GitHub repositories""")
+@click.option('--shared-checkouts', default=None, is_flag=True, help="""Link checkouts from a global store shared by all projects""")
+@click.option('--use-tarballs', default=None, is_flag=True, help="""Download GitHub dependencies as tarballs instead of cloning them""")
+@click.option('--emit-recipes', default=False, is_flag=True, help="""Print build recipes for punic.yaml instead, worked out from the projects (ignoring existing recipes)""")
 @click.argument('deps', nargs=-1)
 @click.pass_context
 def list(context, **kwargs):
@@ -271,6 +319,9 @@ def list(context, **kwargs):
     punic.config.update(**kwargs)
     deps = kwargs['deps']
 
+    if kwargs['emit_recipes']:
+        punic.config.recipes = dict()
+
     config = punic.config
 
     configuration, platforms = config.configuration, config.platforms
@@ -280,7 +331,28 @@ def list(context, **kwargs):
 
     filtered_dependencies = punic._ordered_dependencies(name_filter=deps)
 
-    checkouts = [Checkout(punic=punic, identifier=identifier, revision=revision) for identifier, revision in filtered_dependencies]
+    checkouts = [punic._checkout_for_identifier(identifier, revision) for identifier, revision in filtered_dependencies]
+
+    import yaml
+
+    if kwargs['emit_recipes']:
+        recipes = {}
+        for checkout in checkouts:
+            name = checkout.identifier.project_name
+            schemes = {}
+            projects = set()
+            for platform in platforms:
+                for project, scheme in checkout.schemes_for_platform(platform):
+                    projects.add(project)
+                    schemes[scheme.name] = sorted(sdk for sdk in scheme.supported_platform_names if sdk)
+            if len(projects) != 1:
+                logging.warn('<err>Warning:</err> No recipe for <ref>{}</ref>: it builds from {} projects.'.format(name, len(projects)))
+                continue
+            project = projects.pop()
+            recipe = BuildRecipe(str(project.path.relative_to(checkout.checkout_path)), schemes, configuration=project.default_configuration)
+            recipes[name] = recipe.to_dict()
+        yaml.safe_dump({'recipes': recipes}, stream=sys.stdout, default_flow_style=False)
+        return
 
     tree = {}
 
@@ -288,16 +360,11 @@ def list(context, **kwargs):
         tree[platform.name] = {}
         for checkout in checkouts:
             tree[platform.name][str(checkout.identifier)] = {'projects':{}}
-            checkout.prepare()
+            projects = tree[platform.name][str(checkout.identifier)]['projects']
             for project in checkout.projects:
-                tree[platform.name][str(checkout.identifier)]['projects'][project.path.name] = {'schemes':{}}
-                tree[platform.name][str(checkout.identifier)]['projects'][project.path.name]['path'] = str(project.path.relative_to(config.checkouts_path))
-                schemes = project.schemes
-                schemes = [scheme for scheme in schemes if scheme.framework_targets]
-                schemes = [scheme for scheme in schemes if platform.device_sdk in scheme.supported_platform_names]
-                tree[platform.name][str(checkout.identifier)]['projects'][project.path.name]['schemes'] = [scheme.name for scheme in schemes]
-
-    import yaml
+                projects[project.path.name] = {'schemes': [], 'path': str(project.path.relative_to(config.checkouts_path))}
+            for project, scheme in checkout.schemes_for_platform(platform):
+                projects[project.path.name]['schemes'].append(scheme.name)
 
     yaml.safe_dump(tree, stream = sys.stdout)
 
@@ -308,7 +375,7 @@ def list(context, **kwargs):
 @click.option('--xcode', default=None)
 def init(context, **kwargs):
     """Generate punic configuration file."""
-    config_init(**kwargs)
+    config_init(context.obj.xcodes, **kwargs)
 
 
 @punic_cli.group(cls=DYMGroup)
@@ -329,7 +396,7 @@ def publish(context, xcode_version, force):
         punic = context.obj
         if xcode_version:
             punic.config.xcode_version = xcode_version
-        carthage_cache = CarthageCache(config=punic.config)
+        carthage_cache = CarthageCache(config=punic.config, xcode=punic.xcode)
         logging.info("Cache filename: <ref>'{}'</ref>".format(carthage_cache.archive_name_for_project()))
         carthage_cache.publish(force = force)
 
@@ -345,7 +412,7 @@ def install(context, xcode_version):
         punic = context.obj
         if xcode_version:
             punic.config.xcode_version = xcode_version
-        carthage_cache = CarthageCache(config=punic.config)
+        carthage_cache = CarthageCache(config=punic.config, xcode=punic.xcode)
         logging.info("Cache filename: <ref>'{}'</ref>".format(carthage_cache.archive_name_for_project()))
         carthage_cache.install()
 
@@ -7,9 +7,10 @@ import functools
 import hashlib
 import affirm
 import six
+import os
 import logging
 
-from memoize import mproperty
+from .utilities import mproperty, locked_paths
 from pathlib2 import Path
 
 # Ideally we could six.urllib but this causes problem with nosetests!
@@ -24,6 +25,7 @@ from .errors import *
 from .cartfile import *
 from .semantic_version import *
 from .errors import NoSuchRevision
+import punic.shshutil as shutil
 
 
 class Repository(object):
@@ -59,17 +61,18 @@ class Repository(object):
     def config(self):
         return self.punic.config
 
+    @property
+    def runner(self):
+        return self.punic.runner
+
     @mproperty
     def tags(self):
         """Return a list of Tag objects representing git tags. Only tags that are valid semantic versions are returned"""
         # type: () -> [Tag]
 
-        self.check_work_directory()
-
-        output = runner.check_run('git tag', cwd=self.path)
-        tags = [tag for tag in output.split('\n') if tag]
+        tags = self._tag_names()
 
-        if config.verbose == True:
+        if self.config.verbose == True:
             bad_tags = [tag for tag in tags if not SemanticVersion.is_semantic(tag)]
             if bad_tags:
                 logging.warning("<err>Warning</err>: Found tags in \'{}\' that are not semantic: {}".format(self, ', '.join(['\'{}\''.format(tag) for tag in bad_tags])))
@@ -77,18 +80,33 @@ class Repository(object):
         tags = [Revision(repository=self, revision=tag, revision_type=Revision.Type.tag) for tag in tags if SemanticVersion.is_semantic(tag)]
         return sorted(tags)
 
+    def _tag_names(self):
+        # type: () -> [str]
+        self.check_work_directory()
+        output = self.runner.check_run('git tag', cwd=self.path)
+        return [tag for tag in output.split('\n') if tag]
+
+    def _read_file(self, sha, path):
+        # type: (str, str) -> str
+        """Return the contents of path in the tree at sha, or None if there is no such file."""
+        self.check_work_directory()
+        result = self.runner.run('git show "{}:{}"'.format(sha, path), cwd=self.path)
+        if result.return_code != 0:
+            return None
+        return result.stdout
+
     def rev_parse(self, s):
         # type: (str) -> str
 
         self.check_work_directory()
 
-        result = runner.run('git rev-parse "{}"'.format(s), echo=False, cwd=self.path)
+        result = self.runner.run('git rev-parse "{}"'.format(s), echo=False, cwd=self.path)
         if result.return_code == 0:
             return result.stdout.strip()
 
         # TODO: assumes remote is called origin.
         command = 'git rev-parse "origin/{}"'.format(s)
-        result = runner.run(command, echo=False, cwd=self.path)
+        result = self.runner.run(command, echo=False, cwd=self.path)
         if result.return_code == 0:
             return result.stdout.strip()
         raise Exception('{}: \'{}\' failed with {}'.format(self, command, result))
@@ -98,14 +116,134 @@ class Repository(object):
         logging.debug('Checking out <ref>{}</ref> @ revision <rev>{}</rev>'.format(self, revision))
         self.check_work_directory()
         try:
-            runner.check_run('git checkout "{}"'.format(revision.sha), cwd=self.path)
+            self.runner.check_run('git checkout "{}"'.format(revision.sha), cwd=self.path)
         except Exception:
             raise NoSuchRevision(repository=self, revision=revision)
 
-        runner.check_run('git submodule update --init --recursive', cwd=self.path)
+        self.runner.check_run('git submodule update --init --recursive', cwd=self.path)
+
+    def materialize(self, revision, destination, sparse=None):
+        # type: (Revision, Path, SparsePaths)
+        """Write the tree at `revision` (submodules included) to `destination` straight from the object database.
+
+        Unlike `checkout` this never moves the repository's HEAD or touches its working tree, so any number of
+        checkouts can be materialized from the same repository at the same time. If `sparse` is given only that subset
+        of the tree is written. A submodule commit missing from the cache is only fetched when config.fetch is set,
+        otherwise (or if it can't be) the tree is checked out with `git worktree` instead."""
+        sparse = sparse or SparsePaths()
+        logging.debug('Materializing <ref>{}</ref> @ revision <rev>{}</rev>'.format(self, revision))
+        self.check_work_directory()
+        sha = revision.sha
+
+        staging_path = destination.parent / '.{}.partial'.format(destination.name)
+        if staging_path.exists():
+            shutil.rmtree(staging_path)
+        staging_path.mkdir(parents=True)
+        try:
+            try:
+                _archive_tree(self.runner, self.path / '.git', sha, staging_path, sparse, fetch=self.config.fetch)
+            except _SubmoduleUnavailable as e:
+                logging.debug('<sub>Submodule <ref>{}</ref> not in cache, falling back to a worktree</sub>'.format(e.args[0]))
+                shutil.rmtree(staging_path)
+                self._materialize_worktree(sha, staging_path, sparse)
+            if destination.exists():
+                shutil.rmtree(destination)
+            staging_path.rename(destination)
+        except:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
 
+    def update_materialized(self, old_sha, revision, destination, sparse=None):
+        # type: (str, Revision, Path, SparsePaths) -> bool
+        """Bring a tree previously materialized from `old_sha` up to date with `revision`.
+
+        Only paths that differ between the two commits are deleted or rewritten, everything else (including its mtime)
+        is left alone. Returns False if the change can't be applied incrementally (e.g. `old_sha` is unknown or a
+        submodule moved) in which case the caller should materialize from scratch. `sparse` must be the same as when the
+        tree was materialized."""
+        sparse = sparse or SparsePaths()
+        self.check_work_directory()
+        sha = revision.sha
+        if sha == old_sha:
+            return True
+
+        if self.runner.run(['git', 'cat-file', '-e', '{}^{{commit}}'.format(old_sha)], echo=False, cwd=self.path).return_code != 0:
+            return False
+
+        # --raw is --name-status plus file modes, which lets us spot submodule (gitlink) changes.
+        output = self.runner.check_run(['git', 'diff', '--raw', '-z', '--no-renames', old_sha, sha], echo=False, cwd=self.path)
+        fields = output.split('\0')
+        changes = []
+        for info, path in zip(fields[0::2], fields[1::2]):
+            old_mode, new_mode, _, _, status = info.lstrip(':').split(' ')
+            if not sparse.may_contain(path):
+                continue
+            if '160000' in (old_mode, new_mode):
+                return False
+            if sparse.matches(path):
+                changes.append((status, path))
+
+        logging.debug('Updating <ref>{}</ref> from <rev>{}</rev> to <rev>{}</rev> ({} changed paths)'.format(self, old_sha[:7], revision, len(changes)))
+
+        for status, path in changes:
+            path = destination / path
+            # A path that was a directory (with files under it that are deleted after it) can become a file.
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            elif os.path.lexists(str(path)):
+                path.unlink()
+            if status == 'D':
+                parent = path.parent
+                while parent != destination and parent.exists() and not os.listdir(str(parent)):
+                    parent.rmdir()
+                    parent = parent.parent
+
+        paths = [path for status, path in changes if status != 'D']
+        chunk_size = 500
+        for index in range(0, len(paths), chunk_size):
+            with self.runner.stream(['git', 'archive', '--format=tar', sha, '--'] + paths[index:index + chunk_size], echo=False, cwd=self.path) as stream:
+                shutil.unpack_tar_stream(stream, destination)
+        return True
+
+    def _materialize_worktree(self, sha, destination, sparse):
+        # type: (str, Path, SparsePaths)
+        self.runner.check_run(['git', 'worktree', 'add', '--detach', destination, sha], cwd=self.path)
+        try:
+            self.runner.check_run('git submodule update --init --recursive', cwd=destination)
+        finally:
+            # Detach the tree (and its submodules) from the repository so it is a plain directory like an archive.
+            for root, dirs, files in os.walk(str(destination)):
+                if '.git' in dirs:
+                    dirs.remove('.git')
+                    shutil.rmtree(Path(root) / '.git')
+                if '.git' in files:
+                    os.unlink(os.path.join(root, '.git'))
+            self.runner.check_run('git worktree prune', cwd=self.path)
+
+        if sparse:
+            for root, dirs, files in os.walk(str(destination), topdown=False):
+                relative_root = os.path.relpath(root, str(destination))
+                for name in files + dirs:
+                    path = os.path.join(root, name)
+                    relative_path = os.path.normpath(os.path.join(relative_root, name))
+                    if os.path.islink(path) or not os.path.isdir(path):
+                        if not sparse.matches(relative_path):
+                            os.unlink(path)
+                    elif not os.listdir(path):
+                        os.rmdir(path)
 
     def fetch(self):
+        # Other sessions (and other punic processes) share the repository cache.
+        with locked_paths([self.path]):
+            command = self.fetch_command()
+            if command:
+                self.runner.run_command(command)
+
+    def fetch_command(self):
+        # type: () -> Command
+        """Return the command that clones (or fetches into) the repository, so that many can be run at once with
+        `Runner.run_many`. Returns None if there is nothing to do. Callers must hold `locked_paths([self.path])` until
+        the command has run."""
         if not self.path.exists():
             logging.debug('<sub>Cloning</sub>: <ref>{}</ref>'.format(self))
 
@@ -117,13 +255,12 @@ class Repository(object):
             else:
                 repo = url
 
-            runner.check_run('git clone --recursive --recurse-submodules "{}" "{}"'.format(repo, str(self.path)), cwd=self.path.parent)
+            return Command('git clone --recursive --recurse-submodules "{}" "{}"'.format(repo, str(self.path)), cwd=self.path.parent, check=True)
         else:
             self.check_work_directory()
 
             logging.info('<sub>Fetching</sub>: <ref>{}</ref>'.format(self))
-            runner.check_run('git fetch', cwd=self.path)
-
+            return Command('git fetch', cwd=self.path, check=True)
 
     def specifications_for_revision(self, revision):
         # type: (Revision) -> [Specification]
@@ -135,7 +272,7 @@ class Repository(object):
         if revision in self.specifications_cache:
             return self.specifications_cache[revision]
         elif revision is None and self == self.punic.root_project:
-            cartfile = Cartfile(use_ssh=self.config.use_ssh, overrides=config.repo_overrides)
+            cartfile = Cartfile(use_ssh=self.config.use_ssh, overrides=self.config.repo_overrides)
             specifications = []
 
             cartfile_path = self.path / 'Cartfile'
@@ -157,20 +294,19 @@ class Repository(object):
                     "No specifications found in {} or {}".format(cartfile_path.relative_to(Path.cwd()), cartfile_private_path.relative_to(Path.cwd())))
 
         else:
-            self.check_work_directory()
-
             try:
                 parsed_revision = self.rev_parse(revision)
+            except RepositoryNotClonedError:
+                raise
             except:
                 print("FAILED") # JIWTODO
                 return []
 
-            result = runner.run('git show "{}:Cartfile"'.format(parsed_revision), cwd=self.path)
-            if result.return_code != 0:
+            data = self._read_file(parsed_revision, 'Cartfile')
+            if data is None:
                 specifications = []
             else:
-                data = result.stdout
-                cartfile = Cartfile(use_ssh=self.config.use_ssh, overrides=config.repo_overrides)
+                cartfile = Cartfile(use_ssh=self.config.use_ssh, overrides=self.config.repo_overrides)
                 cartfile.read(data)
                 specifications = cartfile.specifications
 
@@ -182,6 +318,79 @@ class Repository(object):
         return [tag for tag in self.tags if predicate.test(tag.semantic_version)]
 
 
+class _SubmoduleUnavailable(Exception):
+    pass
+
+
+def _archive_tree(runner, git_dir, sha, destination, sparse, prefix='', fetch=False):
+    # type: (Runner, Path, str, Path, SparsePaths, str, bool)
+    """Write the tree at sha (and its submodules' trees) to destination. Raises _SubmoduleUnavailable if a submodule's
+    commit isn't in the repository cache (and, if fetch is set, can't be fetched into it)."""
+    git = ['git', '--git-dir', str(git_dir)]
+    command = git + ['archive', '--format=tar', sha]
+    predicate = None
+    if sparse:
+        predicate = lambda name: sparse.matches(prefix + name)
+        if sparse.include and not prefix:
+            # Let git skip whole subtrees we don't want. Paths missing from this revision are simply ignored.
+            output = runner.check_run(git + ['ls-tree', '--name-only', '-z', sha, '--'] + sparse.include, echo=False)
+            paths = [path for path in output.split('\0') if path]
+            if not paths:
+                return
+            command += ['--'] + paths
+    with runner.stream(command) as stream:
+        shutil.unpack_tar_stream(stream, destination, predicate=predicate)
+
+    for path, submodule_sha, name in _submodules(runner, git_dir, sha):
+        if sparse and not sparse.may_contain(prefix + path):
+            continue
+        module_git_dir = git_dir / 'modules' / name
+        if not _has_commit(runner, module_git_dir, submodule_sha, fetch=fetch):
+            raise _SubmoduleUnavailable(path)
+        _archive_tree(runner, module_git_dir, submodule_sha, destination / path, sparse, prefix=prefix + path + '/', fetch=fetch)
+
+
+def _submodules(runner, git_dir, sha):
+    # type: (Runner, Path, str) -> [(str, str, str)]
+    """Return (path, sha, name) for every submodule recorded in the tree at sha."""
+    git = ['git', '--git-dir', str(git_dir)]
+    result = runner.run(git + ['config', '--blob', '{}:.gitmodules'.format(sha), '--get-regexp', r'^submodule\..*\.path$'], echo=False)
+    if result.return_code != 0:
+        return []
+
+    names_by_path = dict()
+    for line in result.stdout.splitlines():
+        key, path = line.split(' ', 1)
+        names_by_path[path] = key[len('submodule.'):-len('.path')]
+
+    output = runner.check_run(git + ['ls-tree', '-z', sha, '--'] + sorted(names_by_path.keys()), echo=False)
+    submodules = []
+    for entry in output.split('\0'):
+        if not entry:
+            continue
+        info, path = entry.split('\t', 1)
+        mode, object_type, object_sha = info.split(' ')
+        if object_type == 'commit':
+            submodules.append((path, object_sha, names_by_path[path]))
+    return submodules
+
+
+def _has_commit(runner, git_dir, sha, fetch=False):
+    # type: (Runner, Path, str, bool) -> bool
+    """Return True if the repository at git_dir has the commit sha. If it doesn't, and fetch is set, fetch first."""
+    if not git_dir.exists():
+        return False
+    git = ['git', '--git-dir', str(git_dir)]
+    command = git + ['cat-file', '-e', '{}^{{commit}}'.format(sha)]
+    if runner.run(command, echo=False).return_code == 0:
+        return True
+    if not fetch:
+        return False
+    logging.info('<sub>Fetching</sub>: <ref>{}</ref> (for <rev>{}</rev>)'.format(git_dir.name, sha[:7]))
+    runner.run(git + ['fetch', 'origin'])
+    return runner.run(command, echo=False).return_code == 0
+
+
 ########################################################################################################################
 
 @functools.total_ordering
@@ -242,7 +451,7 @@ class Revision(object):
         else:
             self.repository.check_work_directory()
 
-            result = runner.run('git merge-base --is-ancestor "{}" "{}"'.format(other.sha, self.sha), cwd=self.repository.path)
+            result = self.repository.runner.run('git merge-base --is-ancestor "{}" "{}"'.format(other.sha, self.sha), cwd=self.repository.path)
             if result.return_code == 0:
                 return False
             if result.return_code == 1:
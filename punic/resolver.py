@@ -117,6 +117,14 @@ class Resolver(object):
     def resolve_versions(self, dependencies):
         # type: (ProjectIdentifier, Revision) -> [ProjectIdentifier, Tag]
         """Given an array of project identifier/version pairs work out the build order"""
+        graph = self.versions_graph(dependencies)
+        build_order = topological_sort(graph, reverse=True)
+        return build_order
+
+    def versions_graph(self, dependencies):
+        # type: ([(ProjectIdentifier, Revision)]) -> DiGraph
+        """Given an array of project identifier/version pairs return the graph of which of them depends on which: an
+        edge from each node to each of its dependencies."""
 
         graph = DiGraph()
         versions_for_identifier = dict(dependencies)
@@ -132,9 +140,7 @@ class Resolver(object):
                 version = versions_for_identifier[dependency]
                 child = Node(dependency, version)
                 graph.add_edge(parent, child)
-        build_order = topological_sort(graph, reverse=True)
-
-        return build_order
+        return graph
 
     def _dependencies_for_node(self, node):
         # type: (Edge, bool) -> [Any, [Any]]
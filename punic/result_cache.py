@@ -0,0 +1,130 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['ResultCache']
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultCache(object):
+    """A persistent cache of command results (return code, stdout and stderr) backed by SQLite.
+
+    The cache is bounded: once the stored output exceeds `max_size` bytes the least recently used results are evicted.
+    If `ttl` (in seconds) is set results older than that are ignored. A single instance can be shared between threads
+    and the database can be shared between processes. A corrupt database is discarded and recreated.
+
+    >>> import tempfile, os
+    >>> cache = ResultCache(os.path.join(tempfile.mkdtemp(), 'cache.sqlite'))
+    >>> key = ResultCache.key(['xcodebuild', '-list'], cwd='/tmp', env={'DEVELOPER_DIR': '/Applications/Xcode.app'})
+    >>> cache.get(key) is None
+    True
+    >>> cache.set(key, (0, 'output', None))
+    >>> cache.get(key)
+    (0, 'output', None)
+    >>> key == ResultCache.key(['xcodebuild', '-list'], cwd='/tmp', env={'DEVELOPER_DIR': '/Applications/Xcode-beta.app'})
+    False
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @staticmethod
+    def key(args, cwd=None, env=None, cache_key=None):
+        # type: ([str], str, dict, Any) -> str
+        """Return the key for a command: a digest of everything that can change its output."""
+        parts = [[str(arg) for arg in args], str(cwd) if cwd else None, sorted(env.items()) if env is not None else None, str(cache_key) if cache_key else None]
+        return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+    @property
+    def connection(self):
+        if not self._connection:
+            try:
+                self._connection = self._connect()
+            except sqlite3.OperationalError:
+                raise
+            except sqlite3.DatabaseError:
+                logging.debug('Result cache at {} is corrupt, recreating it'.format(self.path))
+                self._unlink()
+                self._connection = self._connect()
+        return self._connection
+
+    def _connect(self):
+        connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, return_code INTEGER, stdout TEXT, stderr TEXT, size INTEGER, created REAL, accessed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        return connection
+
+    def _unlink(self):
+        if os.path.exists(str(self.path)):
+            os.unlink(str(self.path))
+
+    def get(self, key):
+        # type: (str) -> (int, str, str)
+        """Return the (return_code, stdout, stderr) stored for key, or None."""
+        now = time.time()
+        with self._lock:
+            try:
+                with self.connection as connection:
+                    row = connection.execute('SELECT return_code, stdout, stderr, created FROM results WHERE key = ?', (key,)).fetchone()
+                    if not row:
+                        return None
+                    return_code, stdout, stderr, created = row
+                    if self.ttl is not None and created < now - self.ttl:
+                        connection.execute('DELETE FROM results WHERE key = ?', (key,))
+                        return None
+                    connection.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            except sqlite3.DatabaseError as e:
+                self._handle_error(e)
+                return None
+        return return_code, stdout, stderr
+
+    def set(self, key, value):
+        # type: (str, (int, str, str))
+        """Store (return_code, stdout, stderr) for key, then evict least recently used results until within max_size."""
+        return_code, stdout, stderr = value
+        size = len(stdout or '') + len(stderr or '')
+        now = time.time()
+        with self._lock:
+            try:
+                with self.connection as connection:
+                    connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)', (key, return_code, stdout, stderr, size, now, now))
+                    total_size, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()
+                    if total_size > self.max_size:
+                        evicted = []
+                        for evicted_key, evicted_size in connection.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+                            if total_size <= self.max_size:
+                                break
+                            evicted.append((evicted_key,))
+                            total_size -= evicted_size
+                        connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+                        logging.debug('Evicted {} results from the result cache'.format(len(evicted)))
+            except sqlite3.DatabaseError as e:
+                self._handle_error(e)
+
+    def _handle_error(self, error):
+        # A busy database just means a miss (or an unsaved result), anything else means it is corrupt.
+        logging.debug('Result cache error: {}'.format(error))
+        if not isinstance(error, sqlite3.OperationalError):
+            self._close()
+            self._unlink()
+
+    def _close(self):
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def clear(self):
+        """Remove every result (and the database file)."""
+        with self._lock:
+            self._close()
+            self._unlink()
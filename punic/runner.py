@@ -1,15 +1,24 @@
 from __future__ import division, absolute_import, print_function
 
-__all__ = ['Runner', 'runner', 'Result', 'CalledProcessError']
+__all__ = ['Runner', 'Result', 'Command', 'LedgerEntry', 'CalledProcessError']
 
+import collections
+import contextlib
+import json
+import multiprocessing
 import subprocess
 import shlex
-import shelve
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from subprocess import CalledProcessError
-from memoize import mproperty
+from .utilities import mproperty
 import six
 import logging
 
+from .result_cache import ResultCache
+
 class Result(object):
     def __init__(self):
         self.return_code = None
@@ -17,35 +26,120 @@ class Result(object):
         self.stderr = None
 
 
+class LedgerEntry(object):
+    """A record of one command run by a Runner: what ran, where, when, for how long and how much it printed."""
+
+    def __init__(self, args, cwd):
+        self.args = args
+        self.cwd = cwd
+        self.thread = threading.current_thread().ident
+        self.start = time.time()
+        self.end = None
+        self.return_code = None
+        self.output_bytes = 0
+        self.cache_hit = False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def finish(self, return_code, *outputs):
+        self.end = time.time()
+        self.return_code = return_code
+        self.output_bytes += sum(len(output) for output in outputs if output)
+
+    def __repr__(self):
+        return 'LedgerEntry({!r}, {})'.format(' '.join(self.args), self.return_code)
+
+
+class _CountingReader(object):
+    def __init__(self, fileobj, entry):
+        self.fileobj = fileobj
+        self.entry = entry
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.entry.output_bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        line = self.fileobj.readline(size)
+        self.entry.output_bytes += len(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class Command(object):
+    """A command for `Runner.run_many`. Takes the same arguments as `Runner.run`."""
+
+    def __init__(self, command, cwd=None, echo=None, cache_key=None, check=False, env=None):
+        self.command = command
+        self.cwd = cwd
+        self.echo = echo
+        self.cache_key = cache_key
+        self.check = check
+        self.env = env
+
+    def __repr__(self):
+        return 'Command({!r}, cwd={!r})'.format(self.command, self.cwd)
+
+
 class Runner(object):
     def __init__(self, cache_path=None):
         self.cache_path = cache_path
+        self.cache_max_size = 64 * 1024 * 1024
+        self.cache_ttl = None
         self.echo = False
         self.echo_directories = True
+        # How many commands hold or are waiting for a slot, see jobs.
+        self._running = 0
+        self._running_lock = threading.Lock()
+        self.jobs = multiprocessing.cpu_count()
+        # Every command run (or answered from the cache), in the order they started.
+        self.ledger = []
+        # The processes run_logged is running, see terminate().
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+
+    @property
+    def jobs(self):
+        """The maximum number of commands run at the same time, across all threads."""
+        return self._jobs
+
+    @jobs.setter
+    def jobs(self, value):
+        # Commands hold slots of the semaphore they started with, a new one wouldn't count them.
+        with self._running_lock:
+            if self._running:
+                raise RuntimeError('Runner.jobs can\'t be changed while commands are running')
+            self._jobs = max(1, value)
+            self._slots = threading.BoundedSemaphore(self._jobs)
+
+    @contextlib.contextmanager
+    def _slot(self):
+        """Hold one of the `jobs` slots."""
+        with self._running_lock:
+            self._running += 1
+            slots = self._slots
+        try:
+            with slots:
+                yield
+        finally:
+            with self._running_lock:
+                self._running -= 1
 
     @mproperty
-    def shelf(self):
+    def cache(self):
+        # type: () -> ResultCache
         if not self.cache_path:
             return None
-        # noinspection PyBroadException
-        try:
-            shelf = shelve.open(str(self.cache_path))
-            return shelf
-        except:
-            if self.cache_path.exists():
-                logging.info("Resetting cache and trying again...")
-                self.cache_path.unlink()
-                shelf = shelve.open(str(self.cache_path))
-                return self
-            else:
-                raise
-        return shelf
+        return ResultCache(self.cache_path, max_size=self.cache_max_size, ttl=self.cache_ttl)
 
     def reset(self):
-        if self.cache_path.exists():
-            self.shelf.close()
-            self.cache_path.unlink()
-            # TODO: Reopen
+        if self.cache:
+            self.cache.clear()
 
     def result(self, command):
         result = self.run(command)
@@ -73,9 +167,7 @@ class Runner(object):
     # TODO: Cleanup
     check_call = check_run
 
-    def run(self, command, cwd=None, echo=None, cache_key=None, check=False, env=None):
-        args = self.convert_args(command)
-
+    def _echo(self, args, cwd=None, echo=None):
         if echo or echo is None and self.echo:
             if cwd and self.echo_directories:
                 logging.info('cd {}'.format(cwd))
@@ -83,20 +175,53 @@ class Runner(object):
             # TODO: Wont properly reproduce command if command is a string
             logging.info(' '.join(arg.replace(' ', '\\ ') for arg in args))
 
-        if cache_key:
-            # assert not env # TODO
-            key = '{}{}'.format(cache_key, ' '.join(command))
-            if key in self.shelf:
-                # logger.debug('CACHE HIT: {}'.format(key))
-                return_code, stdout, stderr = self.shelf[key]
+    @contextlib.contextmanager
+    def stream(self, command, cwd=None, echo=None, env=None):
+        """Run a command and yield its stdout as a binary file object that can be read incrementally.
+
+        Output is never buffered in memory. Raises CalledProcessError once the block exits if the command failed."""
+        args = self.convert_args(command)
+        self._echo(args, cwd=cwd, echo=echo)
+
+        if cwd:
+            cwd = str(cwd)
+
+        entry = LedgerEntry(args, cwd)
+        self.ledger.append(entry)
+        stderr = tempfile.TemporaryFile()
+        popen = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=stderr, env=env)
+        stdout = _CountingReader(popen.stdout, entry)
+        try:
+            yield stdout
+            # Drain anything left unread (e.g. tar padding) so the command isn't killed by SIGPIPE.
+            while stdout.read(1024 * 64):
+                pass
+        finally:
+            popen.stdout.close()
+            return_code = popen.wait()
+            stderr.seek(0)
+            output = stderr.read()
+            entry.finish(return_code, output)
+            output = six.text_type(output, encoding='utf-8')
+            stderr.close()
+
+        if return_code != 0:
+            if output:
+                logging.debug(output)
+            raise CalledProcessError(return_code, command, output)
+
+    def run(self, command, cwd=None, echo=None, cache_key=None, check=False, env=None):
+        args = self.convert_args(command)
+
+        self._echo(args, cwd=cwd, echo=echo)
+
+        if cache_key and self.cache:
+            key = ResultCache.key(args, cwd=cwd, env=env, cache_key=cache_key)
+            cached = self._cached(args, cwd, key)
+            if cached:
                 result = Result()
-                result.return_code = return_code
-                result.stdout = stdout
-                result.stderr = stderr
+                result.return_code, result.stdout, result.stderr = cached
                 return result
-            else:
-                # logger.debug('CACHE MISS: {}'.format(key))
-                pass
 
         stdout = subprocess.PIPE
         stderr = subprocess.PIPE if not check else subprocess.STDOUT
@@ -104,8 +229,12 @@ class Runner(object):
         if cwd:
             cwd = str(cwd)
 
-        popen = subprocess.Popen(args, cwd=cwd, stdout=stdout, stderr=stderr, env=env)
-        stdout, stderr = popen.communicate()
+        with self._slot():
+            entry = LedgerEntry(args, cwd)
+            self.ledger.append(entry)
+            popen = subprocess.Popen(args, cwd=cwd, stdout=stdout, stderr=stderr, env=env)
+            stdout, stderr = popen.communicate()
+            entry.finish(popen.returncode, stdout, stderr)
 
         if stdout:
             stdout = six.text_type(stdout, encoding='utf-8')
@@ -122,9 +251,8 @@ class Runner(object):
                 logging.debug(stdout)
             raise CalledProcessError(return_code, command, stdout)
 
-        if cache_key:
-            key = '{}{}'.format(cache_key, ' '.join(command))
-            self.shelf[key] = return_code, stdout, stderr
+        if cache_key and self.cache:
+            self.cache.set(key, (return_code, stdout, stderr))
 
         result = Result()
         result.return_code = return_code
@@ -133,5 +261,117 @@ class Runner(object):
 
         return result
 
+    def _cached(self, args, cwd, key):
+        # type: ([str], str, str) -> (int, str, str)
+        """Return the cached (return_code, stdout, stderr) for key (recording it in the ledger), or None."""
+        entry = LedgerEntry(args, cwd)
+        cached = self.cache.get(key)
+        if not cached:
+            logging.debug('<sub>Cache miss</sub>: {}'.format(' '.join(args)))
+            return None
+        logging.debug('<sub>Cache hit</sub>: {}'.format(' '.join(args)))
+        entry.cache_hit = True
+        entry.finish(*cached)
+        self.ledger.append(entry)
+        return cached
+
+    def run_parsed(self, command, parser, cwd=None, echo=None, cache_key=None, env=None):
+        # type: (Any, Callable, Path, bool, Any, dict) -> Any
+        """Run a command and return parser(stdout), stdout being a binary file object that is read as the command runs.
+
+        The output is never held in memory. With cache_key the parser's result (which must be JSON serializable) is kept
+        in the result cache instead of the output. Raises CalledProcessError if the command fails."""
+        args = self.convert_args(command)
+        if cache_key and self.cache:
+            key = ResultCache.key(args, cwd=cwd, env=env, cache_key='parsed,{}'.format(cache_key))
+            self._echo(args, cwd=cwd, echo=echo)
+            cached = self._cached(args, cwd, key)
+            if cached:
+                return json.loads(cached[1])
+            echo = False
+
+        with self._slot():
+            with self.stream(args, cwd=cwd, echo=echo, env=env) as stdout:
+                value = parser(stdout)
+
+        if cache_key and self.cache:
+            self.cache.set(key, (0, json.dumps(value), None))
+        return value
+
+    def run_logged(self, command, log_path, cwd=None, echo=None, env=None, check=False, line_handler=None, tail=200):
+        # type: (Any, Path, Path, bool, dict, bool, Callable, int) -> Result
+        """Run a command, writing its output (stderr included) line by line to log_path instead of collecting it.
+
+        Only the last `tail` lines are kept in memory; they are the result's stdout (and the CalledProcessError's output
+        if `check` is set and the command fails). Each line is also passed to line_handler (if any) as soon as it is
+        read, e.g. to show progress."""
+        args = self.convert_args(command)
+        self._echo(args, cwd=cwd, echo=echo)
+
+        if cwd:
+            cwd = str(cwd)
+        if not log_path.parent.exists():
+            log_path.parent.mkdir(parents=True)
+
+        lines = collections.deque(maxlen=tail)
+        with self._slot():
+            entry = LedgerEntry(args, cwd)
+            self.ledger.append(entry)
+            with log_path.open('wb') as log:
+                popen = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+                with self._processes_lock:
+                    self._processes.add(popen)
+                try:
+                    for line in iter(popen.stdout.readline, b''):
+                        log.write(line)
+                        entry.output_bytes += len(line)
+                        line = six.text_type(line, encoding='utf-8', errors='replace').rstrip('\n')
+                        lines.append(line)
+                        if line_handler:
+                            line_handler(line)
+                finally:
+                    popen.stdout.close()
+                    return_code = popen.wait()
+                    entry.finish(return_code)
+                    with self._processes_lock:
+                        self._processes.discard(popen)
+
+        output = '\n'.join(lines)
+        if check and return_code != 0:
+            raise CalledProcessError(return_code, command, output)
+
+        result = Result()
+        result.return_code = return_code
+        result.stdout = output
+        return result
+
+    def terminate(self):
+        """Terminate every command run_logged is running (in any thread). Each of them then returns (or raises, if
+        `check` is set) as if the command had failed."""
+        with self._processes_lock:
+            for popen in self._processes:
+                if popen.poll() is None:
+                    popen.terminate()
+
+    def run_command(self, command):
+        # type: (Command) -> Result
+        return self.run(command.command, cwd=command.cwd, echo=command.echo, cache_key=command.cache_key, check=command.check, env=command.env)
+
+    def run_many(self, commands):
+        # type: ([Command]) -> [(Command, Result)]
+        """Run commands concurrently and yield (command, result) pairs in the order the commands finish.
 
-runner = Runner()
+        No more than `jobs` commands run at once, including those started by other threads. If a command with `check`
+        set fails its CalledProcessError is raised when its result would have been yielded; commands that haven't
+        started yet are then cancelled."""
+        commands = list(commands)
+        if not commands:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(commands))) as executor:
+            futures = dict((executor.submit(self.run_command, command), command) for command in commands)
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
@@ -0,0 +1,96 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['BuildScheduler']
+
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class BuildScheduler(object):
+    """Run builds concurrently, each one as soon as every build it depends on has finished.
+
+    Builds are added with the keys of the builds they depend on and are started, in the order they were added, once
+    those have all succeeded; no more than `jobs` run at the same time. The first build to fail cancels the rest: builds
+    that haven't started never will, `on_failure` (e.g. `Runner.terminate`) is called to stop those that are running and
+    run() raises the failed build's exception once they have stopped. Otherwise run() returns what each build returned,
+    keyed by the build's key.
+
+    >>> scheduler = BuildScheduler(jobs=2)
+    >>> order = []
+    >>> scheduler.add('app', lambda: order.append('app'), dependencies=['a', 'b'])
+    >>> scheduler.add('a', lambda: order.append('a'))
+    >>> scheduler.add('b', lambda: order.append('b'), dependencies=['a'])
+    >>> sorted(scheduler.run().items())
+    [('a', None), ('app', None), ('b', None)]
+    >>> order
+    ['a', 'b', 'app']
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = max(1, jobs or 1)
+        self._builds = OrderedDict()
+
+    def __len__(self):
+        return len(self._builds)
+
+    @property
+    def concurrent(self):
+        # type: () -> bool
+        """Whether more than one build can run at a time."""
+        return min(self.jobs, len(self._builds)) > 1
+
+    @property
+    def job_share(self):
+        # type: () -> int
+        """The number of jobs (xcodebuild's -jobs) each build gets, so concurrent builds don't oversubscribe the CPUs."""
+        return max(1, multiprocessing.cpu_count() // max(1, min(self.jobs, len(self._builds))))
+
+    def add(self, key, function, dependencies=None):
+        # type: (Any, Callable, [Any])
+        if key in self._builds:
+            raise ValueError('Build {} already scheduled.'.format(key))
+        self._builds[key] = (function, list(dependencies or []))
+
+    def run(self, on_failure=None):
+        # type: (Callable) -> dict
+        for key, (_, dependencies) in self._builds.items():
+            unknown = [dependency for dependency in dependencies if dependency not in self._builds]
+            if unknown:
+                raise ValueError('Build {} depends on unscheduled builds: {}'.format(key, unknown))
+
+        pending = OrderedDict(self._builds)
+        finished = set()
+        running = dict()
+        results = dict()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                if not error:
+                    for key, (function, dependencies) in list(pending.items()):
+                        if len(running) >= self.jobs:
+                            break
+                        if all(dependency in finished for dependency in dependencies):
+                            del pending[key]
+                            running[executor.submit(function)] = key
+                    if not running:
+                        raise ValueError('Builds depend on each other: {}'.format(', '.join(str(key) for key in pending)))
+                elif not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    exception = future.exception()
+                    if exception and not error:
+                        error = exception
+                        logging.debug('<sub>Build {} failed, cancelling {} running and {} waiting builds</sub>'.format(key, len(running), len(pending)))
+                        if on_failure:
+                            on_failure()
+                    elif not exception:
+                        results[key] = future.result()
+                    finished.add(key)
+        if error:
+            raise error
+        return results
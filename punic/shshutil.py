@@ -1,4 +1,8 @@
+import os
 import shutil
+import stat
+import tarfile
+import time
 from pathlib2 import Path
 
 
@@ -24,3 +28,68 @@ def ignore_patterns(*patterns):
 
 def move(src, dst):
     shutil.move(str(src), str(dst))
+
+
+def unpack_tar_stream(fileobj, dst, predicate=None, strip_components=0):
+    """Extract a (possibly compressed) tar stream into dst member by member without seeking or staging the archive.
+
+    The first strip_components path components are removed from member names and only members whose resulting names
+    pass predicate (if given) are extracted. Extracted files are stamped with the current time rather than the archive's
+    mtimes so that incremental builds never mistake newly materialized sources for ones older than their build products.
+    Returns the archive's pax headers (for `git archive` output these record the commit in 'comment')."""
+    now = time.time()
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if strip_components:
+                components = member.name.split('/')[strip_components:]
+                if not components or not components[0]:
+                    continue
+                member.name = '/'.join(components)
+            if predicate and not predicate(member.name):
+                continue
+            member.mtime = now
+            if hasattr(tarfile, 'tar_filter'):
+                archive.extract(member, str(dst), filter='tar')
+            else:
+                archive.extract(member, str(dst))
+        return archive.pax_headers
+
+
+def make_read_only(path):
+    """Remove write permission from everything under (and including) path. Symlinks are left alone."""
+    for root, dirs, files in os.walk(str(path), topdown=False):
+        for name in files + dirs:
+            item_path = os.path.join(root, name)
+            if not os.path.islink(item_path):
+                os.chmod(item_path, stat.S_IMODE(os.lstat(item_path).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    os.chmod(str(path), stat.S_IMODE(os.stat(str(path)).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def make_writable(path):
+    """Give the owner write permission to path and every directory below it so that it can be deleted."""
+    os.chmod(str(path), stat.S_IMODE(os.stat(str(path)).st_mode) | stat.S_IWUSR)
+    for root, dirs, files in os.walk(str(path)):
+        for name in dirs:
+            item_path = os.path.join(root, name)
+            if not os.path.islink(item_path):
+                os.chmod(item_path, stat.S_IMODE(os.lstat(item_path).st_mode) | stat.S_IWUSR)
+
+
+def remove(path):
+    """Remove path, be it a file, a symlink or a directory tree. Does nothing if path doesn't exist."""
+    if os.path.isdir(str(path)) and not os.path.islink(str(path)):
+        shutil.rmtree(str(path), ignore_errors=True)
+    elif os.path.lexists(str(path)):
+        os.unlink(str(path))
+
+
+def tree_size(path):
+    """Return the size in bytes of path or, for a directory, of the files and symlinks under it. Symlinks are not
+    followed."""
+    if not os.path.isdir(str(path)) or os.path.islink(str(path)):
+        return os.lstat(str(path)).st_size
+    size = 0
+    for root, dirs, files in os.walk(str(path)):
+        for name in files + [name for name in dirs if os.path.islink(os.path.join(root, name))]:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
@@ -6,7 +6,7 @@ import functools
 import re
 import six
 from flufl.enum import Enum
-from memoize import mproperty
+from .utilities import mproperty
 from pathlib2 import Path
 import logging
 
@@ -0,0 +1,221 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['TarballRepository']
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+import requests
+from pathlib2 import Path
+
+from .errors import *
+from .repository import Repository
+from .runner import *
+import punic.shshutil as shutil
+
+
+class TarballRepository(Repository):
+    """A github repository that is read through GitHub's HTTP endpoints instead of being cloned.
+
+    Refs come from a single `git ls-remote`, Cartfiles from raw.githubusercontent.com and checkouts are materialized by
+    streaming the codeload tarball for the pinned SHA straight into place. Downloaded tarballs are verified against the
+    commit recorded in their pax header and cached by SHA.
+
+    Anything that needs real history (e.g. ordering two commits) or a tree with submodules transparently falls back to
+    cloning the repository like a plain `Repository`.
+    """
+
+    codeload_url = 'https://codeload.github.com'
+    raw_url = 'https://raw.githubusercontent.com'
+
+    @classmethod
+    def supports(cls, identifier):
+        # type: (ProjectIdentifier) -> bool
+        """Return True if identifier is a github dependency that hasn't been overridden to point elsewhere."""
+        if identifier.source != 'github':
+            return False
+        urls = ['https://github.com/{}/{}.git'.format(identifier.team_name, identifier.project_name),
+                'git@github.com:{}/{}.git'.format(identifier.team_name, identifier.project_name)]
+        return identifier.remote_url in urls
+
+    def __init__(self, punic, identifier):
+        super(TarballRepository, self).__init__(punic, identifier)
+        self.tarball_directory = punic.config.tarball_cache_directory / self.path.name
+        self.uses_git = self.path.exists()
+        self._refs = None
+
+    def _fall_back_to_git(self):
+        if not self.uses_git:
+            logging.debug('<sub>Falling back to cloning <ref>{}</ref></sub>'.format(self))
+            self.uses_git = True
+            super(TarballRepository, self).fetch()
+
+    def check_work_directory(self):
+        self._fall_back_to_git()
+        super(TarballRepository, self).check_work_directory()
+
+    def fetch_command(self):
+        # type: () -> Command
+        if self.uses_git:
+            return super(TarballRepository, self).fetch_command()
+        self._refs = None
+        return None
+
+    @property
+    def refs(self):
+        # type: () -> {str: str}
+        """All branches and tags of the remote repository, mapped to the SHA of the commit they point at."""
+        if self._refs is None:
+            output = self.runner.check_run(['git', 'ls-remote', '--heads', '--tags', self.identifier.remote_url])
+            refs = dict()
+            for line in output.splitlines():
+                sha, name = line.split('\t', 1)
+                if name.endswith('^{}'):
+                    # Annotated tags are listed twice, prefer the commit the tag is peeled to.
+                    refs[name[:-3]] = sha
+                else:
+                    refs.setdefault(name, sha)
+            self._refs = refs
+        return self._refs
+
+    def _tag_names(self):
+        # type: () -> [str]
+        if self.uses_git:
+            return super(TarballRepository, self)._tag_names()
+        return [name[len('refs/tags/'):] for name in self.refs if name.startswith('refs/tags/')]
+
+    def rev_parse(self, s):
+        # type: (str) -> str
+        if self.uses_git:
+            return super(TarballRepository, self).rev_parse(s)
+        s = str(s)
+        if re.match(r'^[0-9a-f]{40}$', s):
+            return s
+        for name in ['refs/tags/{}'.format(s), 'refs/heads/{}'.format(s)]:
+            if name in self.refs:
+                return self.refs[name]
+        raise Exception('{}: no ref named \'{}\' on {}'.format(self, s, self.identifier.remote_url))
+
+    def _read_file(self, sha, path):
+        # type: (str, str) -> str
+        if self.uses_git:
+            return super(TarballRepository, self)._read_file(sha, path)
+        url = '{}/{}/{}/{}/{}'.format(self.raw_url, self.identifier.team_name, self.identifier.project_name, sha, path)
+        response = requests.get(url)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.text
+
+    def tarball_path(self, sha):
+        # type: (str) -> Path
+        return self.tarball_directory / '{}.tar.gz'.format(sha)
+
+    def materialize(self, revision, destination, sparse=None):
+        # type: (Revision, Path, SparsePaths)
+        if self.uses_git:
+            return super(TarballRepository, self).materialize(revision, destination, sparse=sparse)
+
+        logging.debug('Materializing <ref>{}</ref> @ revision <rev>{}</rev> from tarball'.format(self, revision))
+        sha = revision.sha
+
+        staging_path = destination.parent / '.{}.partial'.format(destination.name)
+        if staging_path.exists():
+            shutil.rmtree(staging_path)
+        staging_path.mkdir(parents=True)
+        try:
+            self._unpack_tarball(sha, staging_path, sparse)
+            if (staging_path / '.gitmodules').exists():
+                # Tarballs don't contain submodules.
+                shutil.rmtree(staging_path)
+                self._fall_back_to_git()
+                return super(TarballRepository, self).materialize(revision, destination, sparse=sparse)
+            if destination.exists():
+                shutil.rmtree(destination)
+            staging_path.rename(destination)
+        except:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+    def update_materialized(self, old_sha, revision, destination, sparse=None):
+        # type: (str, Revision, Path, SparsePaths) -> bool
+        if self.uses_git:
+            return super(TarballRepository, self).update_materialized(old_sha, revision, destination, sparse=sparse)
+        # Without history there is no diff to apply: any other SHA means downloading and materializing the whole tree.
+        return revision.sha == old_sha
+
+    def _unpack_tarball(self, sha, destination, sparse):
+        # type: (str, Path, SparsePaths)
+        # .gitmodules is always extracted, materialize() needs to know about submodules even if it isn't wanted.
+        predicate = (lambda name: name == '.gitmodules' or sparse.matches(name)) if sparse else None
+        tarball_path = self.tarball_path(sha)
+        digest_path = Path(str(tarball_path) + '.sha256')
+
+        if tarball_path.exists() and digest_path.exists():
+            if _file_digest(tarball_path) == digest_path.open().read().strip():
+                with tarball_path.open('rb') as stream:
+                    headers = shutil.unpack_tar_stream(stream, destination, predicate=predicate, strip_components=1)
+                self._verify(sha, headers)
+                return
+            logging.warning('<err>Warning</err>: Cached tarball <ref>{}</ref> is corrupt. Downloading again.'.format(tarball_path))
+
+        url = '{}/{}/{}/tar.gz/{}'.format(self.codeload_url, self.identifier.team_name, self.identifier.project_name, sha)
+        logging.info('<sub>Downloading</sub>: <ref>{}</ref>'.format(url))
+        response = requests.get(url, stream=True)
+        response.raise_for_status()
+
+        if not self.tarball_directory.exists():
+            self.tarball_directory.mkdir(parents=True)
+        handle, temp_path = tempfile.mkstemp(dir=str(self.tarball_directory), prefix='.{}.'.format(sha))
+        try:
+            with os.fdopen(handle, 'wb') as cache_file:
+                stream = _TeeReader(response.raw, cache_file)
+                headers = shutil.unpack_tar_stream(stream, destination, predicate=predicate, strip_components=1)
+                while stream.read(1024 * 64):
+                    pass
+            self._verify(sha, headers)
+            with digest_path.open('w') as digest_file:
+                digest_file.write(stream.digest.hexdigest())
+            os.rename(temp_path, str(tarball_path))
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def _verify(self, sha, headers):
+        # type: (str, dict)
+        """Check that the tarball is the one for sha, going by the commit git archive records in its pax header.
+
+        This is not an integrity check of the contents: the header is just text in the tarball, nothing is known to
+        hash the files against. The .sha256 kept next to a cached tarball only catches it being damaged after it was
+        downloaded."""
+        commit = headers.get('comment')
+        if commit != sha:
+            raise PunicRepresentableError('Tarball for {} is for commit {} but expected {}.'.format(self, commit, sha))
+
+
+class _TeeReader(object):
+    """A file-like reader that copies everything read to another file and hashes it on the way through."""
+
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if data:
+            self.destination.write(data)
+            self.digest.update(data)
+        return data
+
+
+def _file_digest(path):
+    # type: (Path) -> str
+    digest = hashlib.sha256()
+    with path.open('rb') as stream:
+        for block in iter(lambda: stream.read(1024 * 64), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -70,4 +70,5 @@ def test_version():
     temp_dir = Path(tempfile.mkdtemp())
 
     with work_directory(temp_dir):
+        runner = Runner()
         output = runner.check_run('punic version')
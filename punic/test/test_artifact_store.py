@@ -0,0 +1,53 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import tempfile
+import time
+
+from pathlib2 import Path
+
+from punic.artifact_store import ArtifactStore
+
+
+def make_framework(path, name, size):
+    """A macOS style framework bundle: the binary under Versions/A, with symlinks to it."""
+    framework_path = path / '{}.framework'.format(name)
+    (framework_path / 'Versions/A').mkdir(parents=True)
+    (framework_path / 'Versions/A' / name).open('wb').write(b'\0' * size)
+    os.symlink('A', str(framework_path / 'Versions/Current'))
+    os.symlink('Versions/Current/{}'.format(name), str(framework_path / name))
+    return framework_path
+
+
+def test_restore_and_evict():
+    temp_dir = Path(tempfile.mkdtemp())
+    build_path = temp_dir / 'Build'
+    build_path.mkdir()
+    store = ArtifactStore(temp_dir / 'store', max_size=250 * 1024)
+
+    keys = [ArtifactStore.key(dependency=name, sha='0123abcd', dependencies=[]) for name in ['A', 'B', 'C']]
+    assert len(set(keys)) == 3
+    assert keys[0] == ArtifactStore.key(dependencies=[], sha='0123abcd', dependency='A')
+
+    framework_path = make_framework(build_path, 'A', 100 * 1024)
+    dsym_path = build_path / 'A.dSYM'
+    dsym_path.mkdir()
+    store.store(keys[0], [framework_path, dsym_path])
+    store.store(keys[1], [make_framework(build_path, 'B', 100 * 1024)])
+
+    # Restoring replaces what is there, keeping the bundle's symlinks.
+    (framework_path / 'Versions/A/A').open('wb').write(b'stale')
+    assert store.restore(keys[0], build_path) == ['A.framework', 'A.dSYM']
+    assert (build_path / 'A.framework/A').stat().st_size == 100 * 1024
+    assert os.readlink(str(build_path / 'A.framework/Versions/Current')) == 'A'
+
+    # A was used more recently than B, so B is evicted to make room for C.
+    os.utime(str(temp_dir / 'store' / keys[1] / 'manifest.json'), (time.time() - 60, time.time() - 60))
+    store.store(keys[2], [make_framework(build_path, 'C', 100 * 1024)])
+    assert store.restore(keys[1], temp_dir / 'Restored') is None
+    assert store.restore(keys[0], temp_dir / 'Restored') == ['A.framework', 'A.dSYM']
+    assert store.restore(keys[2], temp_dir / 'Restored') == ['C.framework']
+    assert sorted(path.name for path in (temp_dir / 'store').iterdir()) == sorted([keys[0], keys[2]])
+
+    store.clear()
+    assert store.restore(keys[0], temp_dir / 'Restored') is None
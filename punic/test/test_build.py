@@ -0,0 +1,90 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import tempfile
+
+import networkx
+import pytest
+from pathlib2 import Path
+
+from punic import Punic
+from punic.config import Config
+from punic.platform import Platform
+from punic.semantic_version import SemanticVersion
+from punic.test.test_checkout import environment, make_repository
+from punic.test.test_xcode import _BundleXcode, examples_path, make_xcode
+import punic.shshutil as shutil
+
+
+class _Punic(Punic):
+    """A session that builds with a stub Xcode and, rather than building, writes an empty framework."""
+
+    __slots__ = ['_xcode', 'builds']
+
+    @property
+    def xcode(self):
+        return self._xcode
+
+    def _build_one(self, platform, project, scheme, configuration, dependency=None, jobs=None, artifact_key=None):
+        self.builds.append((platform.name, dependency, scheme))
+        output_path = self.config.build_path / platform.output_directory_name / 'Example.framework'
+        if not output_path.exists():
+            output_path.mkdir(parents=True)
+        (output_path / 'Example').open('w').write(u'binary')
+        return [output_path]
+
+
+# Punic.build orders the dependency graph with networkx 1.x's topological_sort(graph, reverse=True).
+@pytest.mark.skipif(not networkx.__version__.startswith('1.'), reason='Punic.build needs networkx 1.x')
+def test_up_to_date_dependencies_are_not_introspected():
+    saved_environment = dict(os.environ)
+    os.environ.update(environment)
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        # The Example-tvOS target is based on an xcconfig file, so its settings have to come from xcodebuild.
+        make_xcode(temp_dir / 'Xcode.app', '9.0')
+        (temp_dir / 'Xcode.app/Contents/Developer/usr/bin/xcodebuild').open('w').write(u"""#!/bin/sh
+echo 'Build settings for action build and target Example-tvOS:'
+echo '    TARGET_NAME = Example-tvOS'
+echo '    MACH_O_TYPE = mh_dylib'
+echo '    PACKAGE_TYPE = com.apple.package-type.wrapper.framework'
+echo '    SUPPORTED_PLATFORMS = appletvsimulator appletvos'
+""")
+        shutil.copytree(examples_path / 'Example.xcodeproj', temp_dir / 'Example.xcodeproj')
+        files = [(str(path.relative_to(temp_dir)), path.open().read()) for path in (temp_dir / 'Example.xcodeproj').glob('**/*') if path.is_file()]
+        sha = make_repository(temp_dir / 'Example', files + [('Configuration/Shared.xcconfig', u'\n')])
+        (temp_dir / 'root').mkdir()
+        (temp_dir / 'root/Cartfile.resolved').open('w').write(u'git "file://{}" "{}"\n'.format(temp_dir / 'Example', sha))
+
+        def build(fetch=False):
+            config = Config(root_path=temp_dir / 'root')
+            config.fetch = fetch
+            config.repo_cache_directory = temp_dir / 'repo_cache'
+            config.derived_data_path = temp_dir / 'DerivedData'
+            config.artifact_store_size = 0
+            config.platforms = [Platform.platform_for_nickname('tvOS')]
+            runner = config.make_runner()
+            runner.cache_path = temp_dir / 'cache.sqlite'
+            punic = _Punic(config, runner)
+            punic._xcode = _BundleXcode(temp_dir / 'Xcode.app', runner)
+            punic._xcode._version = SemanticVersion.string('9.0')
+            punic.builds = []
+            punic.build(dependencies=None)
+            return punic
+
+        punic = build(fetch=True)
+        assert punic.builds == [('tvOS', 'Example', 'Example-tvOS')]
+        assert [entry for entry in punic.runner.ledger if 'xcodebuild' in entry.args[0]]
+
+        # Nothing has changed: nothing is built, and xcodebuild isn't even asked about the project.
+        punic = build()
+        assert punic.builds == []
+        assert not [entry for entry in punic.runner.ledger if 'xcodebuild' in entry.args[0]]
+
+        # Replacing an output makes it out of date.
+        shutil.rmtree(temp_dir / 'root/Carthage/Build/tvOS/Example.framework')
+        assert build().builds == [('tvOS', 'Example', 'Example-tvOS')]
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,266 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import tempfile
+
+from pathlib2 import Path
+
+from punic import Punic
+from punic.checkout import find_projects
+from punic.config import Config, SparsePaths
+from punic.errors import PunicRepresentableError
+from punic.repository import Repository, Revision
+from punic.runner import Runner
+from punic.specification import ProjectIdentifier
+import punic.shshutil as shutil
+
+# Submodules are added from the (local) repository cache, which git only allows when asked to.
+environment = {
+    'GIT_AUTHOR_NAME': 'punic', 'GIT_AUTHOR_EMAIL': 'punic@example.com',
+    'GIT_COMMITTER_NAME': 'punic', 'GIT_COMMITTER_EMAIL': 'punic@example.com',
+    'GIT_CONFIG_COUNT': '1', 'GIT_CONFIG_KEY_0': 'protocol.file.allow', 'GIT_CONFIG_VALUE_0': 'always',
+}
+
+
+def make_repository(path, files):
+    Runner().check_run('git init --quiet {}'.format(path))
+    return commit(path, files)
+
+
+def commit(path, files, removed=()):
+    """Commit files (a list of (path, contents)) and the removal of removed, returning the new commit's SHA."""
+    runner = Runner()
+    for name in removed:
+        runner.check_run(['git', 'rm', '--quiet', '-r', name], cwd=path)
+    for name, data in files:
+        if not (path / name).parent.exists():
+            (path / name).parent.mkdir(parents=True)
+        (path / name).open('w').write(data)
+    runner.check_run('git add --all', cwd=path)
+    runner.check_run(['git', 'commit', '--quiet', '-m', 'Commit'], cwd=path)
+    return runner.check_run('git rev-parse HEAD', cwd=path).strip()
+
+
+def test_prepare_submodule():
+    saved_environment = dict(os.environ)
+    os.environ.update(environment)
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        sha = make_repository(temp_dir / 'bar', [('README.md', u'bar\n')])
+        make_repository(temp_dir / 'root', [('Cartfile', u'git "{}"\n'.format(temp_dir / 'bar'))])
+
+        config = Config(root_path=temp_dir / 'root')
+        config.repo_cache_directory = temp_dir / 'repo_cache'
+        config.repo_cache_directory.mkdir()
+        config.use_submodules = True
+        punic = Punic(config, config.make_runner())
+        assert punic.submodule_status() == dict()
+
+        identifier = ProjectIdentifier.string('git "{}"'.format(temp_dir / 'bar'))
+        repository = punic._repository_for_identifier(identifier)
+        repository.fetch()
+        checkout = punic._checkout_for_identifier(identifier, Revision(repository, sha, Revision.Type.commitish))
+        checkout.prepare()
+        assert (temp_dir / 'root/Carthage/Checkouts/bar/README.md').exists()
+
+        # A new session sees the submodule, and prepares it without adding it again.
+        punic = Punic(config, config.make_runner())
+        assert punic.submodule_status() == {'Carthage/Checkouts/bar': (' ', sha)}
+        repository = punic._repository_for_identifier(identifier)
+        punic._checkout_for_identifier(identifier, Revision(repository, sha, Revision.Type.commitish)).prepare()
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.rmtree(temp_dir)
+
+
+def test_shared_checkouts():
+    saved_environment = dict(os.environ)
+    os.environ.update(environment)
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        sha = make_repository(temp_dir / 'bar', [('README.md', u'bar\n')])
+        identifier = ProjectIdentifier.string('git "{}"'.format(temp_dir / 'bar'))
+
+        def prepare(root):
+            if not (temp_dir / root).exists():
+                (temp_dir / root).mkdir()
+            config = Config(root_path=temp_dir / root)
+            config.repo_cache_directory = temp_dir / 'repo_cache'
+            config.checkout_store_directory = temp_dir / 'checkouts'
+            config.shared_checkouts = True
+            config.fetch = True
+            punic = Punic(config, config.make_runner())
+            repository = punic._repository_for_identifier(identifier)
+            repository.fetch()
+            checkout = punic._checkout_for_identifier(identifier, Revision(repository, sha, Revision.Type.commitish))
+            checkout.prepare()
+            return checkout
+
+        # The checkout links to the tree in the store.
+        checkout = prepare('root')
+        store_path = checkout.shared_checkout_path
+        readme_path = temp_dir / 'root/Carthage/Checkouts/bar/README.md'
+        assert readme_path.is_symlink() and os.path.realpath(str(readme_path)) == str(store_path / 'README.md')
+        assert readme_path.open().read() == u'bar\n'
+
+        # Another project links to the same tree.
+        store_mtime = store_path.stat().st_mtime
+        assert prepare('other').shared_checkout_path == store_path
+        assert os.path.realpath(str(temp_dir / 'other/Carthage/Checkouts/bar/README.md')) == str(store_path / 'README.md')
+        assert store_path.stat().st_mtime == store_mtime
+        assert len(list(store_path.parent.iterdir())) == 1
+
+        # Once the store is cleaned the tree is materialized (and linked to) again.
+        shutil.make_writable(temp_dir / 'checkouts')
+        shutil.rmtree(temp_dir / 'checkouts')
+        prepare('root')
+        assert readme_path.open().read() == u'bar\n'
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.make_writable(temp_dir)
+        shutil.rmtree(temp_dir)
+
+
+def test_update_materialized():
+    saved_environment = dict(os.environ)
+    os.environ.update(environment)
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        path = temp_dir / 'bar'
+        shas = [make_repository(path, [('Source/Bar.swift', u'1'), ('README.md', u'1'), ('LICENSE', u'1')])]
+        # A directory becomes a file, and a file a directory.
+        shas.append(commit(path, [('Source', u'2'), ('README.md/index.md', u'2')], removed=['Source', 'README.md']))
+
+        config = Config(root_path=temp_dir / 'root')
+        punic = Punic(config, config.make_runner())
+        repository = Repository(punic, ProjectIdentifier.string('git "{}"'.format(path)), repo_path=path)
+        destination = temp_dir / 'Checkouts/bar'
+        for old_sha, new_sha in [(None, shas[0]), (shas[0], shas[1]), (shas[1], shas[0])]:
+            revision = Revision(repository, new_sha, Revision.Type.commitish)
+            if old_sha:
+                assert repository.update_materialized(old_sha, revision, destination)
+            else:
+                repository.materialize(revision, destination)
+                # Backdate a file no commit changes, to see that it is never rewritten.
+                os.utime(str(destination / 'LICENSE'), (0, 0))
+            files = sorted(os.path.relpath(os.path.join(root, name), str(destination)) for root, dirs, files in os.walk(str(destination)) for name in files)
+            assert files == (['LICENSE', 'README.md', 'Source/Bar.swift'] if new_sha == shas[0] else ['LICENSE', 'README.md/index.md', 'Source'])
+            assert (destination / 'LICENSE').stat().st_mtime == 0
+
+        # Updating to the same commit doesn't run anything, let alone touch the tree.
+        mtimes = dict((name, (destination / name).stat().st_mtime) for name in ['LICENSE', 'README.md', 'Source/Bar.swift'])
+        revision = Revision(repository, shas[0], Revision.Type.commitish)
+        assert revision.sha == shas[0]
+        ledger_length = len(punic.runner.ledger)
+        assert repository.update_materialized(shas[0], revision, destination)
+        assert len(punic.runner.ledger) == ledger_length
+        assert dict((name, (destination / name).stat().st_mtime) for name in mtimes) == mtimes
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.rmtree(temp_dir)
+
+
+def test_find_projects():
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        root = temp_dir / 'root'
+        for path in ['App.xcworkspace', 'Example.xcodeproj/project.xcworkspace', 'Example.xcodeproj/Nested.xcodeproj',
+                     'Sources/Lib/Lib.xcodeproj', 'Carthage/Checkouts/Dep/Dep.xcodeproj', 'Tools/Carthage/Checkouts.xcodeproj',
+                     '.hidden/Hidden.xcodeproj', 'Resources.bundle/Inside.xcodeproj']:
+            (root / path).mkdir(parents=True)
+        (temp_dir / 'Linked/Other.xcodeproj').mkdir(parents=True)
+        os.symlink(str(temp_dir / 'Linked'), str(root / 'Linked'))
+
+        # Nothing in nested checkouts, hidden or symlinked directories or other bundles (projects included).
+        assert [str(path.relative_to(root)) for path in find_projects(root)] == [
+            'App.xcworkspace', 'Example.xcodeproj', 'Sources/Lib/Lib.xcodeproj', 'Tools/Carthage/Checkouts.xcodeproj']
+        assert find_projects(root, sparse=SparsePaths(include=['Sources'])) == [root / 'Sources/Lib/Lib.xcodeproj']
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_dependency_closure():
+    saved_environment = dict(os.environ)
+    os.environ.update(environment)
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        # A depends on B, which depends on C; D depends on nothing.
+        shas = dict()
+        for name, dependencies in [('C', []), ('D', []), ('B', ['C']), ('A', ['B'])]:
+            cartfile = u''.join(u'git "file://{}" "{}"\n'.format(temp_dir / dependency, shas[dependency]) for dependency in dependencies)
+            shas[name] = make_repository(temp_dir / name, [('Cartfile', cartfile)] if cartfile else [('README.md', name)])
+        (temp_dir / 'root').mkdir()
+        (temp_dir / 'root/Cartfile.resolved').open('w').write(u''.join(u'git "file://{}" "{}"\n'.format(temp_dir / name, shas[name]) for name in sorted(shas)))
+
+        config = Config(root_path=temp_dir / 'root')
+        config.repo_cache_directory = temp_dir / 'repo_cache'
+        config.fetch = True
+        punic = Punic(config, config.make_runner())
+        graph = punic._dependency_graph(name_filter=['A'])
+        assert sorted(node.identifier.project_name for node in graph.nodes()) == ['A', 'B', 'C']
+        # D isn't needed, so it isn't even fetched.
+        assert sorted(identifier.project_name for identifier in punic.all_repositories) == ['A', 'B', 'C', 'root']
+
+        try:
+            punic._dependency_graph(name_filter=['A', 'E'])
+        except PunicRepresentableError as e:
+            assert 'E' in str(e)
+        else:
+            assert False, '_dependency_graph should reject names that aren\'t in Cartfile.resolved'
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.rmtree(temp_dir)
+
+
+def test_materialize_submodules():
+    saved_environment = dict(os.environ)
+    os.environ.update(environment)
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        runner = Runner()
+        make_repository(temp_dir / 'sub', [('Sub.swift', u'1')])
+        make_repository(temp_dir / 'bar', [('Bar.swift', u'1')])
+        runner.check_run(['git', 'submodule', 'add', '--quiet', str(temp_dir / 'sub'), 'External/sub'], cwd=temp_dir / 'bar')
+        shas = [commit(temp_dir / 'bar', [])]
+
+        config = Config(root_path=temp_dir / 'root')
+        config.repo_cache_directory = temp_dir / 'repo_cache'
+        punic = Punic(config, config.make_runner())
+        repository = punic._repository_for_identifier(ProjectIdentifier.string('git "file://{}"'.format(temp_dir / 'bar')))
+        repository.fetch()
+
+        def materialize(sha, fetch):
+            config.fetch = fetch
+            del punic.runner.ledger[:]
+            destination = temp_dir / 'Checkouts' / sha
+            repository.materialize(Revision(repository, sha, Revision.Type.commitish), destination)
+            return destination, [' '.join(entry.args) for entry in punic.runner.ledger]
+
+        # The submodule's tree comes from the cache's object database.
+        destination, commands = materialize(shas[0], fetch=False)
+        assert (destination / 'External/sub/Sub.swift').open().read() == u'1'
+        assert not [command for command in commands if ' fetch' in command or ' worktree' in command]
+
+        # A submodule commit the cache doesn't have is only fetched when fetching...
+        commit(temp_dir / 'sub', [('Sub.swift', u'2')])
+        runner.check_run('git submodule update --quiet --remote', cwd=temp_dir / 'bar')
+        shas.append(commit(temp_dir / 'bar', []))
+        runner.check_run('git fetch --quiet --no-recurse-submodules', cwd=repository.path)
+        destination, commands = materialize(shas[1], fetch=False)
+        assert (destination / 'External/sub/Sub.swift').open().read() == u'2'
+        assert [command for command in commands if ' worktree add' in command]
+        assert not [command for command in commands if command.endswith(' fetch origin')]
+
+        # ...in which case the tree still comes from the object database.
+        destination, commands = materialize(shas[1], fetch=True)
+        assert (destination / 'External/sub/Sub.swift').open().read() == u'2'
+        assert [command for command in commands if command.endswith(' fetch origin')]
+        assert not [command for command in commands if ' worktree' in command]
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,45 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import tempfile
+import time
+
+from pathlib2 import Path
+
+from punic.derived_data import DerivedData
+
+
+def build(derived_data, dependency, xcode_version, size, age):
+    """Pretend to build dependency: fill its partition with size bytes and make it look last used age seconds ago."""
+    path = derived_data.partition(dependency, xcode_version)
+    (path / 'iphoneos').mkdir()
+    (path / 'iphoneos/Build.db').open('wb').write(b'\0' * size)
+    derived_data.record_size(path)
+    then = time.time() - age
+    os.utime(str(path / DerivedData.marker_name), (then, then))
+    return path
+
+
+def test_prune_least_recently_used():
+    temp_dir = Path(tempfile.mkdtemp())
+    # Derived data left by punic before it was partitioned is never pruned.
+    (temp_dir / 'Example-abcdefgh/Build').mkdir(parents=True)
+
+    earlier = DerivedData(temp_dir)
+    old = build(earlier, 'A', '9.4', 1000, age=300)
+    older = build(earlier, 'B', '10.0', 1000, age=400)
+    recent = build(earlier, 'A', '10.0', 1000, age=100)
+    assert [path for _, _, path in earlier.partitions()] == [older, old, recent]
+    # Sizes are as recorded after the build, including the partition's marker.
+    assert all(1000 < size < 1100 for _, size, _ in earlier.partitions())
+
+    # The partitions a session uses are kept, even if they are the oldest.
+    derived_data = DerivedData(temp_dir, max_size=2500)
+    current = build(derived_data, 'C', '10.0', 1000, age=500)
+    derived_data.prune()
+    assert [path for _, _, path in derived_data.partitions()] == [current, recent]
+    assert not (temp_dir / 'B').exists()
+    assert (temp_dir / 'A/Xcode-10.0').exists() and (temp_dir / 'Example-abcdefgh/Build').exists()
+
+    DerivedData(temp_dir).prune()
+    assert len(DerivedData(temp_dir).partitions()) == 2
@@ -0,0 +1,70 @@
+from __future__ import division, absolute_import, print_function
+
+from pathlib2 import Path
+
+from punic.pbxproj import PBXProject, ProjectReader, parse_plist
+
+examples_path = Path(__file__).parent / 'Examples/Pbxproj'
+
+
+def test_parse_plist():
+    plist = parse_plist(u'{ a = "tab\\there \\U00e9"; "b c" = <0fa1 0b>; d = ( ); e = { }; f = (x, y); }')
+    assert plist == {'a': u'tab\there \u00e9', 'b c': bytearray(b'\x0f\xa1\x0b'), 'd': [], 'e': {}, 'f': ['x', 'y']}
+    for string in [u'{ a = 1 }', u'{ a = 1; ', u'( a b )', u'{ a = 1; } }', u'{ a = "1; }']:
+        try:
+            parse_plist(string)
+        except ValueError:
+            pass
+        else:
+            assert False, 'parse_plist should have rejected {!r}'.format(string)
+
+
+def test_project_info():
+    reader = ProjectReader(examples_path / 'Example.xcodeproj')
+    targets, configurations, schemes, default_configuration = reader.info
+    assert targets == ['Example-iOS', 'Example-macOS', 'ExampleTests', 'Example-tvOS', 'ExampleStatic']
+    assert configurations == ['Debug', 'Release']
+    assert schemes == ['Example-iOS', 'Example-macOS', 'Example-tvOS', 'ExampleStatic']
+    assert default_configuration == 'Release'
+
+
+def test_scheme_targets_and_settings():
+    reader = ProjectReader(examples_path / 'Example.xcodeproj')
+    # Test targets are only built for testing.
+    assert reader.scheme_target_names('Example-iOS') == ['Example-iOS']
+    assert reader.scheme_target_names('Missing') is None
+
+    assert reader.target_settings('Example-iOS', 'Example-iOS') == {
+        'TARGET_NAME': 'Example-iOS',
+        'MACH_O_TYPE': 'mh_dylib',
+        'PACKAGE_TYPE': 'com.apple.package-type.wrapper.framework',
+        'SUPPORTED_PLATFORMS': 'iphonesimulator iphoneos',
+    }
+    # SDKROOT = $(BASE_SDK) in the scheme's (Debug) configuration.
+    assert reader.target_settings('Example-macOS', 'Example-macOS')['SUPPORTED_PLATFORMS'] == 'macosx'
+    settings = reader.target_settings('ExampleStatic', 'ExampleStatic')
+    assert settings['MACH_O_TYPE'] == 'staticlib'
+    assert settings['SUPPORTED_PLATFORMS'] == 'iphoneos iphonesimulator appletvos appletvsimulator'
+    # Settings can come from an xcconfig file, which only xcodebuild reads.
+    assert reader.target_settings('Example-tvOS', 'Example-tvOS') is None
+
+
+def test_settings_levels():
+    project = PBXProject(examples_path / 'Example.xcodeproj')
+    # SUPPORTED_PLATFORMS is set at project level in Release, which takes precedence over the default for the SDK.
+    assert project.target_settings(project.target_id_named('Example-macOS'), 'Release')['SUPPORTED_PLATFORMS'] == 'iphonesimulator iphoneos'
+    # But the tvOS target's xcconfig file sits between target and project level, and could set it too.
+    assert project.target_settings(project.target_id_named('Example-tvOS'), 'Release') is None
+
+
+def test_xcconfig_paths():
+    # The file doesn't exist, so there are no includes to follow.
+    project = PBXProject(examples_path / 'Example.xcodeproj')
+    assert project.xcconfig_paths == [examples_path / 'Configuration/Shared.xcconfig']
+
+
+def test_workspace():
+    reader = ProjectReader(examples_path / 'Example.xcworkspace')
+    assert reader.info == ([], [], ['All', 'Example-iOS', 'Example-macOS', 'Example-tvOS', 'ExampleStatic'], None)
+    assert reader.scheme_target_names('All') == ['Example-iOS', 'Example-macOS']
+    assert reader.target_settings('All', 'Example-macOS')['MACH_O_TYPE'] == 'mh_dylib'
@@ -0,0 +1,72 @@
+from __future__ import division, absolute_import, print_function
+
+import tempfile
+
+from pathlib2 import Path
+
+from punic.runner import CalledProcessError, Command, Runner
+import punic.shshutil as shutil
+
+
+def test_run_many_limits_concurrency():
+    runner = Runner()
+    runner.jobs = 2
+    commands = [Command(['/bin/sh', '-c', 'sleep 0.2; echo {}'.format(index)]) for index in range(6)]
+    results = []
+    for command, result in runner.run_many(commands):
+        results.append(result.stdout.strip())
+        # The commands still to run hold (or are waiting for) slots.
+        try:
+            runner.jobs = 8
+        except RuntimeError:
+            pass
+        else:
+            assert len(results) == len(commands), 'Runner.jobs should not change while commands are running'
+    assert sorted(results) == [str(index) for index in range(6)]
+
+    # No more than two commands were ever running at once.
+    events = sorted([(entry.start, 1) for entry in runner.ledger] + [(entry.end, -1) for entry in runner.ledger])
+    running = [sum(change for _, change in events[:index + 1]) for index in range(len(events))]
+    assert max(running) == 2
+
+    runner.jobs = 8
+    assert runner.jobs == 8
+
+
+def test_run_many_cancels_on_failure():
+    runner = Runner()
+    runner.jobs = 1
+    commands = [Command(['/bin/sh', '-c', 'exit 1'], check=True)] + [Command(['/bin/sh', '-c', 'sleep 0.1']) for _ in range(5)]
+    try:
+        for _ in runner.run_many(commands):
+            pass
+    except CalledProcessError as e:
+        assert e.returncode == 1
+    else:
+        assert False, 'run_many should raise the failed command\'s CalledProcessError'
+    # The commands that hadn't started by then never do.
+    assert len(runner.ledger) < len(commands)
+
+
+def test_run_logged():
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        log_path = temp_dir / 'Logs/build.log'
+        lines = []
+        result = Runner().run_logged(['/bin/sh', '-c', 'seq 1 5; echo error >&2; exit 3'], log_path, line_handler=lines.append, tail=2)
+        # Everything is logged and handled, only the tail is kept.
+        assert log_path.open().read() == u'1\n2\n3\n4\n5\nerror\n'
+        assert lines == ['1', '2', '3', '4', '5', 'error']
+        assert result.return_code == 3
+        assert result.stdout == '5\nerror'
+
+        try:
+            Runner().run_logged(['/bin/sh', '-c', 'seq 1 5; exit 3'], log_path, check=True, tail=1)
+        except CalledProcessError as e:
+            assert e.returncode == 3
+            assert e.output == '5'
+        else:
+            assert False, 'run_logged should raise CalledProcessError if check is set'
+        assert log_path.open().read() == u'1\n2\n3\n4\n5\n'
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,100 @@
+from __future__ import division, absolute_import, print_function
+
+import stat
+import tempfile
+import threading
+import time
+
+from pathlib2 import Path
+
+from punic.runner import Runner, CalledProcessError
+from punic.scheduler import BuildScheduler
+
+
+def make_xcodebuild(path):
+    """A stand-in for xcodebuild that takes a while to "build" and then exits with the given result code. Like
+    xcodebuild it stops what it is running when it is terminated."""
+    xcodebuild = path / 'xcodebuild'
+    xcodebuild.open('w').write(u'#!/bin/sh\n# xcodebuild <seconds> <result code>\necho "=== BUILD TARGET $0 ==="\nsleep $1 &\ntrap "kill $!; exit 143" TERM\nwait $!\nexit $2\n')
+    xcodebuild.chmod(xcodebuild.stat().st_mode | stat.S_IXUSR)
+    return xcodebuild
+
+
+class Builds(object):
+    def __init__(self, jobs):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.xcodebuild = make_xcodebuild(self.temp_dir)
+        self.runner = Runner()
+        self.runner.jobs = jobs
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.running = 0
+        self.most_running = 0
+
+    def build(self, name, seconds=0.2, result_code=0):
+        def build():
+            with self.lock:
+                self.started.append(name)
+                self.running += 1
+                self.most_running = max(self.most_running, self.running)
+            try:
+                self.runner.run_logged([self.xcodebuild, seconds, result_code], self.temp_dir / '{}.log'.format(name), check=True)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.finished.append(name)
+        return build
+
+
+def test_builds_start_when_dependencies_finish():
+    builds = Builds(jobs=2)
+    scheduler = BuildScheduler(jobs=2)
+    scheduler.add('a', builds.build('a'))
+    scheduler.add('b', builds.build('b', seconds=0.5))
+    scheduler.add('c', builds.build('c'), dependencies=['a'])
+    scheduler.add('d', builds.build('d'), dependencies=['b', 'c'])
+    scheduler.add('e', builds.build('e'))
+    scheduler.run()
+
+    assert builds.most_running == 2
+    # c starts as soon as a is done, while b is still building; e has to wait for a free slot.
+    assert builds.started[:3] == ['a', 'b', 'c']
+    assert builds.finished.index('a') < builds.started.index('c')
+    assert builds.started.index('d') > max(builds.finished.index('b'), builds.finished.index('c'))
+    assert (builds.temp_dir / 'd.log').open().read().startswith('=== BUILD TARGET')
+
+
+def test_first_failure_cancels_everything():
+    builds = Builds(jobs=2)
+    scheduler = BuildScheduler(jobs=2)
+    scheduler.add('slow', builds.build('slow', seconds=30))
+    scheduler.add('broken', builds.build('broken', seconds=0.2, result_code=65))
+    scheduler.add('dependent', builds.build('dependent'), dependencies=['broken'])
+    scheduler.add('waiting', builds.build('waiting'))
+
+    start = time.time()
+    try:
+        scheduler.run(on_failure=builds.runner.terminate)
+    except CalledProcessError as e:
+        assert e.returncode == 65
+    else:
+        assert False, 'the failed build should have been raised'
+    # The slow build was stopped and nothing else was started.
+    assert time.time() - start < 10
+    assert sorted(builds.started) == ['broken', 'slow']
+    assert builds.running == 0
+
+
+def test_unschedulable_builds():
+    scheduler = BuildScheduler(jobs=2)
+    scheduler.add('a', lambda: None, dependencies=['b'])
+    scheduler.add('b', lambda: None, dependencies=['a'])
+    for builds in [scheduler, BuildScheduler()]:
+        builds.add('c', lambda: None, dependencies=['missing'] if builds is not scheduler else [])
+        try:
+            builds.run()
+        except ValueError:
+            pass
+        else:
+            assert False, 'run() should have refused to run {}'.format(builds)
@@ -0,0 +1,176 @@
+from __future__ import division, absolute_import, print_function
+
+import io
+import tarfile
+import tempfile
+import threading
+
+import six
+from pathlib2 import Path
+
+if six.PY2:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+else:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from punic.config import SparsePaths
+from punic.repository import Revision
+from punic.runner import Runner
+from punic.specification import ProjectIdentifier
+from punic.tarball import TarballRepository
+import punic.shshutil as shutil
+
+sha = 'c0ffee0000000000000000000000000000000000'
+
+
+class _Config(object):
+    def __init__(self, path):
+        self.repo_cache_directory = path / 'repo_cache'
+        self.tarball_cache_directory = path / 'tarballs'
+        self.fetch = False
+
+
+class _Punic(object):
+    def __init__(self, path):
+        self.config = _Config(path)
+        self.runner = Runner()
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    root = None
+    requests = []
+
+    def translate_path(self, path):
+        return str(self.root / path.lstrip('/'))
+
+    def do_GET(self):
+        _Handler.requests.append(self.path)
+        SimpleHTTPRequestHandler.do_GET(self)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_tarball(path, commit, files):
+    """Write a tarball laid out like codeload's: everything under a '<repo>-<sha>/' directory, commit in the pax header."""
+    with tarfile.open(str(path), mode='w:gz', format=tarfile.PAX_FORMAT, pax_headers={'comment': commit}) as archive:
+        for name, data in [('bar-{}/'.format(sha), None)] + [('bar-{}/{}'.format(sha, name), data) for name, data in files]:
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                archive.addfile(info)
+            else:
+                info.size = len(data)
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(data))
+
+
+def serve(root):
+    """Serve root over HTTP on a free port, standing in for codeload.github.com."""
+    _Handler.root = root
+    server = HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def make_repository(commit=sha):
+    temp_dir = Path(tempfile.mkdtemp())
+    tarball_path = temp_dir / 'www' / 'foo' / 'bar' / 'tar.gz' / sha
+    tarball_path.parent.mkdir(parents=True)
+    make_tarball(tarball_path, commit, [('Cartfile', b'github "foo/baz"\n'), ('Sources/bar.swift', b'let bar = 1\n')])
+
+    server = serve(temp_dir / 'www')
+    identifier = ProjectIdentifier.string('github "foo/bar"')
+    repository = TarballRepository(_Punic(temp_dir), identifier)
+    repository.codeload_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    return temp_dir, server, repository
+
+
+def test_supports():
+    assert TarballRepository.supports(ProjectIdentifier.string('github "foo/bar"'))
+    assert TarballRepository.supports(ProjectIdentifier.string('github "foo/bar"', use_ssh=True))
+    assert not TarballRepository.supports(ProjectIdentifier.string('git "https://example.com/foo/bar.git"'))
+    assert not TarballRepository.supports(ProjectIdentifier.string('github "foo/bar"', overrides={'bar': 'file:///tmp/bar'}))
+
+
+def test_materialize_and_cache():
+    temp_dir, server, repository = make_repository()
+    try:
+        revision = Revision(repository=repository, revision=sha, revision_type=Revision.Type.commitish)
+        destination = temp_dir / 'Checkouts' / 'bar'
+        destination.parent.mkdir()
+
+        _Handler.requests = []
+        repository.materialize(revision, destination)
+        assert (destination / 'Sources/bar.swift').open().read() == 'let bar = 1\n'
+        assert (destination / 'Cartfile').exists()
+        assert not (destination / 'bar-{}'.format(sha)).exists()
+        assert repository.tarball_path(sha).exists()
+        assert len(_Handler.requests) == 1
+
+        # A second materialization is served from the cache.
+        shutil.rmtree(destination)
+        repository.materialize(revision, destination)
+        assert (destination / 'Sources/bar.swift').exists()
+        assert len(_Handler.requests) == 1
+    finally:
+        server.shutdown()
+        shutil.rmtree(temp_dir)
+
+
+def test_verification_failure():
+    temp_dir, server, repository = make_repository(commit='0' * 40)
+    try:
+        revision = Revision(repository=repository, revision=sha, revision_type=Revision.Type.commitish)
+        destination = temp_dir / 'Checkouts' / 'bar'
+        destination.parent.mkdir()
+        try:
+            repository.materialize(revision, destination)
+        except Exception as e:
+            assert 'expected {}'.format(sha) in str(e)
+        else:
+            assert False, 'materialize should have failed'
+        assert not destination.exists()
+        assert not repository.tarball_path(sha).exists()
+    finally:
+        server.shutdown()
+        shutil.rmtree(temp_dir)
+
+
+def test_sparse_materialize_with_submodules():
+    temp_dir = Path(tempfile.mkdtemp())
+    upstream_path = temp_dir / 'upstream'
+    runner = Runner()
+    runner.check_run(['git', 'init', '--quiet', str(upstream_path)])
+    (upstream_path / 'Sources').mkdir()
+    (upstream_path / 'Sources/bar.swift').open('w').write(u'let bar = 1\n')
+    (upstream_path / '.gitmodules').open('w').write(u'')
+    runner.check_run('git add --all', cwd=upstream_path)
+    runner.check_run(['git', '-c', 'user.name=punic', '-c', 'user.email=punic@example.com', 'commit', '--quiet', '-m', 'Commit'], cwd=upstream_path)
+    upstream_sha = runner.check_run('git rev-parse HEAD', cwd=upstream_path).strip()
+
+    tarball_path = temp_dir / 'www' / 'foo' / 'bar' / 'tar.gz' / upstream_sha
+    tarball_path.parent.mkdir(parents=True)
+    make_tarball(tarball_path, upstream_sha, [('.gitmodules', b''), ('Sources/bar.swift', b'let bar = 1\n')])
+    server = serve(temp_dir / 'www')
+    try:
+        repository = TarballRepository(_Punic(temp_dir), ProjectIdentifier.string('github "foo/bar"'))
+        repository.codeload_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        repository.identifier.remote_url = str(upstream_path)
+        repository.config.repo_cache_directory.mkdir()
+        revision = Revision(repository=repository, revision=upstream_sha, revision_type=Revision.Type.commitish)
+        destination = temp_dir / 'Checkouts' / 'bar'
+        destination.parent.mkdir()
+
+        # The tarball can't have the submodules, even though the sparse paths don't include .gitmodules.
+        repository.materialize(revision, destination, sparse=SparsePaths(include=['Sources']))
+        assert repository.uses_git
+        assert (destination / 'Sources/bar.swift').exists()
+        assert not (destination / '.gitmodules').exists()
+    finally:
+        server.shutdown()
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,170 @@
+from __future__ import division, absolute_import, print_function
+
+import os
+import stat
+import tempfile
+
+from pathlib2 import Path
+
+from punic import Punic
+from punic.config import Config
+from punic.errors import PunicRepresentableError, XcodeBuildError
+from punic.runner import Runner
+from punic.semantic_version import SemanticVersion
+from punic.xcode import Xcode, Xcodes, XcodeBuildArguments, XcodeProject
+import punic.shshutil as shutil
+
+examples_path = Path(__file__).parent / 'Examples/Pbxproj'
+
+
+def make_xcode(path, version):
+    """Lay out just enough of an Xcode bundle for discovery: an Info.plist and an xcodebuild that reports version."""
+    (path / 'Contents/Developer/usr/bin').mkdir(parents=True)
+    (path / 'Contents/Info.plist').open('w').write(u'<plist/>\n')
+    write_xcodebuild(path, version)
+
+
+def write_xcodebuild(path, version):
+    xcodebuild = path / 'Contents/Developer/usr/bin/xcodebuild'
+    xcodebuild.open('w').write(u'#!/bin/sh\nprintf "Xcode {}\\nBuild version 1A1\\n"\n'.format(version))
+    xcodebuild.chmod(xcodebuild.stat().st_mode | stat.S_IXUSR)
+
+
+def make_xcodes(temp_dir):
+    """A session's Xcodes, discovering the bundles in temp_dir instead of asking Spotlight."""
+    xcodes = Xcodes(Runner(), cache_path=temp_dir / 'xcodes.json')
+    xcodes.discovery_command = ['/bin/sh', '-c', 'ls -d {}/*.app'.format(temp_dir)]
+    return xcodes
+
+
+def test_discovery_is_cached():
+    temp_dir = Path(tempfile.mkdtemp())
+    saved_developer_dir = os.environ.get('DEVELOPER_DIR')
+    try:
+        make_xcode(temp_dir / 'Xcode.app', '8.2.1')
+        make_xcode(temp_dir / 'Xcode-beta.app', '9.0')
+        os.environ['DEVELOPER_DIR'] = str(temp_dir / 'Xcode.app/Contents/Developer')
+
+        xcodes = make_xcodes(temp_dir)
+        assert sorted(xcodes.find_all()) == [SemanticVersion.string('8.2.1'), SemanticVersion.string('9.0')]
+        assert xcodes.default().path == temp_dir / 'Xcode.app'
+        assert xcodes.cache_path.exists()
+
+        # A new session selects a version from the cache without running anything.
+        xcodes = make_xcodes(temp_dir)
+        assert xcodes.with_version('9.0').path == temp_dir / 'Xcode-beta.app'
+        assert xcodes.default().is_default
+        assert len(xcodes.runner.ledger) == 0
+
+        # Updating a bundle changes its Info.plist, so (only) its version is asked for again, with the session's runner.
+        write_xcodebuild(temp_dir / 'Xcode-beta.app', '9.1')
+        info_path = temp_dir / 'Xcode-beta.app/Contents/Info.plist'
+        os.utime(str(info_path), (info_path.stat().st_atime, info_path.stat().st_mtime + 10))
+        xcodes = make_xcodes(temp_dir)
+        assert xcodes.with_version('9.1').path == temp_dir / 'Xcode-beta.app'
+        assert [entry.args[-1] for entry in xcodes.runner.ledger] == [xcodes.discovery_command[-1], '-version']
+
+        # Selecting a newly installed Xcode finds it, even though every cached bundle is unchanged.
+        make_xcode(temp_dir / 'Xcode-10.app', '10.0')
+        os.environ['DEVELOPER_DIR'] = str(temp_dir / 'Xcode-10.app/Contents/Developer')
+        assert make_xcodes(temp_dir).default().version == SemanticVersion.string('10.0')
+
+        os.environ['DEVELOPER_DIR'] = str(temp_dir / 'Missing.app/Contents/Developer')
+        try:
+            make_xcodes(temp_dir).default()
+        except PunicRepresentableError:
+            pass
+        else:
+            assert False, 'Xcodes.default() should fail without an Xcode for DEVELOPER_DIR'
+    finally:
+        if saved_developer_dir is None:
+            del os.environ['DEVELOPER_DIR']
+        else:
+            os.environ['DEVELOPER_DIR'] = saved_developer_dir
+        shutil.rmtree(temp_dir)
+
+
+def test_sessions_are_isolated():
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        for name in ['A', 'B']:
+            (temp_dir / name).mkdir()
+            make_xcode(temp_dir / name / 'Xcode.app', '9.0' if name == 'A' else '10.0')
+        xcodes = dict((name, make_xcodes(temp_dir / name)) for name in ['A', 'B'])
+        assert list(xcodes['A'].find_all()) == [SemanticVersion.string('9.0')]
+        assert list(xcodes['B'].find_all()) == [SemanticVersion.string('10.0')]
+        assert xcodes['A'].find_all()[SemanticVersion.string('9.0')].runner is xcodes['A'].runner
+        assert (temp_dir / 'A/xcodes.json').exists() and (temp_dir / 'B/xcodes.json').exists()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+class _BundleXcode(Xcode):
+    """Runs the bundle's own xcodebuild, rather than whatever xcrun finds."""
+
+    def command(self, command, **kwargs):
+        command = super(_BundleXcode, self).command(command, **kwargs)
+        command.command[:2] = [str(self.developer_dir_path / 'usr/bin/xcodebuild')]
+        return command
+
+
+def test_build_settings_follow_xcconfig_files():
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        shutil.copytree(examples_path / 'Example.xcodeproj', temp_dir / 'Example.xcodeproj')
+        (temp_dir / 'Configuration').mkdir()
+        (temp_dir / 'Configuration/Shared.xcconfig').open('w').write(u'#include "Base.xcconfig"\n')
+        base_path = temp_dir / 'Configuration/Base.xcconfig'
+        base_path.open('w').write(u'SUPPORTED_PLATFORMS = appletvsimulator appletvos\n')
+
+        # Settings "from" the xcconfig file the Example-tvOS target is based on (by way of Shared.xcconfig).
+        make_xcode(temp_dir / 'Xcode.app', '9.0')
+        xcodebuild = temp_dir / 'Xcode.app/Contents/Developer/usr/bin/xcodebuild'
+        xcodebuild.open('w').write(u"""#!/bin/sh
+echo 'Build settings for action build and target Example-tvOS:'
+echo '    TARGET_NAME = Example-tvOS'
+sed 's/^/    /' '{}'
+""".format(base_path))
+
+        def build_settings():
+            config = Config(root_path=temp_dir)
+            punic = Punic(config, Runner(cache_path=temp_dir / 'cache.sqlite'))
+            xcode = _BundleXcode(temp_dir / 'Xcode.app', punic.runner)
+            xcode._version = SemanticVersion.string('9.0')
+            project = XcodeProject(punic, xcode, temp_dir / 'Example.xcodeproj')
+            settings = project.build_settings(XcodeBuildArguments(scheme='Example-tvOS', sdk='appletvos'))
+            return settings['Example-tvOS']['SUPPORTED_PLATFORMS'], len(punic.runner.ledger) - sum(entry.cache_hit for entry in punic.runner.ledger)
+
+        assert build_settings() == ('appletvsimulator appletvos', 1)
+        assert build_settings() == ('appletvsimulator appletvos', 0)
+
+        # Editing a file the project's xcconfig file includes invalidates the cached settings.
+        base_path.open('w').write(u'SUPPORTED_PLATFORMS = appletvos\n')
+        assert build_settings() == ('appletvos', 1)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_build_log():
+    temp_dir = Path(tempfile.mkdtemp())
+    try:
+        make_xcode(temp_dir / 'Xcode.app', '9.0')
+        (temp_dir / 'Xcode.app/Contents/Developer/usr/bin/xcodebuild').open('w').write(u'#!/bin/sh\necho "$@"\nexit 65\n')
+        config = Config(root_path=temp_dir)
+        config.build_logs_path = temp_dir / 'Logs'
+        punic = Punic(config, Runner())
+        xcode = _BundleXcode(temp_dir / 'Xcode.app', punic.runner)
+        xcode._version = SemanticVersion.string('9.0')
+        project = XcodeProject(punic, xcode, examples_path / 'Example.xcodeproj')
+        # Builds of different dependencies' projects of the same name get their own logs, missing parts are left out.
+        for dependency, configuration, name in [('Bar', None, 'Bar-Example-Example-tvOS-appletvos.log'), (None, 'Release', 'Example-Example-tvOS-appletvos-Release.log')]:
+            try:
+                project.build(XcodeBuildArguments(scheme='Example-tvOS', sdk='appletvos', configuration=configuration), dependency=dependency)
+            except XcodeBuildError as e:
+                assert e.log_path == temp_dir / 'Logs' / name
+                assert e.output.endswith(' build')
+                assert e.log_path.open().read() == e.output + u'\n'
+            else:
+                assert False, 'XcodeProject.build should raise XcodeBuildError when xcodebuild fails'
+    finally:
+        shutil.rmtree(temp_dir)
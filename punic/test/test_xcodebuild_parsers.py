@@ -0,0 +1,100 @@
+from __future__ import division, absolute_import, print_function
+
+import io
+import json
+import re
+import sys
+import timeit
+
+from punic.xcode import _parse_build_settings, _parse_build_settings_json, build_settings_keys
+
+
+def make_output(targets=20, settings=600):
+    """Return xcodebuild -showBuildSettings output (text and -json) shaped like a real project's: a block of several
+    hundred settings for each target, only a handful of which punic reads."""
+    blocks = []
+    for index in range(targets):
+        target = 'Target{}'.format(index)
+        build_settings = dict(('SETTING_{}'.format(number), '/Users/example/Library/Developer/Xcode/DerivedData/Example-abcdefgh/Build/Intermediates/{}/{}'.format(target, number)) for number in range(settings))
+        build_settings.update({
+            'TARGET_NAME': target,
+            'MACH_O_TYPE': 'mh_dylib',
+            'PACKAGE_TYPE': 'com.apple.package-type.wrapper.framework',
+            'SUPPORTED_PLATFORMS': 'iphonesimulator iphoneos',
+            'FULL_PRODUCT_NAME': '{}.framework'.format(target),
+            'PRODUCT_NAME': target,
+            'EXECUTABLE_NAME': target,
+            'TARGET_BUILD_DIR': '/tmp/DerivedData/Build/Products/Release-iphoneos',
+            'SDK_NAME': 'iphoneos11.0',
+            'OTHER_LDFLAGS': '-ObjC -framework "Foo Bar" = odd',
+        })
+        blocks.append((target, build_settings))
+    text = ''.join('Build settings for action build and target {}:\n'.format(target) + ''.join('    {} = {}\n'.format(key, value) for key, value in sorted(build_settings.items())) + '\n' for target, build_settings in blocks)
+    json_text = json.dumps([{'action': 'build', 'target': target, 'buildSettings': build_settings} for target, build_settings in blocks], indent=4, separators=(',', ' : '))
+    return text.encode('utf-8'), json_text.encode('utf-8')
+
+
+def legacy_parse_build_settings(string):
+    """The parser punic used before: two uncompiled regular expressions matched against every line."""
+    lines = iter(string.splitlines())
+    lines = (line.strip() for line in lines)
+    all_build_settings = list()
+    current_build_settings = dict()
+    for line in lines:
+        match = re.match(r'^Build settings for action (?P<action>.+) and target "?(?P<target>.+)"?:$', line)
+        if match:
+            if current_build_settings:
+                all_build_settings.append(current_build_settings)
+            current_build_settings = dict()
+            continue
+        match = re.match(r'^(?P<setting>.+) = (?P<value>.+)$', line)
+        if match:
+            current_build_settings[match.groupdict()['setting']] = match.groupdict()['value']
+    if current_build_settings:
+        all_build_settings.append(current_build_settings)
+    return dict([(build_settings['TARGET_NAME'], build_settings) for build_settings in all_build_settings if 'TARGET_NAME' in build_settings])
+
+
+def test_parsers_agree():
+    text, json_text = make_output(targets=3, settings=50)
+    expected = dict((target, dict((key, value) for key, value in build_settings.items() if key in build_settings_keys)) for target, build_settings in legacy_parse_build_settings(text.decode('utf-8')).items())
+    assert len(expected) == 3 and len(expected['Target1']) == len(build_settings_keys)
+    assert _parse_build_settings(io.BytesIO(text), keys=build_settings_keys) == expected
+    assert _parse_build_settings_json(io.BytesIO(json_text), keys=build_settings_keys) == expected
+    # Unfiltered, every setting is kept, and values containing ' = ' (which the legacy parser split in the wrong place) are intact.
+    build_settings = _parse_build_settings(io.BytesIO(text))
+    assert len(build_settings['Target0']) == 60
+    assert build_settings['Target0']['OTHER_LDFLAGS'] == '-ObjC -framework "Foo Bar" = odd'
+
+
+def test_parser_json_in_small_chunks():
+    _, json_text = make_output(targets=3, settings=10)
+
+    class Trickle(io.BytesIO):
+        def read(self, size=-1):
+            return io.BytesIO.read(self, 7)
+
+    assert sorted(_parse_build_settings_json(Trickle(json_text), keys=['TARGET_NAME'])) == ['Target0', 'Target1', 'Target2']
+    try:
+        _parse_build_settings_json(io.BytesIO(json_text[:-20]))
+    except ValueError:
+        pass
+    else:
+        assert False, 'truncated output should not parse'
+
+
+def benchmark(targets=20, settings=600, number=3):
+    """Time the parsers on large output, return (legacy, text, json) seconds per parse."""
+    text, json_text = make_output(targets=targets, settings=settings)
+    legacy = min(timeit.repeat(lambda: legacy_parse_build_settings(text.decode('utf-8')), number=1, repeat=number))
+    streaming = min(timeit.repeat(lambda: _parse_build_settings(io.BytesIO(text), keys=build_settings_keys), number=1, repeat=number))
+    streaming_json = min(timeit.repeat(lambda: _parse_build_settings_json(io.BytesIO(json_text), keys=build_settings_keys), number=1, repeat=number))
+    return legacy, streaming, streaming_json
+
+
+if __name__ == '__main__':
+    # python -m punic.test.test_xcodebuild_parsers [targets]
+    targets = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    legacy, streaming, streaming_json = benchmark(targets=targets)
+    lines = targets * 611
+    print('{} lines: legacy {:.3f}s, streaming {:.3f}s ({:.1f}x faster), json {:.3f}s ({:.1f}x faster)'.format(lines, legacy, streaming, legacy / streaming, streaming_json, legacy / streaming_json))
@@ -0,0 +1,99 @@
+from __future__ import division, absolute_import, print_function
+
+__all__ = ['write_chrome_trace', 'summarize', 'log_summary']
+
+import json
+import logging
+import os
+from collections import OrderedDict
+
+# xcodebuild takes its action anywhere in its arguments, these are the ones punic uses.
+_xcodebuild_actions = ['build', 'clean', 'test', 'archive', '-list', '-showBuildSettings', '-version']
+# git options that come before the subcommand and take a separate value.
+_git_options_with_values = ['-C', '-c', '--git-dir', '--work-tree', '--namespace']
+
+
+def command_group(args):
+    # type: ([str]) -> str
+    """Return the executable and (where it has one) the subcommand of a command line, for grouping.
+
+    >>> command_group(['git', 'fetch'])
+    'git fetch'
+    >>> command_group(['git', '--git-dir', 'Foo/.git', 'archive', 'HEAD'])
+    'git archive'
+    >>> command_group(['/usr/bin/xcrun', 'xcodebuild', '-project', 'Foo.xcodeproj', '-scheme', 'Foo', '-showBuildSettings'])
+    'xcodebuild -showBuildSettings'
+    >>> command_group(['/usr/bin/xcrun', 'lipo', '-create', 'a', 'b'])
+    'lipo'
+    """
+    if args and os.path.basename(args[0]) == 'xcrun':
+        args = args[1:]
+    if not args:
+        return ''
+    executable = os.path.basename(args[0])
+    subcommand = None
+    if executable == 'git':
+        arguments = iter(args[1:])
+        for arg in arguments:
+            if arg in _git_options_with_values:
+                next(arguments, None)
+            elif not arg.startswith('-'):
+                subcommand = arg
+                break
+    elif executable == 'xcodebuild':
+        subcommand = next((arg for arg in args[1:] if arg in _xcodebuild_actions), None)
+    return '{} {}'.format(executable, subcommand) if subcommand else executable
+
+
+def write_chrome_trace(ledger, path):
+    # type: ([LedgerEntry], Path)
+    """Write ledger as Chrome trace-event JSON (load it in chrome://tracing or https://ui.perfetto.dev)."""
+    entries = [entry for entry in ledger if entry.end is not None]
+    origin = min(entry.start for entry in entries) if entries else 0
+    threads = dict()
+    events = []
+    for entry in entries:
+        events.append({
+            'name': command_group(entry.args),
+            'cat': 'cache' if entry.cache_hit else 'process',
+            'ph': 'X',
+            'pid': os.getpid(),
+            'tid': threads.setdefault(entry.thread, len(threads) + 1),
+            'ts': int((entry.start - origin) * 1000000),
+            'dur': int(entry.duration * 1000000),
+            'args': {
+                'argv': entry.args,
+                'cwd': str(entry.cwd) if entry.cwd else None,
+                'return_code': entry.return_code,
+                'output_bytes': entry.output_bytes,
+                'cache_hit': entry.cache_hit,
+            },
+        })
+    with open(str(path), 'w') as stream:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, stream)
+
+
+def summarize(ledger):
+    # type: ([LedgerEntry]) -> [(str, int, int, float, int)]
+    """Return (group, count, cache hits, total seconds, output bytes) for each command group, slowest first."""
+    groups = OrderedDict()
+    for entry in ledger:
+        if entry.end is None:
+            continue
+        row = groups.setdefault(command_group(entry.args), [0, 0, 0.0, 0])
+        row[0] += 1
+        row[1] += 1 if entry.cache_hit else 0
+        row[2] += entry.duration
+        row[3] += entry.output_bytes
+    return sorted([tuple([group] + row) for group, row in groups.items()], key=lambda row: row[3], reverse=True)
+
+
+def log_summary(ledger):
+    # type: ([LedgerEntry])
+    rows = summarize(ledger)
+    if not rows:
+        return
+    width = max(len(row[0]) for row in rows)
+    logging.info('{:{width}}  {:>6}  {:>6}  {:>10}  {:>12}'.format('Command', 'Count', 'Cached', 'Seconds', 'Output bytes', width=width))
+    for group, count, cache_hits, seconds, output_bytes in rows:
+        logging.info('<ref>{:{width}}</ref>  {:>6}  {:>6}  <echo>{:>10.3f}</echo>  {:>12}'.format(group, count, cache_hits, seconds, output_bytes, width=width))
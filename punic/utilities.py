@@ -1,12 +1,14 @@
 from __future__ import division, absolute_import, print_function
 
-__all__ = ['work_directory', 'timeit']
+__all__ = ['work_directory', 'timeit', 'mproperty', 'locked_paths']
 
 import contextlib
+import fcntl
+import functools
 import os
+import threading
 import time
 import logging
-import punic
 
 @contextlib.contextmanager
 def work_directory(path):
@@ -26,14 +28,73 @@ def work_directory(path):
 
 
 @contextlib.contextmanager
-def timeit(task=None, log=None):
-
-    if log is None:
-        log = punic.current_session.config.log_timings
-
-    # type: (Union[str, None])
+def timeit(task=None, log=False):
+    # type: (Union[str, None], bool)
     start = time.time()
     yield
     end = time.time()
     if log:
         logging.info('Task \'<ref>{}</ref>\' took <echo>{:.6f}</echo> seconds.'.format(task if task else '<unnamed task>', end - start))
+
+
+def mproperty(fn):
+    """A memoized property, like memoize.mproperty, that is safe to read from several threads at once.
+
+    fn runs at most once per instance: other threads asking for the value while it is being computed wait for it. The
+    lock is reentrant and per instance, so memoized properties of the same object can use each other."""
+    attribute = '_memo_{}'.format(fn.__name__)
+
+    @property
+    @functools.wraps(fn)
+    def _property(self):
+        values = self.__dict__
+        if attribute not in values:
+            with values.setdefault('_memo_lock', threading.RLock()):
+                if attribute not in values:
+                    values[attribute] = fn(self)
+        return values[attribute]
+
+    return _property
+
+
+_path_locks = dict()
+_path_locks_lock = threading.Lock()
+
+
+class _PathLock(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+
+@contextlib.contextmanager
+def locked_paths(paths):
+    # type: ([Path])
+    """Hold an exclusive lock on each of paths, against other threads and other processes, for the duration.
+
+    Locks are taken in a fixed order, so callers can't deadlock each other, and are reentrant within a thread. The lock
+    for `foo` is the file `.foo.lock` next to it."""
+    paths = sorted(set(paths), key=str)
+    if not paths:
+        yield
+        return
+    path = paths[0]
+    with _path_locks_lock:
+        path_lock = _path_locks.setdefault(str(path), _PathLock())
+    with path_lock.lock:
+        if not path_lock.depth:
+            if not path.parent.exists():
+                path.parent.mkdir(parents=True)
+            path_lock.file = open(str(path.parent / '.{}.lock'.format(path.name)), 'w')
+            fcntl.flock(path_lock.file, fcntl.LOCK_EX)
+        path_lock.depth += 1
+        try:
+            with locked_paths(paths[1:]):
+                yield
+        finally:
+            path_lock.depth -= 1
+            if not path_lock.depth:
+                fcntl.flock(path_lock.file, fcntl.LOCK_UN)
+                path_lock.file.close()
+                path_lock.file = None
@@ -1,62 +1,169 @@
 from __future__ import division, absolute_import, print_function
 
-__all__ = ['Xcode', 'XcodeProject', 'uuids_from_binary', 'XcodeBuildProduct', 'XcodeBuildArguments']
+__all__ = ['Xcodes', 'Xcode', 'XcodeProject', 'uuids_from_binary', 'XcodeBuildProduct', 'XcodeBuildArguments']
 
+import codecs
+import copy
+import hashlib
+import json
+import os
 import re
+import threading
 import affirm
 from pathlib2 import Path
-from memoize import mproperty
+from .utilities import mproperty
 import six
 import logging
 
 from .runner import *
 from .semantic_version import *
-
-
-class Xcode(object):
-    _all_xcodes = None
-    _default_xcode = None
-
-    @classmethod
-    def default(cls):
-        if not Xcode._default_xcode:
-            Xcode.find_all()
-        return Xcode._default_xcode
-
-    @classmethod
-    def with_version(cls, version):
+from .pbxproj import ProjectReader, workspace_projects
+from .errors import PunicRepresentableError, XcodeBuildError
+
+
+class Xcodes(object):
+    """The Xcodes installed on this machine, as found by one session.
+
+    The bundles and their versions are cached at `cache_path` (if given) between runs, keyed by bundle path and the
+    modification time of the bundle's Info.plist, so while every cached bundle is unchanged (and one of them is the
+    default) finding them runs no commands. Any commands that are needed run with the session's runner.
+    """
+
+    # The command that lists the path of every installed Xcode bundle, one per line.
+    discovery_command = ['/usr/bin/mdfind', 'kMDItemCFBundleIdentifier="com.apple.dt.Xcode" and kMDItemContentType="com.apple.application-bundle"']
+
+    def __init__(self, runner, cache_path=None):
+        # type: (Runner, Path)
+        self.runner = runner
+        self.cache_path = cache_path
+        self._all_xcodes = None
+        self._default_xcode = None
+        self._lock = threading.Lock()
+
+    def default(self):
+        # type: () -> Xcode
+        if not self._default_xcode:
+            self.find_all()
+            if not self._default_xcode:
+                raise PunicRepresentableError('No Xcode found for the selected developer directory <ref>{}</ref>. Select one with `xcode-select` or `DEVELOPER_DIR`.'.format(self._default_developer_dir_path()))
+        return self._default_xcode
+
+    def with_version(self, version):
+        # type: (Any) -> Xcode
         if isinstance(version, six.string_types):
             version = SemanticVersion.string(version)
         if isinstance(version, int):
             version = SemanticVersion(major=version, minor=0)
-        return Xcode.find_all()[version] if version in Xcode.find_all() else None
+        if version not in self.find_all():
+            # The cache only knows about the Xcodes installed when it was written.
+            self.find_all(refresh=True)
+        return self.find_all().get(version)
+
+    def find_all(self, refresh=False):
+        # type: (bool) -> {SemanticVersion: Xcode}
+        """Return the installed Xcodes keyed by version. Pass `refresh` to run `discovery_command` even if the cache is
+        up to date (to find newly installed Xcodes)."""
+        with self._lock:
+            if self._all_xcodes is None or refresh:
+                xcodes, discovered = self._discover(refresh)
+                default_developer_dir_path = self._default_developer_dir_path()
+                default_xcode = next((xcode for xcode in xcodes if xcode.developer_dir_path == default_developer_dir_path), None)
+                if not default_xcode and not discovered:
+                    # A newly installed Xcode has been selected (with xcode-select or DEVELOPER_DIR) since the cache was written.
+                    xcodes, discovered = self._discover(True)
+                    default_xcode = next((xcode for xcode in xcodes if xcode.developer_dir_path == default_developer_dir_path), None)
+                self._default_xcode = default_xcode
+                if self._default_xcode:
+                    self._default_xcode.is_default = True
+                self._all_xcodes = dict([(xcode.version, xcode) for xcode in xcodes])
+        return self._all_xcodes
+
+    def _discover(self, refresh):
+        # type: (bool) -> ([Xcode], bool)
+        """Return the installed Xcodes (with their versions) from the cache, or by running `discovery_command` if the
+        cache is out of date or refresh is set, and whether discovery_command was run."""
+        cache = self._read_cache()
+        xcodes = [Xcode(Path(path), self.runner) for path in sorted(cache)]
+        discovered = refresh or not xcodes or any(xcode._info_mtime() != cache[str(xcode.path)]['mtime'] for xcode in xcodes)
+        if discovered:
+            output = self.runner.check_run(self.discovery_command)
+            xcodes = [Xcode(Path(path), self.runner) for path in output.strip().split('\n') if path]
+        for xcode in xcodes:
+            entry = cache.get(str(xcode.path))
+            if entry and entry['mtime'] == xcode._info_mtime():
+                xcode._version = SemanticVersion.string(entry['version'])
+        commands = dict((xcode._version_command(), xcode) for xcode in xcodes if xcode._version is None)
+        for command, result in self.runner.run_many(commands):
+            commands[command]._version = _parse_version(result.stdout)
+        if commands or set(str(xcode.path) for xcode in xcodes) != set(cache):
+            self._write_cache(xcodes)
+        return xcodes, discovered
+
+    def _default_developer_dir_path(self):
+        # type: () -> Path
+        # xcode-select -p reports DEVELOPER_DIR if set, otherwise the target of this link. Reading either is free.
+        if os.environ.get('DEVELOPER_DIR'):
+            return Path(os.environ['DEVELOPER_DIR'])
+        if os.path.islink('/var/db/xcode_select_link'):
+            return Path(os.path.realpath('/var/db/xcode_select_link'))
+        return Path(self.runner.check_run(['xcode-select', '-p']).strip())
+
+    def _read_cache(self):
+        # type: () -> dict
+        if not self.cache_path or not self.cache_path.exists():
+            return dict()
+        try:
+            with self.cache_path.open() as stream:
+                return json.load(stream)['xcodes']
+        except (ValueError, KeyError, TypeError):
+            logging.debug('Ignoring unreadable Xcode cache at {}'.format(self.cache_path))
+            return dict()
+
+    def _write_cache(self, xcodes):
+        if not self.cache_path:
+            return
+        cache = dict((str(xcode.path), {'mtime': xcode._info_mtime(), 'version': six.text_type(xcode.version)}) for xcode in xcodes)
+        # Other sessions and processes share the cache, the rename replaces it atomically.
+        temp_path = self.cache_path.with_name('.{}.{}.{}'.format(self.cache_path.name, os.getpid(), threading.current_thread().ident))
+        with temp_path.open('w') as stream:
+            stream.write(six.text_type(json.dumps({'xcodes': cache})))
+        os.rename(str(temp_path), str(self.cache_path))
 
-    @classmethod
-    def find_all(cls):
-        if Xcode._all_xcodes is None:
-            output = runner.check_run('/usr/bin/mdfind \'kMDItemCFBundleIdentifier="com.apple.dt.Xcode" and kMDItemContentType="com.apple.application-bundle"\'')
-            xcodes = [Xcode(Path(path)) for path in output.strip().split("\n")]
-            Xcode._all_xcodes = dict([(xcode.version, xcode) for xcode in xcodes])
-            default_developer_dir_path = Path(runner.check_run(['xcode-select', '-p']).strip())
-            Xcode._default_xcode = [xcode for version, xcode in Xcode._all_xcodes.items() if xcode.developer_dir_path == default_developer_dir_path][0]
-            Xcode._default_xcode.is_default = True
-        return Xcode._all_xcodes
-
-    def __init__(self, path):
+
+class Xcode(object):
+    """An installed Xcode, as found by `Xcodes`. Its commands run with the runner of the session that found it."""
+
+    def __init__(self, path, runner):
+        # type: (Path, Runner)
         self.path = path
+        self.runner = runner
         self.is_default = False
         self.developer_dir_path = self.path / 'Contents/Developer'
+        self._version = None
 
-    @mproperty
+    def _info_mtime(self):
+        # type: () -> float
+        try:
+            return os.stat(str(self.path / 'Contents/Info.plist')).st_mtime
+        except OSError:
+            return None
+
+    @property
     def version(self):
-        output = self.check_call(['xcodebuild', '-version'], env={'DEVELOPER_DIR': str(self.developer_dir_path)})
-        match = re.match(r'^Xcode (?P<version>.+)\nBuild version (?P<build>.+)', output)
-        return SemanticVersion.string(match.groupdict()['version'])
+        if self._version is None:
+            self._version = _parse_version(self.runner.run_command(self._version_command()).stdout)
+        return self._version
 
+    def _version_command(self):
+        # type: () -> Command
+        # The bundle's own xcodebuild, which is what xcrun would find with DEVELOPER_DIR set to it.
+        return Command([str(self.developer_dir_path / 'usr/bin/xcodebuild'), '-version'], check=True)
 
     # noinspection PyMethodMayBeStatic
-    def call(self, command, **kwargs):
-        command = runner.convert_args(command)
+    def command(self, command, **kwargs):
+        # type: (...) -> Command
+        """Return a Command that runs command with this Xcode's tools. Takes the same arguments as `Runner.run`."""
+        command = Runner.convert_args(command)
         command = ['/usr/bin/xcrun'] + command
 
         if not self.is_default:
@@ -66,8 +173,10 @@ class Xcode(object):
                 env.update(kwargs['env'])
             kwargs['env'] = env
 
-        result = runner.run(command, **kwargs)
-        return result
+        return Command(command, **kwargs)
+
+    def call(self, command, **kwargs):
+        return self.runner.run_command(self.command(command, **kwargs))
 
     # noinspection PyMethodMayBeStatic
     def check_call(self, command, **kwargs):
@@ -82,16 +191,34 @@ class Xcode(object):
 ########################################################################################################################
 
 class XcodeProject(object):
-    def __init__(self, punic, xcode, path, identifier):
+    def __init__(self, punic, xcode, path):
         assert punic
         assert xcode
         assert path
-        assert identifier
 
         self.punic = punic
         self.xcode = xcode
         self.path = path
-        self.identifier = identifier
+        # Build settings by query, see `build_settings`.
+        self._build_settings = dict()
+
+    @mproperty
+    def content_hash(self):
+        # type: () -> str
+        """A digest of the files that define the project's targets, schemes and build settings (project.pbxproj,
+        contents.xcworkspacedata, .xcscheme and .xcconfig files, including those of the projects in a workspace)."""
+        digest = hashlib.sha1()
+        for path in _definition_paths(self.path, self.reader):
+            digest.update(os.path.relpath(str(path), str(self.path.parent)).encode('utf-8'))
+            with path.open('rb') as stream:
+                digest.update(hashlib.sha1(stream.read()).digest())
+        return digest.hexdigest()
+
+    @property
+    def cache_key(self):
+        # type: () -> str
+        """The result cache key for xcodebuild queries on this project, which changes when it or Xcode does."""
+        return '{},{}'.format(self.content_hash, self.xcode.version)
 
     @property
     def targets(self):
@@ -118,44 +245,90 @@ class XcodeProject(object):
 
 
 
+    @mproperty
+    def reader(self):
+        # type: () -> ProjectReader
+        return ProjectReader(self.path)
+
     @mproperty
     def info(self):
-        arguments = XcodeBuildArguments()
-        arguments.project = self.path
-        output = self.check_call(subcommand='-list', cache_key=self.identifier)
+        info = self.reader.info
+        if info:
+            return info
+        output = self.check_call(subcommand='-list', cache_key=self.cache_key)
         targets, configurations, schemes, default_configuration = _parse_info(output)
         return targets, configurations, schemes, default_configuration
 
     def build_settings(self, arguments):
         # type: (XcodeBuildArguments) -> dict()
-        output = self.check_call(subcommand='-showBuildSettings', arguments=arguments, cache_key=self.identifier)
-        return _parse_build_settings(output)
-
-    def build(self, arguments):
-        # type: (XcodeBuildArguments) -> dict()
+        """Return the build settings punic reads (`build_settings_keys`) of every target arguments would build, keyed
+        by target name.
+
+        Each distinct query runs xcodebuild at most once per session and its output is parsed as it is read; results are
+        also kept in the runner's result cache under `cache_key`, so an unchanged project is never queried again. Xcode
+        10 and later report the settings as JSON."""
+        arguments = copy.copy(arguments)
+        arguments.jobs = None  # Doesn't change any setting.
+        key = tuple(six.text_type(argument) for argument in arguments.to_list())
+        if key not in self._build_settings:
+            use_json = self.xcode.version >= SemanticVersion(major=10, minor=0)
+            command = self.command(subcommand='-showBuildSettings', arguments=arguments, flags=['-json'] if use_json else [])
+            parser = _parse_build_settings_json if use_json else _parse_build_settings
+            cache_key = '{},{}'.format(self.cache_key, ','.join(sorted(build_settings_keys)))
+            self._build_settings[key] = self.punic.runner.run_parsed(command.command, lambda stdout: parser(stdout, keys=build_settings_keys), env=command.env, cache_key=cache_key)
+        return self._build_settings[key]
+
+    def build(self, arguments, record=None, buffered=False, dependency=None):
+        # type: (XcodeBuildArguments, BuildRecord, bool, str) -> dict()
+        """Build, returning the products of the scheme's framework targets. If record is given the build's timings
+        (including xcodebuild's build timing summary, on Xcode 10 and later) are collected in it.
+
+        xcodebuild's output goes to a log in config.build_logs_path named after the dependency (if given), project,
+        scheme, SDK and configuration. Raises XcodeBuildError if the build fails. If buffered is set the interesting
+        parts of xcodebuild's output are shown in one block once the build has finished, so that builds running at the
+        same time don't interleave."""
+        parts = [dependency, self.path.stem, arguments.scheme, arguments.sdk, arguments.configuration]
+        log_path = self.punic.config.build_logs_path / '{}.log'.format('-'.join(part for part in parts if part))
+        lines = []
+
+        def line_handler(line):
+            if record:
+                record.feed(line)
+            line = _format_xcodebuild_line(line)
+            if line is not None and buffered:
+                lines.append(line)
+            elif line is not None:
+                logging.debug(line)
+
+        flags = []
+        if record and self.xcode.version >= SemanticVersion(major=10, minor=0):
+            flags.append('-showBuildTimingSummary')
+        command = self.command(subcommand='build', arguments=arguments, flags=flags)
         try:
-            self.check_call(subcommand='build', arguments=arguments)
-        except CalledProcessError as e:
-            logging.error('<err>Error</err>: Failed to build - result code <echo>{}</echo>'.format(e.returncode))
-            logging.error('Command: <echo>{}</echo>'.format(e.cmd))
-            logging.error(e.output)
-            exit(e.returncode)
-
+            result = self.punic.runner.run_logged(command.command, log_path, env=command.env, line_handler=line_handler)
+        finally:
+            if lines:
+                logging.debug('<sub>{} ({}):</sub>\n{}'.format(arguments.scheme, arguments.sdk, '\n'.join(lines)))
+        if record:
+            record.finish(result.return_code)
+        if result.return_code != 0:
+            raise XcodeBuildError(result.return_code, ' '.join(Runner.convert_args(command.command)), result.stdout, log_path)
+
+        # The settings of the targets just built say which of them are frameworks, no need to introspect the scheme.
         build_settings = self.build_settings(arguments=arguments)
-        scheme = self.scheme_named(arguments.scheme)
-        assert scheme
+        return [XcodeBuildProduct.build_settings(settings) for settings in build_settings.values() if _product_is_framework(settings)]
 
-        products = []
-        for target in scheme.framework_targets:
-            products.append(XcodeBuildProduct.build_settings(build_settings[target.name]))
-        return products
+    def command(self, subcommand, arguments=None, flags=None, **kwargs):
+        # type: (str, XcodeBuildArguments, [str]) -> Command
+        assert not arguments or isinstance(arguments, XcodeBuildArguments)
+        arguments = arguments.to_list() if arguments else []
+        command = ['xcodebuild', '-project' if self.path.suffix =='.xcodeproj' else '-workspace', self.path] + arguments + [subcommand] + (flags or [])
+        return self.xcode.command(command, **kwargs)
 
     def check_call(self, subcommand, arguments=None, **kwargs):
         # type: (str, XcodeBuildArguments) -> [str]
-        assert not arguments or isinstance(arguments, XcodeBuildArguments)
-        arguments = arguments.to_list() if arguments else []
-        command = ['xcodebuild', '-project' if self.path.suffix =='.xcodeproj' else '-workspace', self.path] + arguments + [subcommand]
-        return self.xcode.check_call(command, **kwargs)
+        kwargs['check'] = True
+        return self.punic.runner.run_command(self.command(subcommand, arguments=arguments, **kwargs)).stdout
 
 
 ########################################################################################################################
@@ -171,9 +344,11 @@ class Scheme(object):
 
     @mproperty
     def targets(self):
-        arguments = XcodeBuildArguments(scheme=self.name)
-        build_settings = self.project.build_settings(arguments=arguments)
-        targets = [Target(self.project, self, target_name) for target_name in build_settings.keys()]
+        target_names = self.project.reader.scheme_target_names(self.name)
+        if target_names is None:
+            arguments = XcodeBuildArguments(scheme=self.name)
+            target_names = self.project.build_settings(arguments=arguments).keys()
+        targets = [Target(self.project, self, target_name) for target_name in target_names]
         return targets
 
     @mproperty
@@ -207,9 +382,12 @@ class Target(object):
 
     @mproperty
     def build_settings(self):
-        arguments = XcodeBuildArguments(scheme=self.scheme.name)
-        build_settings = self.project.build_settings(arguments=arguments)
-        return build_settings[self.name]
+        # Only the settings punic needs to pick targets to build, read from the project files if they can be.
+        build_settings = self.project.reader.target_settings(self.scheme.name, self.name)
+        if build_settings is None:
+            arguments = XcodeBuildArguments(scheme=self.scheme.name)
+            build_settings = self.project.build_settings(arguments=arguments)[self.name]
+        return build_settings
 
     @property
     def supported_platform_names(self):
@@ -221,8 +399,12 @@ class Target(object):
 
     @property
     def product_is_framework(self):
-        mach_o_type = self.build_settings.get('MACH_O_TYPE', None)
-        return mach_o_type == 'mh_dylib' and self.package_type == 'com.apple.package-type.wrapper.framework'
+        return _product_is_framework(self.build_settings)
+
+
+def _product_is_framework(build_settings):
+    # type: (dict) -> bool
+    return build_settings.get('MACH_O_TYPE') == 'mh_dylib' and build_settings.get('PACKAGE_TYPE') == 'com.apple.package-type.wrapper.framework'
 
 ########################################################################################################################
 
@@ -308,13 +490,11 @@ class XcodeBuildProduct(object):
     def executable_path(self):
         return self.product_path / self.executable_name
 
-    @property
-    def uuids(self):
-        return uuids_from_binary(self.executable_path)
+    def uuids(self, runner):
+        return uuids_from_binary(self.executable_path, runner)
 
-    @property
-    def bcsymbolmap_paths(self):
-        paths = [self.target_build_dir / (uuid + '.bcsymbolmap') for uuid in self.uuids]
+    def bcsymbolmap_paths(self, runner):
+        paths = [self.target_build_dir / (uuid + '.bcsymbolmap') for uuid in self.uuids(runner)]
         paths = [path for path in paths if path.exists()]
         return paths
 
@@ -328,87 +508,165 @@ class XcodeBuildProduct(object):
 
 ########################################################################################################################
 
+def _format_xcodebuild_line(line):
+    """Return the interesting parts of xcodebuild's output (progress, warnings and errors), styled for logging, or None.
+
+    >>> _format_xcodebuild_line('Example.swift:1:1: error: <T> expected')
+    '<err>Example.swift:1:1: error: &lt;T&gt; expected</err>'
+    >>> _format_xcodebuild_line('    cd /tmp') is None
+    True
+    """
+    # Messages are styled as HTML and compiler output is full of angle brackets.
+    line = line.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    if line.startswith('=== BUILD ') or line.startswith('** '):
+        return '<sub>{}</sub>'.format(line)
+    elif ' error: ' in line or line.startswith('error: '):
+        return '<err>{}</err>'.format(line)
+    elif ' warning: ' in line or line.startswith('warning: '):
+        return line
+    return None
+
+
+def _parse_version(string):
+    """
+    >>> _parse_version('Xcode 8.2.1\\nBuild version 8C1002\\n')
+    8.2.1
+    """
+    match = re.match(r'^Xcode (?P<version>.+)\nBuild version (?P<build>.+)', string)
+    return SemanticVersion.string(match.groupdict()['version'])
+
+
+# The sections of xcodebuild -list output, in the order _parse_info returns them.
+_info_sections = ['Targets:', 'Build Configurations:', 'Schemes:']
+_info_default_configuration_pattern = re.compile(r'^\s+If no build configuration is specified and -scheme is not passed then "(.+)" is used.')
+
+
 def _parse_info(string):
-    lines = iter(string.splitlines())
-    targets = []
-    configurations = []
-    schemes = []
+    """Parse the output of xcodebuild -list.
+
+    >>> _parse_info('Information about project "Foo":\\n    Targets:\\n        Foo\\n        FooTests\\n\\n    Build Configurations:\\n        Debug\\n        Release\\n\\n    If no build configuration is specified and -scheme is not passed then "Release" is used.\\n\\n    Schemes:\\n        Foo\\n')
+    (['Foo', 'FooTests'], ['Debug', 'Release'], ['Foo'], 'Release')
+    """
+    sections = [[], [], []]
+    section = None
     default_configuration = None
 
-    try:
-        while True:
-            line = six.next(lines)
-            if re.match(r'^\s+Targets:$', line):
-                while True:
-                    line = six.next(lines)
-                    match = re.match(r'        (.+)', line)
-                    if not match:
-                        break
-                    else:
-                        targets.append(match.group(1))
-            if re.match(r'^\s+Build Configurations:$', line):
-                while True:
-                    line = six.next(lines)
-                    match = re.match(r'        (.+)', line)
-                    if not match:
-                        break
-                    else:
-                        configurations.append(match.group(1))
-            if re.match(r'^\s+Schemes:$', line):
-                while True:
-                    line = six.next(lines)
-                    match = re.match(r'        (.+)', line)
-                    if not match:
-                        break
-                    else:
-                        schemes.append(match.group(1))
-
-            match = re.match(r'^\s+If no build configuration is specified and -scheme is not passed then "(.+)" is used.', line)
+    for line in string.splitlines():
+        if section is not None and line.startswith('        ') and len(line) > 8:
+            section.append(line[8:])
+            continue
+        section = None
+        stripped = line.strip()
+        if stripped in _info_sections:
+            section = sections[_info_sections.index(stripped)]
+        elif stripped.startswith('If no build configuration'):
+            match = _info_default_configuration_pattern.match(line)
             if match:
                 default_configuration = match.group(1)
 
-    except StopIteration:
-        pass
-
-
+    targets, configurations, schemes = sections
     return targets, configurations, schemes, default_configuration
 
 
 ########################################################################################################################
 
-def _parse_build_settings(string):
-    # TODO : This is woefully inadequate
+# The build settings punic reads. xcodebuild reports hundreds for every target, the rest are dropped while parsing.
+build_settings_keys = frozenset(['TARGET_NAME', 'MACH_O_TYPE', 'PACKAGE_TYPE', 'SUPPORTED_PLATFORMS', 'FULL_PRODUCT_NAME', 'PRODUCT_NAME', 'EXECUTABLE_NAME', 'TARGET_BUILD_DIR', 'SDK_NAME'])
 
-    lines = iter(string.splitlines())
-    lines = (line.strip() for line in lines)
 
-    all_build_settings = list()
-    current_build_settings = dict()
+def _parse_build_settings(lines, keys=None):
+    # type: (Iterable, Iterable[str]) -> dict
+    """Parse the output of xcodebuild -showBuildSettings into settings keyed by target name.
+
+    lines can be xcodebuild's stdout: output is parsed a line at a time as it is read. Only the settings in keys (all of
+    them if None) are kept.
+
+    >>> _parse_build_settings(['Build settings for action build and target "Foo Bar":', '    MACH_O_TYPE = mh_dylib', '    TARGET_NAME = Foo Bar'])
+    {'Foo Bar': {'MACH_O_TYPE': 'mh_dylib', 'TARGET_NAME': 'Foo Bar'}}
+    """
+    keys = frozenset(key.encode('utf-8') for key in keys) if keys is not None else None
+    all_build_settings = []
+    build_settings = None
 
     for line in lines:
-        match = re.match(r'^Build settings for action (?P<action>.+) and target "?(?P<target>.+)"?:$', line)
-        if match:
-            if current_build_settings:
-                all_build_settings.append(current_build_settings)
-            current_build_settings = dict()
-            next_action, next_target = (match.groupdict()['action'], match.groupdict()['target'])
-            assert next_action == 'build'
+        if isinstance(line, six.text_type):
+            line = line.encode('utf-8')
+        if line.startswith(b'Build settings for action '):
+            build_settings = dict()
+            all_build_settings.append(build_settings)
             continue
-        match = re.match(r'^(?P<setting>.+) = (?P<value>.+)$', line)
-        if match:
-            setting = match.groupdict()["setting"]
-            value = match.groupdict()["value"]
-            current_build_settings[setting] = value
-
-    if current_build_settings:
-        all_build_settings.append(current_build_settings)
+        if build_settings is None:
+            continue
+        name, separator, value = line.strip().partition(b' = ')
+        if separator and (keys is None or name in keys):
+            build_settings[name.decode('utf-8')] = value.decode('utf-8', 'replace')
 
     return dict([(build_settings['TARGET_NAME'], build_settings) for build_settings in all_build_settings if 'TARGET_NAME' in build_settings])
 
 
+def _parse_build_settings_json(stream, keys=None):
+    # type: (file, Iterable[str]) -> dict
+    """Parse the output of xcodebuild -showBuildSettings -json into settings keyed by target name.
+
+    The output is read from stream (xcodebuild's stdout) in chunks and decoded one target at a time. Only the settings
+    in keys (all of them if None) are kept.
+
+    >>> import io
+    >>> _parse_build_settings_json(io.BytesIO(b'[{"action": "build", "target": "Foo", "buildSettings": {"MACH_O_TYPE": "mh_dylib", "SDKROOT": "macosx"}}]'), keys=['MACH_O_TYPE'])
+    {'Foo': {'MACH_O_TYPE': 'mh_dylib'}}
+    """
+    keys = frozenset(keys) if keys is not None else None
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    all_build_settings = dict()
+    buffer = ''
+
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        buffer += text.decode(chunk)
+        while True:
+            # Targets are the elements of a top level array.
+            buffer = buffer.lstrip(' \t\r\n[,]')
+            try:
+                entry, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break  # Incomplete, read some more.
+            buffer = buffer[end:]
+            if entry.get('action', 'build') != 'build':
+                continue
+            build_settings = entry['buildSettings']
+            if keys is not None:
+                build_settings = dict((key, value) for key, value in build_settings.items() if key in keys)
+            all_build_settings[entry['target']] = build_settings
+
+    if buffer.strip():
+        raise ValueError('Could not parse build settings: {!r}'.format(buffer[:80]))
+    return all_build_settings
+
+
+def _definition_paths(path, reader):
+    # type: (Path, ProjectReader) -> [Path]
+    """Return the files that define the targets, schemes and build settings of a project or workspace."""
+    paths = []
+    if path.suffix == '.xcworkspace':
+        paths.append(path / 'contents.xcworkspacedata')
+        for project_path in workspace_projects(path):
+            if project_path.exists():
+                paths += _definition_paths(project_path, reader)
+    else:
+        paths.append(path / 'project.pbxproj')
+        try:
+            paths += reader.project(path).xcconfig_paths
+        except (ValueError, KeyError, IOError) as e:
+            # xcodebuild will complain about the project, if it matters.
+            logging.debug('<sub>Can\'t read {}: {}</sub>'.format(path.name, e))
+    paths += sorted(path.glob('xcshareddata/xcschemes/*.xcscheme'))
+    paths += sorted(path.glob('xcuserdata/*.xcuserdatad/xcschemes/*.xcscheme'))
+    return [path for path in paths if path.exists()]
+
+
 ########################################################################################################################
 
-def uuids_from_binary(path):
+def uuids_from_binary(path, runner):
     command = ['/usr/bin/xcrun', 'dwarfdump', '--uuid', path]
     output = runner.check_run(command)
     lines = output.splitlines()
@@ -40,13 +40,14 @@ setup(
         'click',
         'click_didyoumean',
         'flufl.enum',
+        'futures; python_version < "3.2"',
         'jsonpath_rw',
-        'memoize',
         'networkx',
         'pathlib2',
         'prompt_toolkit',
         'pyyaml',
         'requests',
+        'scandir; python_version < "3.5"',
         'six',
         'tqdm',
         ],